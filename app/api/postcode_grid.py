@@ -0,0 +1,228 @@
+"""In-process grid index of the ONS postcode directory grid references, see NearestOnsPostcodesView
+
+Postcodes of Northern Ireland have Irish Grid references, the others British National
+Grid references, so each grid reference system has a grid of its own.
+"""
+
+import time
+
+import numpy as np
+from flask import current_app as flask_app
+
+from app.api.postcode_index import normalise_postcode, ReloadingIndex
+from app.db.models.external import ONSPostcodeDirectoryL1
+from app.etl.organisation.ons import ONSPostcodeDirectoryPipeline
+
+BRITISH_GRID = 'osgb'
+IRISH_GRID = 'osi'
+GRIDS = (BRITISH_GRID, IRISH_GRID)
+
+NORTHERN_IRELAND = 'N92000002'  # ctry of the postcodes with Irish Grid references
+
+
+class _Grid:
+    """Points bucketed into square cells of cell_size metres
+
+    The points are sorted by cell, column by column: the points of cell (x, y) are
+    offsets[x * height + y] to offsets[x * height + y + 1], so the cells y0 to y1 of
+    column x are one slice.
+    """
+
+    def __init__(self, eastings, northings, rows, cell_size):
+        """
+        Args:
+            eastings, northings: numpy arrays of the point coordinates
+            rows: numpy array of the row of each point in the postcode arrays
+        """
+        self.cell_size = cell_size
+        cell_x, cell_y = eastings // cell_size, northings // cell_size
+        self.x0 = self.y0 = self.width = self.height = 0
+        if len(eastings):
+            self.x0, self.y0 = int(cell_x.min()), int(cell_y.min())
+            self.width = int(cell_x.max()) - self.x0 + 1
+            self.height = int(cell_y.max()) - self.y0 + 1
+        cells = (cell_x - self.x0).astype(np.int64) * self.height + (cell_y - self.y0)
+        order = np.argsort(cells, kind='stable')
+        counts = np.bincount(cells, minlength=self.width * self.height)
+        self.offsets = np.zeros(len(counts) + 1, dtype=np.int32)
+        np.cumsum(counts, out=self.offsets[1:])
+        self.eastings = eastings[order].astype(np.int32)
+        self.northings = northings[order].astype(np.int32)
+        self.rows = rows[order].astype(np.int32)
+
+    @property
+    def nbytes(self):
+        return self.offsets.nbytes + self.eastings.nbytes + self.northings.nbytes + self.rows.nbytes
+
+    def nearest(self, easting, northing, limit, radius=None):
+        """The limit nearest points, within radius metres if given
+
+        The square of cells around the cell of (easting, northing) grows until it holds
+        limit points nearer than any point outside it can be.
+
+        Returns:
+            (rows, distances) numpy arrays, nearest first
+        """
+        x = int(easting // self.cell_size) - self.x0
+        y = int(northing // self.cell_size) - self.y0
+        # rings covering the whole grid
+        max_ring = max(x, self.width - 1 - x, y, self.height - 1 - y, 0)
+        if radius is not None:
+            max_ring = min(max_ring, int(radius // self.cell_size) + 1)
+        # the first ring reaching the grid, for points outside of it
+        ring = min(max(-x, x - self.width + 1, -y, y - self.height + 1, 0), max_ring)
+        while True:
+            points = self._square(x, y, ring)
+            distances = np.hypot(
+                self.eastings[points] - float(easting), self.northings[points] - float(northing)
+            )
+            if radius is not None:
+                within = distances <= radius
+                points, distances = points[within], distances[within]
+            if ring >= max_ring:
+                break
+            if len(points) >= limit:
+                furthest = np.partition(distances, limit - 1)[limit - 1]
+                # the points outside the square are at least ring cells away
+                if furthest <= ring * self.cell_size:
+                    break
+                # the square of this ring holds the points up to furthest away
+                ring = int(furthest // self.cell_size) + 1
+            else:
+                ring = max(ring * 2, ring + 1)
+            ring = min(ring, max_ring)
+        rows = self.rows[points]
+        nearest = np.lexsort((rows, distances))[:limit]
+        return rows[nearest], distances[nearest]
+
+    def _square(self, x, y, ring):
+        """Indexes of the points in the cells at most ring cells from cell (x, y)"""
+        x_from, x_to = max(x - ring, 0), min(x + ring, self.width - 1)
+        y_from, y_to = max(y - ring, 0), min(y + ring, self.height - 1)
+        if x_from > x_to or y_from > y_to:
+            return np.zeros(0, dtype=np.int64)
+        slices = [
+            np.arange(
+                self.offsets[column * self.height + y_from],
+                self.offsets[column * self.height + y_to + 1],
+            )
+            for column in range(x_from, x_to + 1)
+        ]
+        return np.concatenate(slices)
+
+
+class PostcodeGrid(ReloadingIndex):
+    """Grid references of the live postcodes, searchable by distance
+
+    The latest row of every postcode is indexed, the row of L1.current when the
+    pipeline runs in delta mode. Terminated postcodes and postcodes without a grid
+    reference are left out.
+
+    The postcodes are sorted by normalised postcode, and located with searchsorted like
+    in PostcodeIndex. The grids hold the rows of their postcodes in those arrays. Query
+    time depends on how many postcodes are near the queried point, not on the number
+    of postcodes.
+    """
+
+    source = ONSPostcodeDirectoryPipeline.id
+    columns = ['pcds', 'easting', 'northing', 'distance']
+
+    CELL_SIZE = 1000  # metres
+
+    def __init__(self, reload_check_seconds=None, cell_size=CELL_SIZE):
+        super().__init__(reload_check_seconds)
+        self.cell_size = cell_size
+        self._keys = None
+        self._postcodes = None
+        self._eastings = None
+        self._northings = None
+        self._irish = None
+        self._grids = None
+
+    def locate(self, postcode):
+        """Returns (grid, easting, northing) of a postcode, or None if it is not indexed"""
+        self._refresh()
+        key = normalise_postcode(postcode).encode()
+        keys = self._keys
+        if len(key) > keys.dtype.itemsize:
+            return None
+        i = np.searchsorted(keys, key)
+        if i == len(keys) or keys[i] != key:
+            return None
+        grid = IRISH_GRID if self._irish[i] else BRITISH_GRID
+        return grid, int(self._eastings[i]), int(self._northings[i])
+
+    def nearest(self, easting, northing, limit, radius=None, grid=BRITISH_GRID):
+        """The limit postcodes nearest to a grid reference, within radius metres if given
+
+        Returns:
+            list of (pcds, easting, northing, distance in metres), nearest first
+        """
+        self._refresh()
+        rows, distances = self._grids[grid].nearest(easting, northing, limit, radius)
+        return [
+            (
+                self._postcodes[row].decode(),
+                int(self._eastings[row]),
+                int(self._northings[row]),
+                round(float(distance), 1),
+            )
+            for row, distance in zip(rows, distances)
+        ]
+
+    @property
+    def nbytes(self):
+        """Memory used by the index, None until it is loaded"""
+        if self._keys is None:
+            return None
+        arrays = (self._keys, self._postcodes, self._eastings, self._northings, self._irish)
+        return sum(a.nbytes for a in arrays) + sum(g.nbytes for g in self._grids.values())
+
+    def __len__(self):
+        return 0 if self._keys is None else len(self._keys)
+
+    def _load(self):
+        started = time.monotonic()
+        l1_table = ONSPostcodeDirectoryL1.get_fq_table_name()
+        schema = ONSPostcodeDirectoryPipeline.schema
+        current_table = ONSPostcodeDirectoryPipeline.CURRENT_TABLE
+        if flask_app.dbi.table_exists(schema, current_table):
+            latest = f'''
+                select l.pcds, l.easting, l.northing, l.doterm, l.ctry
+                from {l1_table} l join "{schema}"."{current_table}" c on c.id = l.id
+            '''
+        else:
+            latest = f'''
+                select distinct on (pcds) pcds, easting, northing, doterm, ctry
+                from {l1_table}
+                order by pcds, id desc
+            '''
+        sql_query = f'''
+            select pcds, easting, northing, ctry
+            from ({latest}) latest
+            where doterm is null and easting is not null and northing is not null
+        '''
+        df = flask_app.dbi.execute_query(sql_query, df=True)
+        keys = np.array([normalise_postcode(p).encode() for p in df['pcds']], dtype=bytes)
+        order = np.argsort(keys, kind='stable')
+        postcodes = np.array([p.encode() for p in df['pcds']], dtype=bytes)[order]
+        eastings = df['easting'].to_numpy(dtype=np.int32)[order]
+        northings = df['northing'].to_numpy(dtype=np.int32)[order]
+        irish = (df['ctry'] == NORTHERN_IRELAND).to_numpy()[order]
+        grids = {
+            grid: _Grid(eastings[rows], northings[rows], rows, self.cell_size)
+            for grid, rows in (
+                (BRITISH_GRID, np.flatnonzero(~irish)),
+                (IRISH_GRID, np.flatnonzero(irish)),
+            )
+        }
+        self._keys, self._postcodes, self._irish = keys[order], postcodes, irish
+        self._eastings, self._northings, self._grids = eastings, northings, grids
+        flask_app.logger.info(
+            f'postcode grid loaded: {len(keys)} postcodes, '
+            f'{self.nbytes / 2 ** 20:.1f} MB, {time.monotonic() - started:.1f}s'
+        )
+
+
+# one grid per worker process
+postcode_grid = PostcodeGrid()
@@ -0,0 +1,203 @@
+"""In-process indexes of postcode data, see DitReferencePostcodeView and PostcodeGrid
+
+Each worker process loads an index from L1 on its first lookup and reloads it once a
+datafile of the indexed pipeline has been processed since.
+"""
+
+import sys
+import threading
+import time
+from abc import ABCMeta, abstractmethod
+
+import numpy as np
+import pandas as pd
+from flask import current_app as flask_app
+
+from app.db.models.external import DITReferencePostcodesL1
+from app.db.models.internal import DatafileRegistryModel
+from app.etl.organisation.dit import DITReferencePostcodesPipeline
+
+
+def normalise_postcode(postcode):
+    """The postcode_normalised value of a postcode (see DITReferencePostcodesPipeline)"""
+    return postcode.replace(' ', '').lower()
+
+
+def _codes_dtype(num_values):
+    for dtype in (np.int8, np.int16, np.int32):
+        if num_values < np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+class _DictionaryColumn:
+    """Column of few distinct values, values[codes[i]] is the value of row i
+
+    NULLs are coded -1, which indexes the None at the end of values.
+    """
+
+    def __init__(self, codes, uniques):
+        self.values = list(uniques) + [None]
+        self.codes = codes.astype(_codes_dtype(len(self.values)))
+
+    def __getitem__(self, row):
+        return self.values[self.codes[row]]
+
+    @property
+    def nbytes(self):
+        return (
+            self.codes.nbytes
+            + sys.getsizeof(self.values)
+            + sum(sys.getsizeof(v) for v in self.values)
+        )
+
+
+class _PackedColumn:
+    """Column of many distinct strings, packed into one UTF-8 buffer
+
+    The value of row i is data[offsets[i]:offsets[i + 1]], or None where nulls[i].
+    """
+
+    def __init__(self, series):
+        self.nulls = series.isna().to_numpy()
+        encoded = [b'' if null else v.encode() for v, null in zip(series, self.nulls)]
+        self.data = b''.join(encoded)
+        dtype = np.int32 if len(self.data) < np.iinfo(np.int32).max else np.int64
+        self.offsets = np.zeros(len(encoded) + 1, dtype=dtype)
+        np.cumsum([len(e) for e in encoded], out=self.offsets[1:])
+
+    def __getitem__(self, row):
+        if self.nulls[row]:
+            return None
+        return self.data[self.offsets[row] : self.offsets[row + 1]].decode()
+
+    @property
+    def nbytes(self):
+        return self.nulls.nbytes + self.offsets.nbytes + sys.getsizeof(self.data)
+
+
+def _column(series):
+    codes, uniques = pd.factorize(series, use_na_sentinel=True)
+    if len(uniques) > np.iinfo(np.int16).max and all(isinstance(v, str) for v in uniques):
+        return _PackedColumn(series)
+    return _DictionaryColumn(codes, uniques)
+
+
+class ReloadingIndex(metaclass=ABCMeta):
+    """In-process index of the L1 data of a pipeline, reloaded once a datafile is processed
+
+    Lookups check whether a datafile of the pipeline was processed since the index was
+    loaded at most every reload_check_seconds. A reload happens in the thread of the
+    lookup that noticed it, the other threads keep using the loaded index meanwhile.
+    """
+
+    source = None  # id of the pipeline whose L1 table is indexed
+
+    def __init__(self, reload_check_seconds=None):
+        """
+        Args:
+            reload_check_seconds: the postcode_index_reload_check_seconds app config value
+                by default
+        """
+        self._reload_check_seconds = reload_check_seconds
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked = None
+
+    @property
+    def reload_check_seconds(self):
+        if self._reload_check_seconds is not None:
+            return self._reload_check_seconds
+        return flask_app.config['app'].get('postcode_index_reload_check_seconds', 60)
+
+    def _refresh(self):
+        now = time.monotonic()
+        if self._checked is not None and now - self._checked < self.reload_check_seconds:
+            return
+        # while another thread reloads, keep using the loaded index
+        if not self._lock.acquire(blocking=self._checked is None):
+            return
+        try:
+            if self._checked is not None and now - self._checked < self.reload_check_seconds:
+                return
+            version = DatafileRegistryModel.get_last_processed_timestamp(self.source)
+            if self._checked is None or version != self._version:
+                self._load()
+                self._version = version
+            self._checked = time.monotonic()
+        finally:
+            self._lock.release()
+
+    @abstractmethod
+    def _load(self):
+        """Loads the index from L1"""
+        ...
+
+
+class PostcodeIndex(ReloadingIndex):
+    """Sorted array of normalised postcodes and a columnar store of their L1 data columns
+
+    The postcodes are a numpy array of fixed width byte strings searched with
+    searchsorted, rows[i] is the row of postcodes[i] in the columns. Columns of few
+    distinct values are dictionary encoded, the others packed into a buffer. Where L1 has
+    several rows of a postcode, the row with the highest id is kept.
+    """
+
+    source = DITReferencePostcodesPipeline.id
+    columns = [c for c, _ in DITReferencePostcodesPipeline._l1_data_column_types]
+
+    def __init__(self, reload_check_seconds=None):
+        super().__init__(reload_check_seconds)
+        self._postcodes = None
+        self._rows = None
+        self._columns = None
+
+    def get(self, postcode):
+        """Returns the data column values of a postcode as a tuple, or None if unknown"""
+        self._refresh()
+        key = normalise_postcode(postcode).encode()
+        postcodes = self._postcodes
+        if len(key) > postcodes.dtype.itemsize:
+            return None
+        i = np.searchsorted(postcodes, key)
+        if i == len(postcodes) or postcodes[i] != key:
+            return None
+        row = self._rows[i]
+        return tuple(column[row] for column in self._columns)
+
+    @property
+    def nbytes(self):
+        """Memory used by the index, None until it is loaded"""
+        if self._postcodes is None:
+            return None
+        return (
+            self._postcodes.nbytes
+            + self._rows.nbytes
+            + sum(column.nbytes for column in self._columns)
+        )
+
+    def __len__(self):
+        return 0 if self._postcodes is None else len(self._postcodes)
+
+    def _load(self):
+        started = time.monotonic()
+        sql_query = f'''
+            select postcode_normalised, {','.join(self.columns)}
+            from {DITReferencePostcodesL1.get_fq_table_name()}
+            where postcode_normalised is not null
+            order by id desc
+        '''
+        df = flask_app.dbi.execute_query(sql_query, df=True)
+        keys = np.array([k.encode() for k in df['postcode_normalised']], dtype=bytes)
+        # the first of equal keys, the row with the highest id
+        postcodes, rows = np.unique(keys, return_index=True)
+        columns = [_column(df[c]) for c in self.columns]
+        self._postcodes, self._rows, self._columns = postcodes, rows.astype(np.int32), columns
+        flask_app.logger.info(
+            f'postcode index loaded: {len(postcodes)} postcodes, '
+            f'{self.nbytes / 2 ** 20:.1f} MB, {time.monotonic() - started:.1f}s'
+        )
+
+
+# one index per worker process
+postcode_index = PostcodeIndex()
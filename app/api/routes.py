@@ -24,7 +24,17 @@ RULES = [
         '/api/v1/get-dit-reference-postcode/',
         dit_reference_postcodes.DitReferencePostcodeView.as_view('dit_reference_postcode2'),
     ),
+    (
+        '/api/v1/get-postcode-data/batch/',
+        dit_reference_postcodes.DitReferencePostcodeBatchView.as_view(
+            'dit_reference_postcodes_batch'
+        ),
+    ),
     ('/api/v1/get-ons-postcodes/', ons_postcodes.OnsPostcodeListView.as_view('list_ons_postcodes')),
+    (
+        '/api/v1/get-ons-postcodes/nearest/',
+        ons_postcodes.NearestOnsPostcodesView.as_view('nearest_ons_postcodes'),
+    ),
     (
         '/api/v1/get-world-bank-tariffs/',
         world_bank_tariffs.WorldBankTariffTransformListView.as_view('list_world_bank_tariff'),
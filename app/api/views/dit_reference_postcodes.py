@@ -1,10 +1,15 @@
+import csv
+import io
+
+import pandas as pd
 from data_engineering.common.api.utils import to_web_dict
 from data_engineering.common.views import ac, json_error
 from flask import current_app as flask_app
-from flask import request
+from flask import request, Response, stream_with_context
 from flask.views import View
 from werkzeug.exceptions import BadRequest
 
+from app.api.postcode_index import normalise_postcode, postcode_index
 from app.api.views.base import PipelinePaginatedListView
 from app.db.models.external import DITReferencePostcodesL1
 from app.etl.organisation.dit import DITReferencePostcodesPipeline
@@ -27,15 +32,126 @@ class DitReferencePostcodeView(View):
         postcode = request.args.get('postcode')
         if not postcode:
             raise BadRequest('No postcode specified')
-        postcode = postcode.replace(' ', '').lower()
+        postcode = normalise_postcode(postcode)
+        if flask_app.config['app'].get('postcode_index') and orientation == 'tabular':
+            return self._index_response(postcode)
         sql_query = f'''
             select {','.join(
                 [field for field, _ in DITReferencePostcodesPipeline._l1_data_column_types]
             )}
             from {DITReferencePostcodesL1.get_fq_table_name()}
-            where lower(replace(postcode, ' ', '')) = :postcode
+            where postcode_normalised = :postcode
+            order by id desc
             limit 1
         '''
         df = flask_app.dbi.execute_query(sql_query, data={'postcode': postcode}, df=True)
         web_dict = to_web_dict(df, orientation)
         return flask_app.make_response(web_dict)
+
+    def _index_response(self, postcode):
+        """Looks postcode up in the in-process index
+
+        The row goes through to_web_dict like the rows of the database, so that values
+        such as the dates are serialised the same way.
+        """
+        row = postcode_index.get(postcode)
+        df = pd.DataFrame([row] if row is not None else [], columns=postcode_index.columns)
+        web_dict = to_web_dict(df, 'tabular')
+        return flask_app.make_response(web_dict)
+
+
+class DitReferencePostcodeBatchView(View):
+    """Looks up a batch of postcodes in one query
+
+    The postcodes are posted as a JSON list (or an object with a postcodes list) or as
+    CSV with the postcodes in the first column and an optional postcode header. The
+    results are streamed in the same format, one row per posted postcode in the posted
+    order, starting with the posted postcode and whether it was found. The data columns
+    of unknown postcodes are null.
+    """
+
+    methods = ['POST']
+    decorators = [json_error, ac.authentication_required, ac.authorization_required]
+
+    columns = [field for field, _ in DITReferencePostcodesPipeline._l1_data_column_types]
+    headers = ['query', 'found'] + columns
+
+    def dispatch_request(self):
+        is_csv = request.mimetype == 'text/csv'
+        postcodes = self._csv_postcodes() if is_csv else self._json_postcodes()
+        max_size = flask_app.config['app'].get('postcode_batch_max_size', 10000)
+        if not postcodes:
+            raise BadRequest('No postcodes specified')
+        if len(postcodes) > max_size:
+            raise BadRequest(f'More than {max_size} postcodes specified')
+
+        normalised = [normalise_postcode(p) for p in postcodes]
+        rows = self._lookup(set(normalised))
+        unknown = (None,) * len(self.columns)
+        results = (
+            [postcode, key in rows, *rows.get(key, unknown)]
+            for postcode, key in zip(postcodes, normalised)
+        )
+        if is_csv:
+            return Response(stream_with_context(self._csv_lines(results)), mimetype='text/csv')
+        return Response(
+            stream_with_context(self._json_chunks(results)), mimetype='application/json'
+        )
+
+    @staticmethod
+    def _json_postcodes():
+        data = request.get_json(silent=True)
+        if isinstance(data, dict):
+            data = data.get('postcodes')
+        if not isinstance(data, list) or not all(isinstance(p, str) for p in data):
+            raise BadRequest('Expected a JSON list of postcodes')
+        return data
+
+    @staticmethod
+    def _csv_postcodes():
+        reader = csv.reader(io.StringIO(request.get_data(as_text=True)))
+        postcodes = [row[0] for row in reader if row]
+        if postcodes and postcodes[0].strip().lower() == 'postcode':
+            postcodes = postcodes[1:]
+        return postcodes
+
+    def _lookup(self, postcodes):
+        """Returns {normalised postcode: data column values} of the known postcodes
+
+        The values are converted with to_web_dict, so that values such as the dates are
+        serialised like the values of DitReferencePostcodeView.
+        """
+        if flask_app.config['app'].get('postcode_index'):
+            rows = ((p, postcode_index.get(p)) for p in postcodes)
+            return self._web_values({p: row for p, row in rows if row is not None})
+        # the row with the highest id, as in the postcode index
+        sql_query = f'''
+            select distinct on (postcode_normalised) postcode_normalised, {','.join(self.columns)}
+            from {DITReferencePostcodesL1.get_fq_table_name()}
+            where postcode_normalised = any(:postcodes)
+            order by postcode_normalised, id desc
+        '''
+        rows = flask_app.dbi.execute_query(sql_query, data={'postcodes': list(postcodes)})
+        return self._web_values({row[0]: tuple(row[1:]) for row in rows})
+
+    def _web_values(self, rows):
+        keys = list(rows)
+        df = pd.DataFrame([rows[key] for key in keys], columns=self.columns)
+        values = to_web_dict(df, 'tabular')['values']
+        return {key: tuple(value) for key, value in zip(keys, values)}
+
+    def _json_chunks(self, results):
+        yield f'{{"headers": {flask_app.json.dumps(self.headers)}, "values": ['
+        for i, result in enumerate(results):
+            yield (',' if i else '') + flask_app.json.dumps(result)
+        yield ']}'
+
+    def _csv_lines(self, results):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        writer.writerow(self.headers)
+        for result in results:
+            writer.writerow(result)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
@@ -1,3 +1,12 @@
+import math
+
+from data_engineering.common.views import ac, json_error
+from flask import current_app as flask_app
+from flask import request
+from flask.views import View
+from werkzeug.exceptions import BadRequest
+
+from app.api.postcode_grid import BRITISH_GRID, GRIDS, postcode_grid
 from app.api.views.base import PipelinePaginatedListView
 from app.db.models.external import ONSPostcodeDirectoryL1
 from app.etl.organisation.ons import ONSPostcodeDirectoryPipeline
@@ -8,3 +17,59 @@ class OnsPostcodeListView(PipelinePaginatedListView):
     model = ONSPostcodeDirectoryL1
     camel_case_columns = False
     include_id_column = True
+
+
+class NearestOnsPostcodesView(View):
+    """The postcodes nearest to a postcode or a grid reference, nearest first
+
+    Query parameters: postcode, or easting and northing with an optional grid (osgb, the
+    default, or osi for Irish Grid references of Northern Ireland), limit (default 10)
+    and radius in metres. A postcode is the nearest to itself. Unknown postcodes have no
+    nearest postcodes.
+    """
+
+    decorators = [json_error, ac.authentication_required, ac.authorization_required]
+
+    # extent of the British National Grid, which covers the Irish Grid's
+    MAX_EASTING = 700000
+    MAX_NORTHING = 1300000
+
+    def dispatch_request(self):
+        max_limit = flask_app.config['app'].get('nearest_postcodes_max_limit', 1000)
+        limit = self._number_arg('limit', int, 10)
+        radius = self._number_arg('radius', float)
+        if not 1 <= limit <= max_limit:
+            raise BadRequest(f'limit must be between 1 and {max_limit}')
+        if radius is not None and not (math.isfinite(radius) and radius >= 0):
+            raise BadRequest('radius must be a positive number of metres')
+
+        postcode = request.args.get('postcode')
+        if postcode:
+            location = postcode_grid.locate(postcode)
+        else:
+            easting = self._number_arg('easting', int)
+            northing = self._number_arg('northing', int)
+            if easting is None or northing is None:
+                raise BadRequest('No postcode or easting and northing specified')
+            if not (0 <= easting <= self.MAX_EASTING and 0 <= northing <= self.MAX_NORTHING):
+                raise BadRequest('easting or northing out of the grid')
+            grid = request.args.get('grid', BRITISH_GRID)
+            if grid not in GRIDS:
+                raise BadRequest(f"grid must be one of {', '.join(GRIDS)}")
+            location = grid, easting, northing
+        values = []
+        if location is not None:
+            grid, easting, northing = location
+            values = postcode_grid.nearest(easting, northing, limit, radius, grid)
+        web_dict = {'headers': postcode_grid.columns, 'values': [list(v) for v in values]}
+        return flask_app.make_response(web_dict)
+
+    @staticmethod
+    def _number_arg(name, type_, default=None):
+        value = request.args.get(name)
+        if value is None:
+            return default
+        try:
+            return type_(value)
+        except ValueError:
+            raise BadRequest(f'{name} must be a number')
@@ -1,6 +1,7 @@
 from flask.cli import AppGroup
 
 from app.commands.dev.add_hawk_user import add_hawk_user as add_hawk_user_command
+from app.commands.dev.benchmark import benchmark as benchmark_command
 from app.commands.dev.datafiles_to_db_by_source import (
     datafiles_to_db_by_source as datafiles_command,
 )
@@ -14,6 +15,7 @@ from app.commands.dev.spire import populate_spire_schema as populate_spire_schem
 cmd_group = AppGroup('dev', help='Commands to build database')
 
 cmd_group.add_command(add_hawk_user_command)
+cmd_group.add_command(benchmark_command)
 cmd_group.add_command(datafiles_command)
 cmd_group.add_command(datafiles_to_s3_by_source)
 cmd_group.add_command(db_command)
@@ -0,0 +1,83 @@
+import json
+import os
+
+import click
+from flask.cli import with_appcontext
+
+from benchmarks.runner import BENCHMARKS, compare_with_baseline, run_benchmarks
+
+DEFAULT_BASELINE = 'benchmarks/baseline.json'
+
+
+def _parse_pipeline_options(pipeline_options):
+    """Parses key=value strings, values are parsed as JSON where possible"""
+    options = {}
+    for pipeline_option in pipeline_options:
+        key, _, value = pipeline_option.partition('=')
+        try:
+            options[key] = json.loads(value)
+        except ValueError:
+            options[key] = value
+    return options
+
+
+@click.command('benchmark')
+@with_appcontext
+@click.option(
+    '--only',
+    type=click.Choice(list(BENCHMARKS)),
+    multiple=True,
+    help='Only run this benchmark, can be repeated',
+)
+@click.option('--size', type=int, default=100000, help='Number of records to generate')
+@click.option('--seed', type=int, default=0, help='Seed of the data generators')
+@click.option(
+    '--pipeline-option',
+    multiple=True,
+    help='key=value option passed to the pipelines, e.g. parallel_copy_workers=4',
+)
+@click.option('--baseline', default=DEFAULT_BASELINE, help='Baseline results file')
+@click.option('--save-baseline', is_flag=True, help='Save the results as the baseline')
+@click.option(
+    '--tolerance',
+    type=float,
+    default=0.1,
+    help='Relative change from the baseline reported as a regression',
+)
+@click.confirmation_option(
+    prompt='Benchmarks load data into the configured database, run them against a local '
+    'database only. Continue?'
+)
+def benchmark(only, size, seed, pipeline_option, baseline, save_baseline, tolerance):
+    """
+    Measure pipeline throughput on synthetic datafiles
+    """
+    options = _parse_pipeline_options(pipeline_option)
+    results = run_benchmarks(only or list(BENCHMARKS), size, seed, **options)
+    for result in results:
+        stages = ', '.join(f'{stage} {duration:.2f}s' for stage, duration in result.stages.items())
+        click.echo(
+            f'{result.name}: {result.records_per_second:,.0f} records/s, '
+            f'{result.mb_per_second:.2f} MB/s, {result.duration:.2f}s, '
+            f'peak RSS {result.peak_rss / 2 ** 20:.0f} MB ({stages})'
+        )
+
+    if os.path.exists(baseline):
+        with open(baseline) as f:
+            baseline_results = json.load(f)
+        regressions = compare_with_baseline(results, baseline_results, tolerance)
+        for regression in regressions:
+            click.echo(
+                f'REGRESSION {regression.name} {regression.metric}: '
+                f'{regression.value:,.2f} (baseline {regression.baseline:,.2f})'
+            )
+        if not regressions:
+            click.echo(f'no regressions from {baseline}')
+    else:
+        baseline_results = {}
+
+    if save_baseline:
+        baseline_results.update({result.name: result._asdict() for result in results})
+        with open(baseline, 'w') as f:
+            json.dump(baseline_results, f, indent=2, sort_keys=True)
+        click.echo(f'baseline saved to {baseline}')
@@ -47,6 +47,7 @@ from app.etl.organisation.world_bank import (
     WorldBankTariffPipeline,
     WorldBankTariffTransformPipeline,
 )
+from app.etl.work_queue import redis_from_config, WorkQueue
 
 arg_to_pipeline_config_list = {
     # format:  {'command option': [(pipeline, dataset subdir, options)]}
@@ -98,14 +99,14 @@ arg_to_pipeline_config_list = {
         (
             CompaniesHouseAccountsPipeline,
             'companies_house/accounts_legacy/',
-            {'unpack': False, 'trigger_dataflow_dag': True},
+            {'unpack': False, 'trigger_dataflow_dag': True, 'incremental_listing': True},
         ),
     ],
     HMRCExportersPipeline.data_source: [
         (
             HMRCExportersPipeline,
             'hmrc/exporters/',
-            {'unpack': False, 'trigger_dataflow_dag': True},
+            {'unpack': False, 'trigger_dataflow_dag': True, 'incremental_listing': True},
         )
     ],
 }
@@ -127,6 +128,85 @@ arg_to_pipeline_config_list = {
     help='Only process selected products [World bank tariff ' 'pipelines only]',
     default=None,
 )
+@click.option(
+    '--parallel-copy-workers',
+    type=int,
+    help='Split large delimited datafiles and copy them using this many connections',
+    default=None,
+)
+@click.option(
+    '--parse-workers',
+    type=int,
+    help='Parse Companies House accounts documents and HMRC months in this many processes',
+    default=None,
+)
+@click.option(
+    '--max-rejected-rows',
+    type=int,
+    help='Load datafiles with up to this many bad rows, which are written to L0.rejects',
+    default=None,
+)
+@click.option(
+    '--unlogged-staging-tables',
+    is_flag=True,
+    help='Create staging tables as UNLOGGED tables and log the WAL saved',
+)
+@click.option(
+    '--deferred-index-ratio',
+    type=float,
+    help='Rebuild indexes after appending a batch of at least this ratio of the table size',
+    default=None,
+)
+@click.option(
+    '--l0-to-l1-chunk-size',
+    type=int,
+    help='Transform L0 into L1 in committed chunks of this many ids, resuming after a crash',
+    default=None,
+)
+@click.option(
+    '--delta',
+    is_flag=True,
+    help='Only load new, changed or terminated postcodes [ONS postcode directory only]',
+)
+@click.option(
+    '--workers',
+    type=int,
+    help='Run independent pipelines concurrently in this many processes',
+    default=None,
+)
+@click.option(
+    '--prefetch-files',
+    type=int,
+    help='Download this many datafiles ahead of the one being loaded',
+    default=None,
+)
+@click.option(
+    '--prefetch-max-mb',
+    type=int,
+    help='Pause prefetching while the downloaded datafiles take up this many MB',
+    default=None,
+)
+@click.option(
+    '--relist',
+    is_flag=True,
+    help='List all datafiles of sources that are otherwise listed incrementally',
+)
+@click.option(
+    '--enqueue',
+    is_flag=True,
+    help='Queue the datafiles to process in the Redis work queue instead of processing them',
+)
+@click.option(
+    '--work',
+    is_flag=True,
+    help='Process datafiles from the Redis work queue until it is empty',
+)
+@click.option(
+    '--lease-seconds',
+    type=int,
+    help='Requeue work items whose worker did not renew its lease for this many seconds',
+    default=None,
+)
 def datafiles_to_db_by_source(**kwargs):
     """
     Populate tables with source files
@@ -136,7 +216,14 @@ def datafiles_to_db_by_source(**kwargs):
         ctx = click.get_current_context()
         click.echo(ctx.get_help())
     else:
-        manager = PipelineManager(storage=get_source_folder(), dbi=app.dbi)
+        prefetch_max_mb = kwargs['prefetch_max_mb']
+        manager = PipelineManager(
+            storage=get_source_folder(),
+            dbi=app.dbi,
+            prefetch_files=kwargs['prefetch_files'] or 0,
+            prefetch_max_bytes=prefetch_max_mb * 2**20 if prefetch_max_mb else None,
+            relist=kwargs['relist'],
+        )
         for _arg, pipeline_info_list in arg_to_pipeline_config_list.items():
             arg = _arg.replace(".", "__")
             if kwargs['all'] or kwargs[arg]:
@@ -149,9 +236,26 @@ def datafiles_to_db_by_source(**kwargs):
                             force=kwargs['force'],
                             continue_transform=kwargs['continue'],
                             products=kwargs['products'],
+                            parallel_copy_workers=kwargs['parallel_copy_workers'] or 1,
+                            parse_workers=kwargs['parse_workers'] or 1,
+                            max_rejected_rows=kwargs['max_rejected_rows'],
+                            unlogged_staging_tables=kwargs['unlogged_staging_tables'],
+                            deferred_index_ratio=kwargs['deferred_index_ratio'],
+                            l0_to_l1_chunk_size=kwargs['l0_to_l1_chunk_size'],
+                            delta=kwargs['delta'],
                             **options,
                         )
-        manager.pipeline_process_all()
+        if kwargs['enqueue'] or kwargs['work']:
+            work_queue = WorkQueue(
+                redis_from_config(app.config['cache']), lease_seconds=kwargs['lease_seconds'] or 300
+            )
+            if kwargs['enqueue']:
+                queued = manager.pipeline_enqueue_all(work_queue)
+                click.echo(f'{queued} work items queued')
+            if kwargs['work']:
+                manager.pipeline_work(work_queue)
+        else:
+            manager.pipeline_process_all(workers=kwargs['workers'] or 1)
 
 
 def _pipeline_option(option_name):
@@ -5,6 +5,7 @@ from datatools.io.storage import S3Storage
 from flask import current_app as app
 from flask.cli import with_appcontext
 
+from app.downloader.listing import IncrementallyListedStorage
 from app.downloader.manager import Manager as DownloadManager
 from app.downloader.web.companies_house import CompaniesHouseAccounts
 from app.downloader.web.hmrc import HMRCExporters
@@ -19,6 +20,11 @@ arg_to_downloader_info_list = {
 
 @click.command('datafiles_to_s3_by_source')
 @click.option('--all', is_flag=True, help='download all data sources to s3')
+@click.option(
+    '--relist',
+    is_flag=True,
+    help='List all stored files of sources that are otherwise listed incrementally',
+)
 @with_appcontext
 def datafiles_to_s3_by_source(**kwargs):
     """
@@ -37,6 +43,8 @@ def datafiles_to_s3_by_source(**kwargs):
                 sub_path = info_list[1]
                 path = os.path.join(bucket, app.config['s3']['datasets_folder'], sub_path)
                 storage = S3Storage(path)
+                if downloader.incremental_listing:
+                    storage = IncrementallyListedStorage(storage, path, relist=kwargs['relist'])
                 manager.register(downloader(storage))
         manager.update_datasources()
 
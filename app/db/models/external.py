@@ -38,6 +38,8 @@ class ONSPostcodeDirectoryL1(BaseModel):
 
     id = _col(_int, primary_key=True, autoincrement=True)
     data_source_row_id = _col(_int, unique=True)
+    easting = _col(_int)  # oseast1m as an integer, NULL without a grid reference
+    northing = _col(_int)  # osnrth1m as an integer, NULL without a grid reference
     pcd = _col(_text)  # Postcode XXX[space]YYY or XXXYYYY
     pcd2 = _col(_text)  # Postcode XXX[space][space]YYY or XXX[space]YYYY
     pcds = _col(_text, index=True)  # Postcode XXX[space]YYY[space] or XXX[space]YYYY
@@ -103,6 +105,7 @@ class DITReferencePostcodesL1(BaseModel):
 
     id = _col(_int, primary_key=True, autoincrement=True)
     data_source_row_id = _col(_int, unique=True)
+    postcode_normalised = _col(_text, index=True)  # lower case postcode without spaces
     postcode = _col(_text)
     local_authority_district_code = _col(_text)
     local_authority_district_name = _col(_text)
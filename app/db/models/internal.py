@@ -29,7 +29,11 @@ from app.constants import (
 
 class DatafileRegistryModel(BaseModel):
     __tablename__ = 'datafile_registry'
-    __table_args__ = {'schema': 'operations'}
+    __table_args__ = (
+        _sa.Index('datafile_registry_source_file_name_idx', 'source', 'file_name', unique=True),
+        _sa.Index('datafile_registry_source_content_digest_idx', 'source', 'content_digest'),
+        {'schema': 'operations'},
+    )
 
     processing_state = _enum(*DatafileState.values(), name='processing_state', inherit_schema=True)
 
@@ -38,17 +42,27 @@ class DatafileRegistryModel(BaseModel):
     file_name = _col(_text)
     state = _col(processing_state, nullable=False, default=False)
     error_message = _col(_text)
+    content_digest = _col(_text)  # sha256 hex digest as fetched, or etag:<ETag> in S3
+    size = _col(_sa.BigInteger)  # bytes
+    checkpoint = _col(_sa.JSON)  # progress of an unfinished run, see DataPipeline.save_checkpoint
     created_timestamp = _col(
         'created_timestamp', _dt, nullable=False, default=lambda: datetime.datetime.utcnow()
     )
     updated_timestamp = _col('updated_timestamp', _dt, onupdate=lambda: datetime.datetime.utcnow())
 
     @classmethod
-    def get_update_or_create(cls, source, file_name, state=None, error_message=None):
+    def get_update_or_create(
+        cls, source, file_name, state=None, error_message=None, content_digest=None, size=None
+    ):
         if not file_name:
             # always create new row if file_name is empty
             instance = DatafileRegistryModel(
-                source=source, file_name=file_name, state=state, error_message=error_message
+                source=source,
+                file_name=file_name,
+                state=state,
+                error_message=error_message,
+                content_digest=content_digest,
+                size=size,
             )
             instance.save()
             return instance, True
@@ -57,6 +71,8 @@ class DatafileRegistryModel(BaseModel):
         defaults = {
             'state': state,
             'error_message': error_message,
+            'content_digest': content_digest,
+            'size': size,
         }
         clean_datafile, created = DatafileRegistryModel.get_or_create(
             source=source,
@@ -64,16 +80,67 @@ class DatafileRegistryModel(BaseModel):
             defaults=defaults,
         )
         if not created:
-            update_state = state is not None
-            update_error_message = error_message is not None
-            if update_state:
-                clean_datafile.state = state
-            if update_error_message:
-                clean_datafile.error_message = error_message
-            if update_state or update_error_message:
+            updated = False
+            for field, value in defaults.items():
+                if value is not None:
+                    setattr(clean_datafile, field, value)
+                    updated = True
+            if updated:
                 clean_datafile.save()
         return clean_datafile, created
 
+    @classmethod
+    def get_checkpoint(cls, source, file_name, content_digest=None):
+        """Returns the checkpoint of the last run of source/file_name if it did not finish
+
+        The checkpoint is discarded when the datafile content has changed since.
+        """
+        query = cls.query.filter(
+            cls.source == source,
+            cls.file_name == file_name if file_name else cls.file_name.is_(None),
+        )
+        entry = query.order_by(cls.id.desc()).first()
+        if not entry or entry.checkpoint is None:
+            return None
+        if entry.state not in (DatafileState.PROCESSING.value, DatafileState.FAILED.value):
+            return None
+        if content_digest and entry.content_digest and content_digest != entry.content_digest:
+            return None
+        return entry.checkpoint
+
+    def save_checkpoint(self, checkpoint):
+        self.checkpoint = checkpoint
+        self.save()
+
+    @classmethod
+    def is_processed_or_ignored(cls, source, file_name):
+        query = cls.query.filter(
+            cls.source == source,
+            cls.file_name == file_name,
+            cls.state.in_([DatafileState.PROCESSED.value, DatafileState.IGNORED.value]),
+        )
+        return _sa.session.query(query.exists()).scalar()
+
+    @classmethod
+    def get_processed_datafile(cls, source, content_digest):
+        """Returns a processed datafile of source with this content digest, or None"""
+        return cls.query.filter(
+            cls.source == source,
+            cls.content_digest == content_digest,
+            cls.state == DatafileState.PROCESSED.value,
+        ).first()
+
+    @classmethod
+    def get_last_processed_timestamp(cls, source):
+        """Returns when a datafile of source was last processed, or None"""
+        return (
+            _sa.session.query(
+                _sa.func.max(_sa.func.coalesce(cls.updated_timestamp, cls.created_timestamp))
+            )
+            .filter(cls.source == source, cls.state == DatafileState.PROCESSED.value)
+            .scalar()
+        )
+
     @classmethod
     def get_processed_or_ignored_datafiles(cls, data_source=None):
         processed_dfs_per_pipeline = defaultdict(list)
@@ -90,6 +157,78 @@ class DatafileRegistryModel(BaseModel):
         return processed_dfs_per_pipeline
 
 
+class PipelineStageMetricsModel(BaseModel):
+    """Timings and sizes of the stages of a pipeline run, see app.etl.utils.StageMetrics"""
+
+    __tablename__ = 'pipeline_stage_metrics'
+    __table_args__ = {'schema': 'operations'}
+
+    id = _col('id', _int, primary_key=True, autoincrement=True)
+    datafile_registry_id = _col(_int, _foreign_key('operations.datafile_registry.id'))
+    source = _col(_text, nullable=False)
+    file_name = _col(_text)
+    stage = _col(_text, nullable=False)
+    started_timestamp = _col(_dt, nullable=False)
+    duration = _col(_sa.Float, nullable=False)  # seconds
+    rows = _col(_sa.BigInteger)
+    bytes_read = _col(_sa.BigInteger)
+    peak_rss = _col(_sa.BigInteger)  # bytes, peak of the process up to the end of the stage
+
+    @classmethod
+    def save_stage_metrics(cls, source, file_name, stage_metrics, datafile_registry_id=None):
+        for metrics in stage_metrics:
+            _sa.session.add(
+                cls(
+                    datafile_registry_id=datafile_registry_id,
+                    source=source,
+                    file_name=file_name,
+                    stage=metrics.stage,
+                    started_timestamp=metrics.started_timestamp,
+                    duration=metrics.duration,
+                    rows=metrics.rows,
+                    bytes_read=metrics.bytes_read,
+                    peak_rss=metrics.peak_rss,
+                )
+            )
+        _sa.session.commit()
+
+
+class StorageListingModel(BaseModel):
+    """File names listed in a storage location, see app.downloader.listing"""
+
+    __tablename__ = 'storage_listing'
+    __table_args__ = (
+        _sa.Index('storage_listing_location_file_name_idx', 'location', 'file_name', unique=True),
+        {'schema': 'operations'},
+    )
+
+    id = _col('id', _int, primary_key=True, autoincrement=True)
+    location = _col(_text, nullable=False)
+    file_name = _col(_text, nullable=False)
+    listed_timestamp = _col(_dt, nullable=False, default=lambda: datetime.datetime.utcnow())
+
+    @classmethod
+    def get_file_names(cls, location):
+        query = _sa.session.query(cls.file_name).filter(cls.location == location)
+        return [file_name for file_name, in query.order_by(cls.file_name)]
+
+    @classmethod
+    def add_file_names(cls, location, file_names):
+        for file_name in file_names:
+            _sa.session.add(cls(location=location, file_name=file_name))
+        _sa.session.commit()
+
+    @classmethod
+    def remove_file_name(cls, location, file_name):
+        cls.query.filter(cls.location == location, cls.file_name == file_name).delete()
+        _sa.session.commit()
+
+    @classmethod
+    def replace_file_names(cls, location, file_names):
+        cls.query.filter(cls.location == location).delete()
+        cls.add_file_names(location, file_names)
+
+
 class Pipeline(BaseModel):
     __tablename__ = 'pipeline'
     __table_args__ = (
@@ -5,6 +5,8 @@ from abc import ABCMeta, abstractmethod
 class AbstractDataSource(metaclass=ABCMeta):
     refresh_delay = 1
     file_date_format = '%Y-%m-%d'
+    # stored file names sort by date, see app.downloader.listing
+    incremental_listing = True
     logger = logging.getLogger(__name__)
 
     def __init__(self, storage):
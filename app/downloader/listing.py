@@ -0,0 +1,99 @@
+import boto3
+from botocore.exceptions import ClientError
+
+from app.db.models.internal import StorageListingModel
+
+
+def parse_s3_location(location):
+    """Returns (bucket, key prefix) of an s3:// location, (None, None) otherwise"""
+    if not location.startswith('s3://'):
+        return None, None
+    bucket, _, prefix = location[len('s3://') :].partition('/')
+    if prefix and not prefix.endswith('/'):
+        prefix += '/'
+    return bucket, prefix
+
+
+def s3_object_checksum(location, file_name):
+    """Returns (checksum, size) of a file of an s3:// location, None for other locations
+
+    The checksum is the object's ETag, read from its metadata without fetching the
+    object. Objects uploaded with the same content and part size have the same ETag.
+    """
+    bucket, prefix = parse_s3_location(location)
+    if bucket is None:
+        return None
+    head = boto3.client('s3').head_object(Bucket=bucket, Key=prefix + file_name)
+    etag = head['ETag'].strip('"')
+    return f'etag:{etag}', head['ContentLength']
+
+
+class IncrementallyListedStorage:
+    """Storage wrapper listing an S3 location incrementally from the last name listed
+
+    The file names listed are stored in operations.storage_listing. S3 lists keys in
+    lexicographic order and can start after a given key (StartAfter), so once a
+    location has been listed, get_file_names only lists the keys after the greatest
+    name listed so far. This assumes new file names sort after existing ones (e.g.
+    they start with or end in a date in ISO order); files added with smaller names
+    are only picked up by a full relist, deleted files by a full relist or by
+    forget_if_missing. Locations other than s3:// urls are always listed in full.
+
+    Every other attribute is passed through to the wrapped storage.
+    """
+
+    def __init__(self, storage, location, relist=False):
+        """
+        Args:
+            storage: datatools.io.Storage instance
+            location: str, url of the storage, e.g. s3://bucket/datasets/hmrc/exporters/
+            relist: bool, list the whole location and replace the stored names
+        """
+        self.storage = storage
+        self.location = location
+        self.relist = relist
+
+    def __getattr__(self, name):
+        return getattr(self.storage, name)
+
+    def get_file_names(self, *args, **kwargs):
+        bucket, prefix = parse_s3_location(self.location)
+        if args or kwargs or bucket is None:
+            return self.storage.get_file_names(*args, **kwargs)
+
+        file_names = StorageListingModel.get_file_names(self.location)
+        if self.relist or not file_names:
+            file_names = sorted(self.storage.get_file_names())
+            StorageListingModel.replace_file_names(self.location, file_names)
+            self.relist = False
+            return file_names
+        new_file_names = list(self._list_s3_after(bucket, prefix, max(file_names)))
+        StorageListingModel.add_file_names(self.location, new_file_names)
+        return file_names + new_file_names
+
+    def forget_if_missing(self, file_name):
+        """Removes a stored file name if the file is no longer in the location
+
+        Returns:
+            bool, whether the file is missing
+        """
+        bucket, prefix = parse_s3_location(self.location)
+        if bucket is None:
+            return False
+        try:
+            boto3.client('s3').head_object(Bucket=bucket, Key=prefix + file_name)
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ('404', 'NoSuchKey'):
+                raise
+            StorageListingModel.remove_file_name(self.location, file_name)
+            return True
+        return False
+
+    def _list_s3_after(self, bucket, prefix, start_after):
+        paginator = boto3.client('s3').get_paginator('list_objects_v2')
+        pages = paginator.paginate(Bucket=bucket, Prefix=prefix, StartAfter=prefix + start_after)
+        for page in pages:
+            for s3_object in page.get('Contents', []):
+                file_name = s3_object['Key'][len(prefix) :]
+                if file_name and not file_name.endswith('/'):
+                    yield file_name
@@ -12,3 +12,4 @@ class ONSPostcodeDirectory(ONSGeoPortalWebScrapingDataSource):
     storage_file_regex = r'ONSPD_(?P<date>\w{3}_\d{4})\_UK.zip$'
     storage_file_format = r'ONSPD_{date}_UK.zip'
     storage_file_date_format = '%b_%Y'
+    incremental_listing = False  # month names do not sort by date
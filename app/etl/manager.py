@@ -1,16 +1,33 @@
+import functools
+import hashlib
 import inspect
-from collections import namedtuple, OrderedDict
+import multiprocessing
+import os.path
+import tempfile
+import threading
+import time
+from collections import deque, namedtuple, OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 
 from datatools.io.datafile_provider import DatafileProvider
+from datatools.io.fileinfo import FileInfo
 from datatools.io.storage import StorageFactory
 from flask import current_app as flask_app
 from tqdm import tqdm
 
 from app.constants import DatafileState
-from app.db.models.internal import DatafileRegistryModel
+from app.db.models.internal import DatafileRegistryModel, PipelineStageMetricsModel
+from app.downloader.listing import (
+    IncrementallyListedStorage,
+    parse_s3_location,
+    s3_object_checksum,
+)
+from app.etl.utils import measure_stage
 
 PipelineConfig = namedtuple(
-    'PipelineConfig', 'pipeline sub_directory force unpack trigger_dataflow_dag'
+    'PipelineConfig',
+    'pipeline sub_directory force unpack trigger_dataflow_dag incremental_listing',
+    defaults=(False,),
 )
 
 
@@ -18,12 +35,199 @@ class DSSDatafileProvider(DatafileProvider):
     ignore_filename_patterns = ['[Content_Types].xml'] + DatafileProvider.ignore_filename_patterns
 
 
+FetchedDatafile = namedtuple('FetchedDatafile', 'file_name file_info content_digest size metrics')
+
+# data_changed: whether the pipeline changed data, failed: whether processing failed
+ProcessResult = namedtuple('ProcessResult', 'data_changed failed')
+
+SPOOL_MEMORY_BYTES = 2**26
+
+
+class MissingDatafileError(LookupError):
+    """A listed datafile that is no longer in the storage, see Manager._read_files"""
+
+
+def fetch_datafile(
+    fetch,
+    file_name,
+    memory_bytes=SPOOL_MEMORY_BYTES,
+    chunk_size=2**20,
+    checksum=None,
+    stream=False,
+):
+    """Fetches a datafile into a temporary file, computing its sha256 digest on the way
+
+    The temporary file is kept in memory up to memory_bytes and written to disk beyond.
+    When the storage provides a checksum of the datafile, it is used as content digest
+    instead, and with stream the datafile is not read ahead of its processing at all.
+
+    Args:
+        fetch: callable returning the datatools FileInfo of file_name
+        file_name: str
+        checksum: callable returning (content digest, size) of file_name, or None if the
+            storage has no checksum, see Manager._storage_checksum
+        stream: bool, return the fetched file_info as is if the checksum is known
+
+    Returns:
+        FetchedDatafile, with a file_info reading from the temporary file, or the fetched
+        file_info if streamed
+    """
+    with measure_stage('fetch') as metrics:
+        file_info = fetch(file_name)
+        known = checksum(file_name) if checksum else None
+        if known and stream:
+            content_digest, size = known
+            return FetchedDatafile(file_name, file_info, content_digest, size, metrics)
+        digest = hashlib.sha256()
+        spool = tempfile.SpooledTemporaryFile(max_size=memory_bytes)
+        chunk = file_info.data.read(chunk_size)
+        while chunk:
+            digest.update(chunk)
+            spool.write(chunk)
+            chunk = file_info.data.read(chunk_size)
+        metrics.bytes_read = spool.tell()
+        spool.seek(0)
+    return FetchedDatafile(
+        file_name=file_name,
+        file_info=FileInfo(file_info.name, spool),
+        content_digest=known[0] if known else digest.hexdigest(),
+        size=metrics.bytes_read,
+        metrics=metrics,
+    )
+
+
+class DatafilePrefetcher:
+    """Fetches datafiles in a background thread ahead of their processing
+
+    Iterating yields a FetchedDatafile (see fetch_datafile) per file name, in order. Up
+    to num_files datafiles are fetched ahead of the one being processed. No further
+    datafile is fetched while the datafiles held (the one being processed included) add
+    up to max_bytes or more, so a datafile larger than the budget is processed without
+    prefetching. An error fetching a datafile is raised when that datafile is reached,
+    datafiles whose fetch raised MissingDatafileError are skipped.
+    """
+
+    def __init__(
+        self,
+        fetch,
+        file_names,
+        num_files,
+        max_bytes=None,
+        memory_bytes=SPOOL_MEMORY_BYTES,
+        checksum=None,
+    ):
+        self.fetch = fetch
+        self.checksum = checksum
+        self.file_names = list(file_names)
+        self.num_files = num_files
+        self.max_bytes = max_bytes
+        self.memory_bytes = memory_bytes
+        self._condition = threading.Condition()
+        self._fetched = deque()
+        self._held_bytes = 0
+        self._closed = False
+
+    def __iter__(self):
+        thread = threading.Thread(target=self._fetch_all, daemon=True)
+        thread.start()
+        try:
+            for _ in self.file_names:
+                with self._condition:
+                    while not self._fetched:
+                        self._condition.wait()
+                    datafile, error = self._fetched.popleft()
+                    self._condition.notify_all()
+                if error:
+                    raise error
+                if datafile is None:
+                    continue
+                try:
+                    yield datafile
+                finally:
+                    self._release(datafile)
+        finally:
+            with self._condition:
+                self._closed = True
+                self._condition.notify_all()
+            thread.join()
+            for datafile, _ in self._fetched:
+                if datafile:
+                    self._release(datafile)
+
+    def _can_fetch(self):
+        if len(self._fetched) >= self.num_files:
+            return False
+        if self.max_bytes is None or self._held_bytes == 0:
+            return True
+        return self._held_bytes < self.max_bytes
+
+    def _fetch_all(self):
+        for file_name in self.file_names:
+            with self._condition:
+                while not self._closed and not self._can_fetch():
+                    self._condition.wait()
+                if self._closed:
+                    return
+            datafile, error = None, None
+            try:
+                datafile = fetch_datafile(
+                    self.fetch, file_name, self.memory_bytes, checksum=self.checksum
+                )
+            except MissingDatafileError:
+                pass
+            except Exception as e:
+                error = e
+            with self._condition:
+                self._fetched.append((datafile, error))
+                self._held_bytes += datafile.size if datafile else 0
+                self._condition.notify_all()
+            if error:
+                return
+
+    def _release(self, datafile):
+        datafile.file_info.data.close()
+        with self._condition:
+            self._held_bytes -= datafile.size
+            self._condition.notify_all()
+
+
+# set before forking the pipeline worker processes, which inherit them
+_worker_app, _worker_manager = None, None
+
+
+def _init_pipeline_worker():
+    _worker_app.app_context().push()
+    # the pooled connections belong to the parent process, open new ones
+    flask_app.db.engine.dispose(close=False)
+
+
+def _process_pipeline_in_worker(pipeline_id):
+    return _worker_manager.pipeline_process(pipeline_id)
+
+
 class Manager:
     """Manages several clean pipelines and one storage instance"""
 
-    def __init__(self, storage=None, dbi=None):
+    def __init__(
+        self, storage=None, dbi=None, prefetch_files=0, prefetch_max_bytes=None, relist=False
+    ):
+        """
+        Args:
+            storage: string or datatools.io.Storage instance, see _cast_to_storage
+            dbi: database interface passed to the pipelines
+            prefetch_files: number of datafiles to fetch ahead of the one being
+                processed, see DatafilePrefetcher
+            prefetch_max_bytes: int or None, stop prefetching while the fetched
+                datafiles held add up to this many bytes
+            relist: bool, list the whole sub directory of pipelines registered with
+                incremental_listing, see IncrementallyListedStorage
+        """
         self.storage = self._cast_to_storage(storage)
+        self.storage_location = storage if isinstance(storage, str) else None
+        self.relist = relist
         self.dbi = dbi
+        self.prefetch_files = prefetch_files
+        self.prefetch_max_bytes = prefetch_max_bytes
         self._pipelines = OrderedDict()
 
     def _to_pipeline_id(self, pipeline):
@@ -53,67 +257,409 @@ class Manager:
         return self._pipelines[pipeline_id]
 
     def pipeline_process(self, pipeline_id, progress_bar=None):
+        """Processes the datafiles of a pipeline, or runs a pipeline without datafiles
+
+        Returns:
+            bool, whether no datafile (or run) failed
+        """
         pipeline_config = self.pipeline_get(pipeline_id)
         pipeline = pipeline_config.pipeline
-        data_changed = False
+        data_changed = failed = False
         if pipeline_config.sub_directory:
-            storage = self.storage.get_sub_storage(pipeline_config.sub_directory)
-            dfp = DSSDatafileProvider(storage)
-            processed_and_ignored_files = DatafileRegistryModel.get_processed_or_ignored_datafiles(
-                pipeline_id
-            )
-            for file_name in dfp.get_file_names():
-                if (
-                    file_name in processed_and_ignored_files[pipeline_id]
-                    and pipeline_config.force is False
-                ):
-                    continue
-                file_info = next(dfp.read_files(file_name, unpack=pipeline_config.unpack))
-                data_changed = self._update_registry_and_process(
-                    pipeline=pipeline,
-                    orig_file_name=file_name,
-                    file_info=file_info,
-                    progress_bar=progress_bar,
-                )
+            dfp = self._datafile_provider(pipeline_config)
+            file_names = self._file_names_to_process(pipeline_config, dfp)
+            for datafile in self._read_files(dfp, file_names, pipeline_config):
+                result = self._process_datafile(pipeline_config, datafile, progress_bar)
+                data_changed = result.data_changed or data_changed
+                failed = result.failed or failed
         else:
-            data_changed = self._update_registry_and_process(
+            data_changed, failed = self._update_registry_and_process(
                 pipeline=pipeline,
                 progress_bar=progress_bar,
+                resume=not pipeline_config.force,
             )
         if data_changed and pipeline_config.trigger_dataflow_dag:
-            pipeline.trigger_dataflow_dag()
+            self._trigger_dataflow_dag(pipeline)
+        return not failed
+
+    def _datafile_provider(self, pipeline_config):
+        storage = self.storage.get_sub_storage(pipeline_config.sub_directory)
+        return DSSDatafileProvider(self._listed_storage(pipeline_config, storage) or storage)
+
+    def _listed_storage(self, pipeline_config, storage=None):
+        """IncrementallyListedStorage of a pipeline registered with incremental_listing"""
+        if not pipeline_config.incremental_listing or not self.storage_location:
+            return None
+        return IncrementallyListedStorage(
+            storage or self.storage.get_sub_storage(pipeline_config.sub_directory),
+            os.path.join(self.storage_location, pipeline_config.sub_directory),
+            relist=self.relist,
+        )
 
     @staticmethod
+    def _file_names_to_process(pipeline_config, dfp):
+        file_names = dfp.get_file_names()
+        if pipeline_config.force is not False:
+            return list(file_names)
+        source = pipeline_config.pipeline.id
+        done = set(DatafileRegistryModel.get_processed_or_ignored_datafiles(source)[source])
+        return [file_name for file_name in file_names if file_name not in done]
+
+    def _process_datafile(self, pipeline_config, datafile, progress_bar=None):
+        """Processes a FetchedDatafile unless it duplicates a processed datafile
+
+        Returns:
+            ProcessResult
+        """
+        pipeline = pipeline_config.pipeline
+        if pipeline_config.force is False and self._ignore_duplicate(pipeline, datafile):
+            return ProcessResult(data_changed=False, failed=False)
+        return self._update_registry_and_process(
+            pipeline=pipeline,
+            orig_file_name=datafile.file_name,
+            file_info=datafile.file_info,
+            progress_bar=progress_bar,
+            stage_metrics=[datafile.metrics],
+            content_digest=datafile.content_digest,
+            size=datafile.size,
+            resume=not pipeline_config.force,
+        )
+
+    def _trigger_dataflow_dag(self, pipeline):
+        with measure_stage('trigger_dataflow_dag') as trigger:
+            pipeline.trigger_dataflow_dag()
+        self._save_stage_metrics(pipeline, None, [trigger])
+
+    def _read_files(self, dfp, file_names, pipeline_config):
+        """Yields a FetchedDatafile per file name, fetching ahead if configured
+
+        Datafiles deleted since they were listed by an incrementally listed storage are
+        skipped, and removed from its listing.
+        """
+        listed_storage = self._listed_storage(pipeline_config)
+
+        def fetch(file_name):
+            try:
+                return next(dfp.read_files(file_name, unpack=pipeline_config.unpack))
+            except Exception as e:
+                if listed_storage is None or not listed_storage.forget_if_missing(file_name):
+                    raise
+                flask_app.logger.warning(
+                    f'{file_name} skipped, it is no longer in {listed_storage.location}'
+                )
+                raise MissingDatafileError(file_name) from e
+
+        checksum = self._storage_checksum(pipeline_config)
+        if self.prefetch_files:
+            yield from DatafilePrefetcher(
+                fetch,
+                file_names,
+                self.prefetch_files,
+                max_bytes=self.prefetch_max_bytes,
+                checksum=checksum,
+            )
+            return
+        for file_name in file_names:
+            try:
+                datafile = fetch_datafile(fetch, file_name, checksum=checksum, stream=True)
+            except MissingDatafileError:
+                continue
+            try:
+                yield datafile
+            finally:
+                datafile.file_info.data.close()
+
+    def _storage_checksum(self, pipeline_config):
+        """Returns a callable returning (content digest, size) of a datafile of the storage
+
+        Datafiles in S3 are identified by their ETag, which saves reading them for a
+        digest. Returns None for other storages, whose datafiles get a sha256 digest.
+        """
+        if not self.storage_location:
+            return None
+        location = os.path.join(self.storage_location, pipeline_config.sub_directory)
+        if parse_s3_location(location)[0] is None:
+            return None
+        return functools.partial(s3_object_checksum, location)
+
+    @classmethod
+    def _ignore_duplicate(cls, pipeline, datafile):
+        """Registers datafile as ignored if a datafile with the same content was processed
+
+        Returns:
+            bool, whether the datafile is a duplicate
+        """
+        duplicate = DatafileRegistryModel.get_processed_datafile(
+            pipeline.id, datafile.content_digest
+        )
+        if not duplicate:
+            return False
+        flask_app.logger.info(
+            f'{pipeline.id}: ignoring {datafile.file_name}, '
+            f'it has the same content as {duplicate.file_name}'
+        )
+        entry, _ = DatafileRegistryModel.get_update_or_create(
+            source=pipeline.id,
+            file_name=datafile.file_name,
+            state=DatafileState.IGNORED.value,
+            content_digest=datafile.content_digest,
+            size=datafile.size,
+        )
+        cls._save_stage_metrics(pipeline, entry, [datafile.metrics])
+        return True
+
+    @classmethod
     def _update_registry_and_process(
-        pipeline, orig_file_name=None, file_info=None, progress_bar=None
+        cls,
+        pipeline,
+        orig_file_name=None,
+        file_info=None,
+        progress_bar=None,
+        stage_metrics=None,
+        content_digest=None,
+        size=None,
+        resume=True,
     ):
+        """Processes a datafile (or runs a pipeline without datafiles) and registers it
+
+        With resume, the checkpoint saved by a failed or interrupted run of the same
+        datafile is passed to the pipeline, see DataPipeline.save_checkpoint. Failures
+        are registered and logged, not raised.
+
+        Returns:
+            ProcessResult
+        """
         if progress_bar:
             progress_bar.set_postfix(str=orig_file_name or pipeline.id)
         entry = None
-        data_changed = False
+        data_changed = failed = False
+        pipeline.stage_metrics = list(stage_metrics or [])
         try:
+            checkpoint = None
+            if resume:
+                checkpoint = DatafileRegistryModel.get_checkpoint(
+                    pipeline.id, orig_file_name, content_digest
+                )
             entry, _ = DatafileRegistryModel.get_update_or_create(
                 source=pipeline.id,
                 file_name=orig_file_name,
                 state=DatafileState.PROCESSING.value,
+                content_digest=content_digest,
+                size=size,
             )
+            if entry.checkpoint != checkpoint:
+                entry.save_checkpoint(checkpoint)
+            if checkpoint is not None:
+                flask_app.logger.info(
+                    f'{pipeline.id}: resuming {orig_file_name or ""} from checkpoint {checkpoint}'
+                )
+            pipeline.checkpoint = checkpoint
+            pipeline.on_checkpoint = entry.save_checkpoint
             pipeline.process(file_info)
             data_changed = True
             entry.state = DatafileState.PROCESSED.value
+            entry.checkpoint = None
             entry.save()
         except Exception as e:
+            failed = True
             if entry:
                 entry.state = DatafileState.FAILED.value
                 entry.error_message = str(e)
                 entry.save()
             flask_app.logger.error(f'pipeline processing failed: {e}')
-        return data_changed
+        finally:
+            pipeline.on_checkpoint = None
+        cls._save_stage_metrics(pipeline, entry, pipeline.stage_metrics)
+        return ProcessResult(data_changed=data_changed, failed=failed)
+
+    @staticmethod
+    def _save_stage_metrics(pipeline, entry, stage_metrics):
+        """Stores stage metrics, failing to do so does not fail the pipeline"""
+        try:
+            PipelineStageMetricsModel.save_stage_metrics(
+                source=pipeline.id,
+                file_name=entry.file_name if entry else None,
+                stage_metrics=stage_metrics,
+                datafile_registry_id=entry.id if entry else None,
+            )
+        except Exception as e:
+            flask_app.logger.error(f'saving pipeline stage metrics failed: {e}')
+
+    def pipeline_process_all(self, workers=1):
+        """Processes all registered pipelines
 
-    def pipeline_process_all(self):
-        progress = tqdm(self._pipelines.keys())
-        for pipeline_id in progress:
-            progress.set_description(pipeline_id)
-            self.pipeline_process(pipeline_id, progress_bar=progress)
+        With more than one worker, pipelines run concurrently in a pool of that many
+        processes, each with its own database connections. A pipeline is only started
+        once the registered pipelines it depends on (see DataPipeline.dependencies) have
+        finished; if one of them fails (a datafile of it fails, see pipeline_process), its
+        dependents are skipped.
+        """
+        if workers <= 1:
+            progress = tqdm(self._pipelines.keys())
+            for pipeline_id in progress:
+                progress.set_description(pipeline_id)
+                self.pipeline_process(pipeline_id, progress_bar=progress)
+            return
+
+        global _worker_app, _worker_manager
+        graph = self.pipeline_dependencies()
+        _worker_app, _worker_manager = flask_app._get_current_object(), self
+        finished, running = set(), {}
+        progress = tqdm(total=len(graph))
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('fork'),
+            initializer=_init_pipeline_worker,
+        ) as executor:
+            while len(finished) < len(graph):
+                for pipeline_id, dependencies in graph.items():
+                    started = pipeline_id in finished or pipeline_id in running.values()
+                    if not started and dependencies <= finished:
+                        future = executor.submit(_process_pipeline_in_worker, pipeline_id)
+                        running[future] = pipeline_id
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pipeline_id = running.pop(future)
+                    finished.add(pipeline_id)
+                    progress.update()
+                    # failed datafiles are registered as failed, not raised
+                    error = future.exception()
+                    if error is None and future.result():
+                        continue
+                    flask_app.logger.error(
+                        f'pipeline {pipeline_id} failed' + (f': {error}' if error else '')
+                    )
+                    for dependent in self._dependents(graph, pipeline_id) - finished:
+                        flask_app.logger.error(
+                            f'pipeline {dependent} skipped, it depends on {pipeline_id}'
+                        )
+                        finished.add(dependent)
+                        progress.update()
+
+    def pipeline_enqueue_all(self, work_queue):
+        """Queues the work of all registered pipelines in work_queue, see pipeline_work
+
+        A work item is queued per datafile to process, or a single item without file name
+        for pipelines without sub directory. The failures of the previous run are cleared,
+        which unblocks the dependents of the pipelines that failed.
+
+        Args:
+            work_queue: app.etl.work_queue.WorkQueue instance
+        Returns:
+            int, number of items queued
+        """
+        queued = 0
+        for pipeline_id, pipeline_config in self._pipelines.items():
+            work_queue.clear_failed(pipeline_id)
+            if not pipeline_config.sub_directory:
+                queued += work_queue.enqueue(pipeline_id)
+                continue
+            dfp = self._datafile_provider(pipeline_config)
+            for file_name in self._file_names_to_process(pipeline_config, dfp):
+                queued += work_queue.enqueue(pipeline_id, file_name)
+        return queued
+
+    def pipeline_work(self, work_queue, poll_seconds=5):
+        """Processes the work items of the registered pipelines queued in work_queue
+
+        Any number of workers, on any node, can work on the same queue. An item is only
+        claimed once the registered pipelines its pipeline depends on have no pending or
+        leased items left, and its lease is renewed while it is processed. Items that
+        failed are removed from the queue as failed (see WorkQueue.fail); the items of the
+        pipelines depending on a pipeline with failed items stay queued but are not
+        claimed. Returns once the registered pipelines have no pending or leased items
+        left but those.
+
+        Args:
+            work_queue: app.etl.work_queue.WorkQueue instance
+            poll_seconds: seconds to wait before trying again when no item can be claimed
+        """
+        graph = self.pipeline_dependencies()
+        while True:
+            blocked = set()
+            for pipeline_id in graph:
+                if work_queue.failed(pipeline_id):
+                    blocked |= self._dependents(graph, pipeline_id)
+            ready = [
+                pipeline_id
+                for pipeline_id, dependencies in graph.items()
+                if pipeline_id not in blocked
+                and not any(work_queue.outstanding(dependency) for dependency in dependencies)
+            ]
+            lease = work_queue.claim(ready)
+            if lease is None:
+                if not any(work_queue.outstanding(p) for p in graph if p not in blocked):
+                    for pipeline_id in sorted(blocked):
+                        if work_queue.outstanding(pipeline_id):
+                            flask_app.logger.error(
+                                f'pipeline {pipeline_id} skipped, a pipeline it depends on failed'
+                            )
+                    return
+                time.sleep(poll_seconds)
+                continue
+            with work_queue.heartbeat(lease):
+                succeeded = self._process_work_item(lease.item)
+            remove = work_queue.complete if succeeded else work_queue.fail
+            if not remove(lease):
+                flask_app.logger.warning(f'lease of {lease.item} was lost while processing')
+
+    def _process_work_item(self, item):
+        """Processes the datafile of a work item, or runs a pipeline without datafiles
+
+        Returns:
+            bool, whether it did not fail
+        """
+        pipeline_config = self.pipeline_get(item.pipeline_id)
+        pipeline = pipeline_config.pipeline
+        if item.file_name is None:
+            data_changed, failed = self._update_registry_and_process(
+                pipeline=pipeline, resume=not pipeline_config.force
+            )
+        elif pipeline_config.force is False and DatafileRegistryModel.is_processed_or_ignored(
+            pipeline.id, item.file_name
+        ):
+            return True
+        else:
+            dfp = self._datafile_provider(pipeline_config)
+            data_changed = failed = False
+            for datafile in self._read_files(dfp, [item.file_name], pipeline_config):
+                data_changed, failed = self._process_datafile(pipeline_config, datafile)
+        if data_changed and pipeline_config.trigger_dataflow_dag:
+            self._trigger_dataflow_dag(pipeline)
+        return not failed
+
+    def pipeline_dependencies(self):
+        """Dependencies between the registered pipelines
+
+        Returns:
+            dict {pipeline_id: set of ids of the registered pipelines it depends on}
+        Raises:
+            ValueError if the dependencies are circular
+        """
+        graph = {}
+        for pipeline_id, config in self._pipelines.items():
+            dependencies = tuple(getattr(config.pipeline, 'dependencies', None) or ())
+            graph[pipeline_id] = {
+                other_id
+                for other_id, other_config in self._pipelines.items()
+                if other_id != pipeline_id and isinstance(other_config.pipeline, dependencies)
+            }
+        for pipeline_id in graph:
+            if pipeline_id in self._dependents(graph, pipeline_id):
+                raise ValueError(f'{pipeline_id} pipeline depends on itself')
+        return graph
+
+    @staticmethod
+    def _dependents(graph, pipeline_id):
+        """Ids of the pipelines depending on pipeline_id, directly or indirectly"""
+        dependents, stack = set(), [pipeline_id]
+        while stack:
+            current = stack.pop()
+            for other_id, dependencies in graph.items():
+                if current in dependencies and other_id not in dependents:
+                    dependents.add(other_id)
+                    stack.append(other_id)
+        return dependents
 
     def pipeline_register(self, pipeline, sub_directory=None, pipeline_id=None, **kwargs):
         """Register a clean pipeline for the manager to use
@@ -141,8 +687,9 @@ class Manager:
         force = kwargs.get('force', False)
         unpack = kwargs.get('unpack', True)
         trigger_dataflow_dag = kwargs.get('trigger_dataflow_dag', False)
+        incremental_listing = kwargs.get('incremental_listing', False)
         self._pipelines[pipeline_id] = PipelineConfig(
-            po, sub_directory, force, unpack, trigger_dataflow_dag
+            po, sub_directory, force, unpack, trigger_dataflow_dag, incremental_listing
         )
 
     def pipeline_remove(self, pipeline):
@@ -1,9 +1,12 @@
 import datetime
 import logging
+import multiprocessing
 import os
 import re
-from collections import OrderedDict
-from io import StringIO
+import time
+from collections import defaultdict, namedtuple, OrderedDict
+from io import BytesIO, StringIO
+from itertools import islice
 
 import dateutil
 import dateutil.parser
@@ -13,13 +16,30 @@ from lxml.etree import XMLSyntaxError
 from psycopg2._psycopg import DataError
 
 from app.etl.pipeline_type.incremental_data import L0IncrementalDataPipeline
+from app.etl.utils import peak_rss, StageMetrics
+
+# documents parsed by a parse worker task; pid identifies the worker
+ParseStats = namedtuple('ParseStats', 'pid documents bytes_read duration peak_rss')
 
 
 class CompaniesHouseAccountsPipeline(L0IncrementalDataPipeline):
+    """Loads the XBRL documents of Companies House accounts bulk data zips
+
+    Options:
+        parse_workers: when greater than 1, the documents are parsed in this many
+            processes (see _parallel_datafile_to_l0_temp). L0 rows are the same as
+            when parsing in the pipeline process.
+
+    """
 
     organisation = 'companies_house'
     dataset = 'accounts_legacy'
 
+    # zip members parsed and copied into L0.temp at a time with parse_workers
+    _parse_batch_documents = 1000
+    # zip members sent to a parse worker at a time
+    _parse_task_documents = 50
+
     _l0_data_column_types = [
         ('run_code', 'text'),
         ('company_id', 'text'),
@@ -63,28 +83,55 @@ class CompaniesHouseAccountsPipeline(L0IncrementalDataPipeline):
         ('profit_loss_for_period', 'numeric'),
     ]
 
+    def set_option_defaults(self, options):
+        options.setdefault('parse_workers', 1)
+        return super().set_option_defaults(options)
+
+    def _copy_tsv_to_l0_temp(self, csv_data):
+        """Copies TSV lines into L0.temp
+
+        Without the max_rejected_rows option, the lines are dropped if the COPY fails.
+        """
+
+        def copy(buffer, has_header=False):
+            self.dbi.dsv_buffer_to_table(
+                buffer,
+                self._l0_temp_table,
+                null='None',
+                columns=[c for c, _ in self._l0_data_column_types],
+            )
+
+        csv_data.seek(0)
+        if self.options.max_rejected_rows is not None:
+            # a line is a record, values are not quoted
+            self._copy_rejecting_bad_rows(copy, csv_data, quote=None)
+            return
+        try:
+            copy(csv_data)
+        except DataError as e:
+            logging.error(f'failed to upload accounts data: {e}')
+
     def _datafile_to_l0_temp(self, file_info):
+        if self.options.parse_workers > 1:
+            self._parallel_datafile_to_l0_temp(file_info)
+            return
+
         csv_data = StringIO()
         xbrl_parser = XBRLParser()
 
         def flush():
             nonlocal csv_data
-            csv_data.seek(0)
-            try:
-                self.dbi.dsv_buffer_to_table(
-                    csv_data,
-                    self._l0_temp_table,
-                    null='None',
-                    columns=[c for c, _ in self._l0_data_column_types],
-                )
-            except DataError as e:
-                logging.error(f'failed to upload accounts data: {e}')
+            self._copy_tsv_to_l0_temp(csv_data)
             csv_data = StringIO()
 
+        start_index = self._resume_l0_temp()
         count = 0
-        for fi in DatafileProvider.read_files_from_zip(file_info.data):
+        for index, fi in enumerate(DatafileProvider.read_files_from_zip(file_info.data)):
+            if index < start_index:
+                continue
             if count % 1000 == 999:
                 flush()
+                self._save_l0_temp_checkpoint(index)
             try:
                 tsv_lines = xbrl_parser.xbrl_to_tsv(fi.data)
                 csv_data.writelines(tsv_lines)
@@ -93,37 +140,224 @@ class CompaniesHouseAccountsPipeline(L0IncrementalDataPipeline):
                 logging.error(f'failed to parse document: {e}')
         flush()
 
+    def _parallel_datafile_to_l0_temp(self, file_info):
+        """Parses the zip members in parse_workers processes and copies them into L0.temp
+
+        Members are sent to the workers in batches of _parse_batch_documents, split into
+        tasks of _parse_task_documents. The next batch is parsed while a batch is copied,
+        so at most two batches are held in memory. Each batch is copied with a single
+        COPY, its rows in zip member order, and checkpointed. The throughput of each
+        worker is logged and added to stage_metrics as a parse_worker_<n> stage.
+        """
+        start_index = self._resume_l0_temp()
+        members = (
+            (index, fi.data.name, fi.data.read())
+            for index, fi in enumerate(DatafileProvider.read_files_from_zip(file_info.data))
+            if index >= start_index
+        )
+        worker_stats = OrderedDict()
+
+        def copy_batch(result, next_index):
+            csv_data = StringIO()
+            for tsv_lines, stats in result.get():
+                csv_data.writelines(tsv_lines)
+                worker_stats.setdefault(stats.pid, []).append(stats)
+            self._copy_tsv_to_l0_temp(csv_data)
+            self._save_l0_temp_checkpoint(next_index)
+
+        started_timestamp = datetime.datetime.utcnow()
+        context = multiprocessing.get_context('fork')
+        with context.Pool(self.options.parse_workers) as pool:
+            parsing = None  # (AsyncResult, index of the member after the batch)
+            while True:
+                batch = list(islice(members, self._parse_batch_documents))
+                next_parsing = None
+                if batch:
+                    tasks = [
+                        [
+                            (name, data)
+                            for _, name, data in batch[i : i + self._parse_task_documents]
+                        ]
+                        for i in range(0, len(batch), self._parse_task_documents)
+                    ]
+                    next_parsing = (
+                        pool.map_async(_parse_xbrl_documents, tasks),
+                        batch[-1][0] + 1,
+                    )
+                if parsing:
+                    copy_batch(*parsing)
+                if not next_parsing:
+                    break
+                parsing = next_parsing
+
+        for number, stats in enumerate(worker_stats.values()):
+            metrics = StageMetrics(f'parse_worker_{number}')
+            metrics.started_timestamp = started_timestamp
+            metrics.duration = sum(s.duration for s in stats)
+            metrics.rows = sum(s.documents for s in stats)
+            metrics.bytes_read = sum(s.bytes_read for s in stats)
+            metrics.peak_rss = max(s.peak_rss for s in stats)
+            self.stage_metrics.append(metrics)
+            logging.info(
+                f'parse worker {number}: {metrics.rows} documents in {metrics.duration:.1f}s '
+                f'({metrics.rows / (metrics.duration or 1):.1f} documents/s)'
+            )
+
+    def _l0_temp_max_id(self):
+        return self.dbi.execute_query(
+            f'SELECT max(id) FROM {self._l0_temp_table}', raise_if_fail=True
+        )[0][0]
+
+    def _save_l0_temp_checkpoint(self, member_index):
+        """Checkpoints that the zip members before member_index are in L0.temp"""
+        self.save_checkpoint({'member_index': member_index, 'last_id': self._l0_temp_max_id()})
+
+    def _resume_l0_temp(self):
+        """Prepares L0.temp to resume from the checkpoint of a failed run
+
+        Rows copied after the checkpoint was saved are deleted. If L0.temp no longer
+        holds the rows up to the checkpoint, it is emptied and the datafile is loaded
+        from the start.
+
+        Returns:
+            int, index of the first zip member to load
+        """
+        if not self.checkpoint:
+            return 0
+        last_id = self.checkpoint['last_id']
+        max_id = self._l0_temp_max_id()
+        if last_id is not None and (max_id is None or max_id < last_id):
+            self._execute_statement(f'DELETE FROM {self._l0_temp_table}')
+            return 0
+        self._execute_statement(
+            f'DELETE FROM {self._l0_temp_table} WHERE id > {last_id if last_id else 0}'
+        )
+        return self.checkpoint['member_index']
+
+
+def _parse_xbrl_documents(documents):
+    """Parses XBRL documents in a parse worker process
+
+    Args:
+        documents: list of (file name, bytes)
+    Returns:
+        (list of the TSV lines of the documents, ParseStats)
+    """
+    start = time.perf_counter()
+    xbrl_parser = XBRLParser()
+    tsv_lines = []
+    for name, data in documents:
+        xbrl_file = BytesIO(data)
+        xbrl_file.name = name
+        try:
+            tsv_lines.extend(xbrl_parser.xbrl_to_tsv(xbrl_file))
+        except XMLSyntaxError as e:
+            logging.error(f'failed to parse document: {e}')
+    stats = ParseStats(
+        pid=os.getpid(),
+        documents=len(documents),
+        bytes_read=sum(len(data) for _, data in documents),
+        duration=time.perf_counter() - start,
+        peak_rss=peak_rss(),
+    )
+    return tsv_lines, stats
+
+
+def _local_name(element):
+    return element.tag.rpartition('}')[2]
+
+
+# query for the elements of an XBRL document, resolved by XBRLIndex.find
+#   name: local name of the elements
+#   attr_value: value the name attribute of the elements ends with, after a colon
+#     (elements with either are matched if both are given)
+#   context_ref_contains, context_ref_excludes: text the contextRef attribute of the
+#     matched elements must contain or not contain
+#   first_descendant: local name of the element to return instead, the first descendant
+#     with that name of the matched elements
+XBRLQuery = namedtuple(
+    'XBRLQuery',
+    'name attr_value context_ref_contains context_ref_excludes first_descendant',
+    defaults=(None, None, None, None, None),
+)
+
+
+class XBRLIndex:
+    """Elements of an XBRL document indexed by local name and by name attribute suffix
+
+    The index is built in a single walk of the document, queries then only look up
+    the elements they match.
+    """
+
+    def __init__(self, document):
+        # {key: [(position in document, element)]}, in document order
+        self._by_name = defaultdict(list)
+        self._by_attr_value = defaultdict(list)
+        for position, element in enumerate(document.getroot().iter(tag=etree.Element)):
+            self._by_name[_local_name(element)].append((position, element))
+            name_attr = element.get('name')
+            if name_attr and ':' in name_attr:
+                self._by_attr_value[name_attr.rpartition(':')[2]].append((position, element))
+
+    def _attr_value_matches(self, attr_value):
+        # the first ":{attr_value}" of the name attribute ends it
+        suffix = f':{attr_value}'
+        return [
+            (position, element)
+            for position, element in self._by_attr_value.get(attr_value, [])
+            if element.get('name').find(suffix) == len(element.get('name')) - len(suffix)
+        ]
+
+    def find(self, query):
+        """Returns the elements matching query, an XBRLQuery, in document order"""
+        matches = set()
+        if query.name:
+            matches.update(self._by_name.get(query.name, []))
+        if query.attr_value:
+            matches.update(self._attr_value_matches(query.attr_value))
+        elements = [element for _, element in sorted(matches, key=lambda match: match[0])]
+
+        if query.context_ref_contains:
+            elements = [
+                e for e in elements if query.context_ref_contains in e.get('contextRef', '')
+            ]
+        if query.context_ref_excludes:
+            elements = [
+                e for e in elements if query.context_ref_excludes not in e.get('contextRef', '')
+            ]
+        if query.first_descendant:
+            for element in elements:
+                for descendant in element.iterdescendants(tag=etree.Element):
+                    if _local_name(descendant) == query.first_descendant:
+                        return [descendant]
+            return []
+        return elements
+
 
 class XBRLParser:
 
-    # XPATH helpers
+    # query helpers
     # XML element syntax: <ns:name attribute='value'>content</ns:name>
     @staticmethod
     def _element_has_name(name):
-        return f"//*[local-name()='{name}']"
+        return XBRLQuery(name=name)
 
     @staticmethod
-    def _element_has_attr_value(attr_value, attr_name='name'):
-        return (
-            f"//*[contains(@{attr_name}, ':{attr_value}') "
-            f"and substring-after(@{attr_name}, ':{attr_value}') = '']"
-        )
+    def _element_has_attr_value(attr_value):
+        return XBRLQuery(attr_value=attr_value)
 
     @staticmethod
-    def _element_has_name_or_attr_value(value, attr_name='name'):
-        return (
-            f"//*[local-name()='{value}' or (contains(@{attr_name}, ':{value}') "
-            f"and substring-after(@{attr_name}, ':{value}') = '')]"
-        )
+    def _element_has_name_or_attr_value(value):
+        return XBRLQuery(name=value, attr_value=value)
 
     # aliases
     _en = _element_has_name.__func__
     _av = _element_has_attr_value.__func__
     _en_av = _element_has_name_or_attr_value.__func__
 
-    # {attribute: ([xpath_expressions], attribute_type)}
+    # {attribute: ([queries], attribute_type)}
     #   attribute: identifier for financial attribute
-    #   xpath_expressions: xpaths that will be tried to locate
+    #   queries: XBRLQuery that will be tried to locate
     #   financial attribute in XBRL tree (until a value is found)
     #   attribute_type: type used to parse the attribute value
     GENERAL_XPATH_MAPPINGS = {
@@ -139,11 +373,7 @@ class XBRLParser:
             [
                 _av('EntityCurrentLegalOrRegisteredName'),
                 _en('EntityCurrentLegalName'),
-                (
-                    "(//*[contains(@name, ':EntityCurrentLegalOrRegisteredName') "
-                    "and substring-after(@name, ':EntityCurrentLegalOrRegisteredName') = '']"
-                    "//*[local-name()='span'])[1]"
-                ),
+                XBRLQuery(attr_value='EntityCurrentLegalOrRegisteredName', first_descendant='span'),
             ],
             str,
         ),
@@ -179,20 +409,14 @@ class XBRLParser:
         'creditors_due_within_one_year': (
             [
                 _av('CreditorsDueWithinOneYear'),
-                (
-                    "//*[contains(@name, ':Creditors') and substring-after(@name, ':Creditors')"
-                    " = '' and contains(@contextRef, 'WithinOneYear')]"
-                ),
+                XBRLQuery(attr_value='Creditors', context_ref_contains='WithinOneYear'),
             ],
             float,
         ),
         'creditors_due_after_one_year': (
             [
                 _av('CreditorsDueAfterOneYear'),
-                (
-                    "//*[contains(@name, ':Creditors') and substring-after(@name, ':Creditors')"
-                    " = '' and contains(@contextRef, 'AfterOneYear')]"
-                ),
+                XBRLQuery(attr_value='Creditors', context_ref_contains='AfterOneYear'),
             ],
             float,
         ),
@@ -214,19 +438,15 @@ class XBRLParser:
         'called_up_share_capital': (
             [
                 _en_av('CalledUpShareCapital'),
-                (
-                    "//*[contains(@name, ':Equity') and substring-after(@name, ':Equity') = '' "
-                    "and contains(@contextRef, 'ShareCapital')]"
-                ),
+                XBRLQuery(attr_value='Equity', context_ref_contains='ShareCapital'),
             ],
             float,
         ),
         'profit_loss_account_reserve': (
             [
                 _en_av('ProfitLossAccountReserve'),
-                (
-                    "//*[contains(@name, ':Equity') and substring-after(@name, ':Equity') = '' "
-                    "and contains(@contextRef, 'RetainedEarningsAccumulatedLosses')]"
+                XBRLQuery(
+                    attr_value='Equity', context_ref_contains='RetainedEarningsAccumulatedLosses'
                 ),
             ],
             float,
@@ -234,10 +454,7 @@ class XBRLParser:
         'shareholder_funds': (
             [
                 _en_av('ShareholderFunds'),
-                (
-                    "//*[contains(@name, ':Equity') and substring-after(@name, ':Equity') = '' "
-                    "and not(contains(@contextRef, 'segment'))]"
-                ),
+                XBRLQuery(attr_value='Equity', context_ref_excludes='segment'),
             ],
             float,
         ),
@@ -299,12 +516,18 @@ class XBRLParser:
 
     def xbrl_to_tsv(self, xbrl_file):
         document = etree.parse(xbrl_file, etree.XMLParser(ns_clean=True))
-        contexts = self._get_contexts(document)
+        index = XBRLIndex(document)
+        contexts = self._get_contexts(index)
         value_by_period = OrderedDict()
 
         # retrieve periodical attribute values
         for attribute in self.PERIODICAL_XPATH_MAPPINGS:
-            self._populate_periodical_attributes(document, contexts, attribute, value_by_period)
+            self._populate_periodical_attributes(index, contexts, attribute, value_by_period)
+
+        # retrieve general attribute values, the same for every period
+        general_values = ['None'] * len(self.columns)
+        for attribute in self.GENERAL_XPATH_MAPPINGS:
+            self._populate_general_attributes(index, attribute, general_values)
 
         # if no periodical attributes found, create empty row for general attributes
         if not value_by_period:
@@ -331,31 +554,32 @@ class XBRLParser:
             row[self.columns.index('period_start')] = period[0]
             row[self.columns.index('period_end')] = period[1]
             for attribute in self.GENERAL_XPATH_MAPPINGS:
-                self._populate_general_attributes(document, attribute, row)
+                column = self.columns.index(attribute)
+                row[column] = general_values[column]
             results.append(row)
         return ['\t'.join(r) + '\n' for r in results]
 
-    def _populate_general_attributes(self, document, attribute, row):
-        xpath_expressions = self.GENERAL_XPATH_MAPPINGS.get(attribute)[0]
-        for xpath in xpath_expressions:
+    def _populate_general_attributes(self, index, attribute, row):
+        queries = self.GENERAL_XPATH_MAPPINGS.get(attribute)[0]
+        for query in queries:
             # retrieve value only if not found already
             if row[self.columns.index(attribute)] == 'None':
-                for e in document.xpath(xpath):
+                for e in index.find(query):
                     attr_type = self._get_attribute_type(
-                        self.GENERAL_XPATH_MAPPINGS, attribute, xpath
+                        self.GENERAL_XPATH_MAPPINGS, attribute, query
                     )
                     row[self.columns.index(attribute)] = self._get_value(e, attr_type)
 
-    def _populate_periodical_attributes(self, document, contexts, attribute, value_by_period):
-        xpath_expressions = self.PERIODICAL_XPATH_MAPPINGS.get(attribute)[0]
-        for xpath in xpath_expressions:
-            for e in document.xpath(xpath):
+    def _populate_periodical_attributes(self, index, contexts, attribute, value_by_period):
+        queries = self.PERIODICAL_XPATH_MAPPINGS.get(attribute)[0]
+        for query in queries:
+            for e in index.find(query):
                 attr_type = self._get_attribute_type(
-                    self.PERIODICAL_XPATH_MAPPINGS, attribute, xpath
+                    self.PERIODICAL_XPATH_MAPPINGS, attribute, query
                 )
-                context_ref_attr = e.xpath('@contextRef')
-                if context_ref_attr:
-                    context = contexts[context_ref_attr[0]]
+                context_ref = e.get('contextRef')
+                if context_ref is not None:
+                    context = contexts[context_ref]
                     if context is not None:
                         dates = self._get_dates(context)
                         if dates != ('None', 'None'):
@@ -375,10 +599,10 @@ class XBRLParser:
         return value_by_period
 
     @staticmethod
-    def _get_attribute_type(mappings, attribute, xpath):
+    def _get_attribute_type(mappings, attribute, query):
         attr_type = mappings.get(attribute)[1]
         if isinstance(attr_type, list):
-            index = mappings.get(attribute)[0].index(xpath)
+            index = mappings.get(attribute)[0].index(query)
             return attr_type[index]
         return attr_type
 
@@ -398,9 +622,9 @@ class XBRLParser:
             return start_date, end_date
 
     @staticmethod
-    def _get_contexts(document):
+    def _get_contexts(index):
         contexts = {}
-        for e in document.xpath("//*[local-name()='context']"):
+        for e in index.find(XBRLQuery(name='context')):
             contexts[e.get('id')] = e.xpath("./*[local-name()='period']")[0]
         return contexts
 
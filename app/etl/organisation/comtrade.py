@@ -18,7 +18,7 @@ class ComtradeCountryCodeAndISOPipeline(L1SnapshotDataPipeline):
     ]
 
     def _datafile_to_l0_temp(self, file_info):
-        self.dbi.dsv_buffer_to_table(
+        self._dsv_buffer_to_staging_table(
             csv_buffer=file_info.data,
             fq_table_name=self._l0_temp_table,
             columns=None,
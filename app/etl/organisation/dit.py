@@ -1,9 +1,6 @@
-from io import BytesIO
-
-from sqlalchemy import text
-
 from app.etl.pipeline_type.incremental_data import L1IncrementalDataPipeline
 from app.etl.pipeline_type.snapshot_data import L1SnapshotDataPipeline
+from app.etl.utils import EmptyQuoteRemover
 
 
 class DITBACIPipeline(L1IncrementalDataPipeline):
@@ -20,10 +17,8 @@ class DITBACIPipeline(L1IncrementalDataPipeline):
     ]
 
     def _datafile_to_l0_temp(self, file_info):
-        self.dbi.dsv_buffer_to_table(
+        self._dsv_buffer_to_l0_temp(
             csv_buffer=file_info.data,
-            fq_table_name=self._l0_temp_table,
-            columns=[c for c, _ in self._l0_data_column_types],
             has_header=True,
             sep=',',
             quote='"',
@@ -119,7 +114,7 @@ class DITEUCountryMembershipPipeline(L1SnapshotDataPipeline):
     ]
 
     def _datafile_to_l0_temp(self, file_info):
-        self.dbi.dsv_buffer_to_table(
+        self._dsv_buffer_to_staging_table(
             csv_buffer=file_info.data,
             fq_table_name=self._l0_temp_table,
             columns=None,
@@ -137,13 +132,19 @@ class DITEUCountryMembershipPipeline(L1SnapshotDataPipeline):
 
     _l0_l1_data_transformations = {}
 
+    # one L0 record (a country) becomes a L1 record per year
+    _l1_unique_column_names = None
+
     def _l0_to_l1(self, datafile_name):
-        l1_column_names = [c for c, _ in self._l1_column_types[1:4]]
+        l1_column_names = [
+            c for c, _ in self._l1_column_types[1:] if c not in ('year', 'tariff_code')
+        ]
         selection = ','.join([self._l0_l1_transformations.get(c, c) for c in l1_column_names])
         column_name_string = ','.join(l1_column_names)
+        l1_table_name = self.dbi.parse_fully_qualified(self._l1_table).table
         stmt = f"""
             ALTER TABLE {self._l1_table} DROP CONSTRAINT IF EXISTS
-                "L1_data_source_row_id_key";
+                "{l1_table_name}_data_source_row_id_key";
             INSERT INTO {self._l1_table} (
                 {column_name_string}, year, tariff_code
             )
@@ -155,7 +156,7 @@ class DITEUCountryMembershipPipeline(L1SnapshotDataPipeline):
                     WHERE datafile_created = '{datafile_name}') AS sq
             JOIN LATERAL json_each_text(sq.line) ON (key ~ '^[1-2]+');
         """
-        self.dbi.execute_statement(text(stmt))
+        return self._execute_statement(stmt)
 
 
 class DITReferencePostcodesPipeline(L1SnapshotDataPipeline):
@@ -179,8 +180,8 @@ class DITReferencePostcodesPipeline(L1SnapshotDataPipeline):
     ]
 
     def _datafile_to_l0_temp(self, file_info):
-        csv_data_no_empty_quotes = BytesIO(file_info.data.read().replace(b'""', b''))
-        self.dbi.dsv_buffer_to_table(
+        csv_data_no_empty_quotes = EmptyQuoteRemover(file_info.data)
+        self._dsv_buffer_to_staging_table(
             csv_buffer=csv_data_no_empty_quotes,
             fq_table_name=self._l0_temp_table,
             columns=None,
@@ -190,4 +191,15 @@ class DITReferencePostcodesPipeline(L1SnapshotDataPipeline):
         )
 
     _l1_data_column_types = _l0_data_column_types
-    _l0_l1_data_transformations = {}
+    _l0_l1_data_transformations = {'postcode_normalised': "lower(replace(postcode, ' ', ''))"}
+
+    @property
+    def l1_helper_columns(self):
+        # lookup key of the postcode API, indexed (see DITReferencePostcodesL1)
+        return super().l1_helper_columns + [('postcode_normalised', 'text')]
+
+    def process(self, file_info, **kwargs):
+        super().process(file_info, **kwargs)
+        # L1 is created without the model indexes when it is recreated with force
+        for index in self._model_indexes(self.L1_TABLE):
+            self._create_model_index(index, self._l1_table, str(index.name))
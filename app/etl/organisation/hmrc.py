@@ -1,10 +1,26 @@
-from io import BytesIO, StringIO
+import io
+import multiprocessing
+import os
+import shutil
+import tempfile
+from functools import partial
 from zipfile import ZipFile
 
-from app.etl.pipeline_type.incremental_data import L1IncrementalDataPipeline
+from app.etl.pipeline_type.incremental_data import CopyPart, L1IncrementalDataPipeline
+from app.etl.utils import IteratorReader
 
 
 class HMRCBasePipeline(L1IncrementalDataPipeline):
+    """Loads zips of monthly zips of HMRC exporters lines
+
+    Options:
+        parse_workers: when greater than 1, the months of a datafile are formatted in this
+            many processes and copied into L0.temp over as many connections (see
+            _parallel_datafile_to_l0_temp). L0 rows are the same as when formatting them
+            in the pipeline process.
+
+    """
+
     organisation = 'hmrc'
 
     _l0_data_column_types = [
@@ -39,47 +55,167 @@ class HMRCBasePipeline(L1IncrementalDataPipeline):
         'export_item_codes': "string_to_array(export_item_codes, ',', '')",
     }
 
+    def set_option_defaults(self, options):
+        options.setdefault('parse_workers', 1)
+        return super().set_option_defaults(options)
+
     def _datafile_to_l0_temp(self, file_info):
+        if self.options.parse_workers > 1:
+            self._parallel_datafile_to_l0_temp(file_info)
+            return
+
         subprocess = DatafileToL0Process()
         subprocess.process(
-            file_info, self.dbi, self._l0_temp_table, [c for c, _ in self._l0_data_column_types]
+            file_info,
+            self.dbi,
+            self._l0_temp_table,
+            [c for c, _ in self._l0_data_column_types],
+            copy=self._dsv_buffer_to_staging_table,
         )
 
+    def _parallel_datafile_to_l0_temp(self, file_info):
+        """Formats the months of the datafile in parse_workers processes
+
+        The datafile is spooled to a temporary directory and each worker formats a member
+        of it, a month, into a csv file of its own. The csv files are then copied into
+        L0.temp over parse_workers connections (see _copy_parts_to_l0_temp), which keeps
+        ids in member order. With max_rejected_rows, they are copied one after another
+        so bad rows can be rejected.
+        """
+        columns = [c for c, _ in self._l0_data_column_types]
+        with tempfile.TemporaryDirectory() as directory:
+            archive_path = os.path.join(directory, 'datafile.zip')
+            with open(archive_path, 'wb') as archive:
+                shutil.copyfileobj(file_info.data, archive)
+            with ZipFile(archive_path) as zf:
+                names = zf.namelist()
+            if not names:
+                return
+            tasks = [
+                (archive_path, name, os.path.join(directory, f'{i}.csv'))
+                for i, name in enumerate(names)
+            ]
+            context = multiprocessing.get_context('fork')
+            with context.Pool(min(len(tasks), self.options.parse_workers)) as pool:
+                num_records = pool.map(_format_member_to_csv, tasks)
+
+            parts = [
+                CopyPart(open_buffer=partial(open, csv_path, 'rb'), num_records=n, has_header=False)
+                for (_, _, csv_path), n in zip(tasks, num_records)
+            ]
+            if self.options.max_rejected_rows is None:
+                self._copy_parts_to_l0_temp(
+                    parts, sep=',', quote='"', null='', workers=self.options.parse_workers
+                )
+                return
+            for part in parts:
+                with part.open_buffer() as csv_data:
+                    self._dsv_buffer_to_staging_table(
+                        csv_data,
+                        self._l0_temp_table,
+                        has_header=False,
+                        null='',
+                        sep=',',
+                        columns=columns,
+                        quote='"',
+                    )
+
+
+def _format_member_to_csv(task):
+    """Formats the exporters lines of a member of a zip of monthly zips into a csv file
+
+    Runs in a parse worker, see HMRCBasePipeline._parallel_datafile_to_l0_temp.
+
+    Args:
+        task: (path of the zip, name of the member, path of the csv file to write)
+    Returns:
+        number of csv lines written
+    """
+    archive_path, name, csv_path = task
+    process = DatafileToL0Process()
+    num_records = 0
+    with ZipFile(archive_path) as zf, open(csv_path, 'w', encoding='utf-8') as csv_file:
+        for line in process._format_lines(process._get_lines_from_member(zf, name)):
+            csv_file.write(line)
+            num_records += 1
+    return num_records
+
 
 class DatafileToL0Process:
-    def process(self, datafile, dbi, table, columns):
+    """Streams the exporters lines of a zip of monthly zips into a COPY
+
+    Members are decompressed and decoded incrementally and the formatted lines are fed
+    to the COPY in chunks of COPY_CHUNK_SIZE bytes, so memory use does not grow with the
+    size of the archive. Inner zips are spooled to a temporary file, in memory up to
+    SPOOL_MAX_SIZE bytes, as zipfile needs a seekable file.
+    """
+
+    COPY_CHUNK_SIZE = 2**20
+    SPOOL_MAX_SIZE = 2**26
+
+    def process(self, datafile, dbi, table, columns, copy=None):
+        """
+        Args:
+            copy: callable with the signature of dbi.dsv_buffer_to_table copying the csv
+                data into table, dbi.dsv_buffer_to_table by default
+        """
         self.dbi = dbi
+        self.copy = copy or dbi.dsv_buffer_to_table
         csv_data = self._get_csv_data(datafile.data)
         self._csv_data_to_l0(csv_data, table, columns)
 
     def _get_lines_from_file_data(self, file_data):
         # we expect the data to represent a zipfile of zipfiles
-        def gen_data(zipfile):
-            for n in zipfile.namelist():
-                yield zipfile.read(n), n
-
-        zf = ZipFile(file_data)
-        for sub_zf_data, n in gen_data(zf):
-            csv_data = (
-                next(gen_data(ZipFile(BytesIO(sub_zf_data))))[0]
-                if n.endswith('.zip')
-                else sub_zf_data
-            )
-            yield from csv_data.decode('mac-roman').splitlines()
+        with ZipFile(file_data) as zf:
+            for n in zf.namelist():
+                yield from self._get_lines_from_member(zf, n)
 
-    def _get_csv_data(self, file_data):
-        rv = StringIO()
-        for line in self._get_lines_from_file_data(file_data):
+    def _get_lines_from_member(self, zf, n):
+        with zf.open(n) as member:
+            if n.endswith('.zip'):
+                yield from self._get_lines_from_inner_zip(member)
+            else:
+                yield from self._decode_lines(member)
+
+    def _get_lines_from_inner_zip(self, member):
+        with tempfile.SpooledTemporaryFile(max_size=self.SPOOL_MAX_SIZE) as spool:
+            shutil.copyfileobj(member, spool)
+            spool.seek(0)
+            with ZipFile(spool) as zf:
+                # only the first member of an inner zip is read
+                for n in zf.namelist()[:1]:
+                    with zf.open(n) as inner_member:
+                        yield from self._decode_lines(inner_member)
+
+    @staticmethod
+    def _decode_lines(stream):
+        # lines are split as str.splitlines splits the whole decoded text
+        for line in io.TextIOWrapper(stream, encoding='mac-roman'):
+            yield from line.splitlines()
+
+    def _format_lines(self, lines):
+        for line in lines:
             formatted_line = self._format_monthly_exporter_file_line(line)
             if formatted_line is not None:
-                rv.write(formatted_line + '\n')
-        rv.seek(0)
-        return rv
+                yield formatted_line + '\n'
+
+    def _get_csv_chunks(self, file_data):
+        lines, size = [], 0
+        for line in self._format_lines(self._get_lines_from_file_data(file_data)):
+            lines.append(line)
+            size += len(line)
+            if size >= self.COPY_CHUNK_SIZE:
+                yield ''.join(lines).encode()
+                lines, size = [], 0
+        if lines:
+            yield ''.join(lines).encode()
+
+    def _get_csv_data(self, file_data):
+        """Returns a binary file-like object of the csv data, generated as it is read"""
+        return io.BufferedReader(IteratorReader(self._get_csv_chunks(file_data)))
 
     def _csv_data_to_l0(self, csv_data, table, columns):
-        self.dbi.dsv_buffer_to_table(
-            csv_data, table, has_header=False, null='', sep=',', columns=columns, quote='"'
-        )
+        self.copy(csv_data, table, has_header=False, null='', sep=',', columns=columns, quote='"')
 
     def _format_monthly_exporter_file_line(self, line):
         values = line.split('\t')
@@ -1,17 +1,38 @@
 import datetime
 import re
 import zipfile
-from io import BytesIO
 
 from datatools.io.fileinfo import FileInfo
+from sqlalchemy import text
 
 from app.etl.pipeline_type.incremental_data import L1IncrementalDataPipeline
+from app.etl.utils import EmptyQuoteRemover
+
+
+def _integer_or_null(column):
+    """SQL expression of a text column as an integer, NULL unless it is all digits"""
+    return f"CASE WHEN {column} ~ '^[0-9]+$' THEN {column}::int END"
 
 
 class ONSPostcodeDirectoryPipeline(L1IncrementalDataPipeline):
+    """Loads the quarterly publications of the ONS Postcode Directory
+
+    Options:
+        delta: only load the postcodes of a publication that are new or changed since the
+            previous publication into L0 and L1, which includes postcodes that were
+            terminated (doterm set) since. Postcodes are compared on pcd and a hash of
+            their L1 data columns with L1.current, which holds the latest row of every
+            postcode of the latest publication, without duplicates. Postcodes dropped
+            from a publication are removed from L1.current. The first publication loaded
+            in delta mode is loaded in full.
+
+    """
+
     organisation = 'ons'
     dataset = 'postcode_directory'
 
+    CURRENT_TABLE = 'L1.current'
+
     _l0_data_column_types = [
         ('pcd', 'text'),
         ('pcd2', 'text'),
@@ -67,6 +88,10 @@ class ONSPostcodeDirectoryPipeline(L1IncrementalDataPipeline):
 
     publication_date = None
 
+    def set_option_defaults(self, options):
+        options.setdefault('delta', False)
+        return super().set_option_defaults(options)
+
     def process(self, file_info, drop_source=True, **kwargs):
         file_regex = r'(.*?)/ONSPD_(?P<date>\w{3}_\d{4})\_UK.csv$'
         zf = zipfile.ZipFile(file_info.data, mode='r')
@@ -84,19 +109,28 @@ class ONSPostcodeDirectoryPipeline(L1IncrementalDataPipeline):
         self.publication_date = datetime.datetime.strftime(date, '%Y-%m-%d')
         csv_file_info = FileInfo(file_info.name, file)
         super().process(csv_file_info, drop_source, **kwargs)
+        if self.options.delta:
+            with self._stage('update_current') as stage:
+                stage.rows = self._update_current_table()
+
+    def create_tables(self, drop_staging_tables=True):
+        super().create_tables(drop_staging_tables=drop_staging_tables)
+        if self.options.delta:
+            self._create_table(
+                self._current_table, self._current_column_types, drop_existing=self.options.force
+            )
 
     def _datafile_to_l0_temp(self, file_info):
-        csv_data_no_empty_quotes_and_date_appended = BytesIO(
-            file_info.data.read().replace(b'""', b'')
-        )
-        self.dbi.dsv_buffer_to_table(
-            csv_buffer=csv_data_no_empty_quotes_and_date_appended,
-            fq_table_name=self._l0_temp_table,
-            columns=[c for c, _ in self._l0_data_column_types],
+        csv_data_no_empty_quotes = EmptyQuoteRemover(file_info.data)
+        self._dsv_buffer_to_l0_temp(
+            csv_buffer=csv_data_no_empty_quotes,
             has_header=True,
             sep=',',
             quote='"',
         )
+        if self.options.delta:
+            with self._stage('l0_temp_delta') as stage:
+                stage.rows = self._delete_unchanged_l0_temp_rows()
 
     _l1_data_column_types = (
         _l0_data_column_types[:3]
@@ -105,10 +139,91 @@ class ONSPostcodeDirectoryPipeline(L1IncrementalDataPipeline):
         + [('publication_date', 'date')]
     )
 
+    @property
+    def l1_helper_columns(self):
+        # grid reference as integers, for the nearest postcodes API (see PostcodeGrid)
+        return super().l1_helper_columns + [('easting', 'int'), ('northing', 'int')]
+
     @property
     def _l0_l1_data_transformations(self):
         return {
             'dointr': "to_date(dointr, 'YYYYMM')",
             'doterm': "to_date(doterm, 'YYYYMM')",
             'publication_date': f"to_date('{self.publication_date}', 'YYYY-MM-DD')",
+            'easting': _integer_or_null('oseast1m'),
+            'northing': _integer_or_null('osnrth1m'),
         }
+
+    # DELTA
+    @property
+    def _current_table(self):
+        return self._fully_qualified(self.CURRENT_TABLE)
+
+    @property
+    def _current_column_types(self):
+        """L1 id and data columns of the latest row of each postcode and its row hash"""
+        data_column_types = [(c, t) for c, t in self._l1_data_column_types if c != 'pcd']
+        return (
+            [('id', 'int'), ('pcd', 'text primary key')]
+            + data_column_types
+            + [('row_hash', 'text')]
+        )
+
+    def _row_hash(self, transformations=None):
+        """SQL expression hashing the L1 data columns but publication_date
+
+        Args:
+            transformations: {l1_column: sql expression of its value} for the columns
+                not selected as they are
+        """
+        transformations = transformations or {}
+        values = ','.join(
+            transformations.get(c, c)
+            for c, _ in self._l1_data_column_types
+            if c != 'publication_date'
+        )
+        return f'md5(ROW({values})::text)'
+
+    def _delete_unchanged_l0_temp_rows(self):
+        """Deletes the postcodes that have not changed since the previous publication
+
+        Postcodes of L1.current that are not in L0.temp are removed from L1.current first.
+
+        Returns:
+            int, number of rows deleted from L0.temp
+        """
+        stmt = f"""
+            DELETE FROM {self._current_table} c
+            WHERE NOT EXISTS (SELECT 1 FROM {self._l0_temp_table} t WHERE t.pcd = c.pcd)
+        """
+        self.dbi.execute_statement(text(stmt), raise_if_fail=True)
+
+        row_hash = self._row_hash(self._l0_l1_data_transformations)
+        stmt = f"""
+            DELETE FROM {self._l0_temp_table} WHERE id IN (
+                SELECT t.id
+                FROM (SELECT id, pcd, {row_hash} AS row_hash FROM {self._l0_temp_table}) t
+                JOIN {self._current_table} c ON c.pcd = t.pcd AND c.row_hash = t.row_hash
+            )
+        """
+        return self._execute_statement(stmt, raise_if_fail=True)
+
+    def _update_current_table(self):
+        """Upserts the rows of the publication loaded into L1 into L1.current
+
+        Returns:
+            int, number of rows upserted
+        """
+        column_names = [c for c, _ in self._current_column_types]
+        column_name_string = ','.join(column_names)
+        selection = ','.join(column_names[:-1] + [self._row_hash()])
+        updates = ','.join(f'{c} = EXCLUDED.{c}' for c in column_names if c != 'pcd')
+        stmt = f"""
+            INSERT INTO {self._current_table} ({column_name_string})
+            SELECT DISTINCT ON (pcd) {selection}
+            FROM {self._l1_table}
+            WHERE publication_date = '{self.publication_date}'
+            ORDER BY pcd, id DESC
+            ON CONFLICT (pcd) DO UPDATE SET {updates}
+        """
+        return self._execute_statement(stmt, raise_if_fail=True)
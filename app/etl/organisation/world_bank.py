@@ -1,5 +1,4 @@
 import time
-from io import BytesIO
 from multiprocessing.pool import ThreadPool as Pool
 
 import psycopg2
@@ -11,6 +10,7 @@ from app.etl.organisation.comtrade import ComtradeCountryCodeAndISOPipeline
 from app.etl.organisation.dit import DITEUCountryMembershipPipeline
 from app.etl.pipeline_type.incremental_data import L1IncrementalDataPipeline
 from app.etl.pipeline_type.snapshot_data import L1SnapshotDataPipeline
+from app.etl.utils import EmptyQuoteRemover
 
 
 def timeit(method):
@@ -37,7 +37,7 @@ class WorldBankBoundRatesPipeline(L1SnapshotDataPipeline):
     ]
 
     def _datafile_to_l0_temp(self, file_info):
-        self.dbi.dsv_buffer_to_table(
+        self._dsv_buffer_to_staging_table(
             csv_buffer=file_info.data,
             fq_table_name=self._l0_temp_table,
             columns=None,
@@ -76,7 +76,7 @@ class WorldBankBoundRatesPipeline(L1SnapshotDataPipeline):
             ORDER BY {grouping}, RIGHT(nomen_code,1)::int DESC
             ON CONFLICT (data_source_row_id) DO NOTHING
         """
-        self.dbi.execute_statement(text(stmt))
+        return self._execute_statement(stmt)
 
 
 class WorldBankTariffPipeline(L1IncrementalDataPipeline):
@@ -96,20 +96,30 @@ class WorldBankTariffPipeline(L1IncrementalDataPipeline):
     _l1_data_column_types = None
 
     def process(self, file_info=None, drop_source=True, **kwargs):
-        self._create_sequence(self._l0_sequence, drop_existing=self.options.force)
-        self._create_table(self._l0_table, self._l0_column_types, drop_existing=self.options.force)
-        self._create_table(self._l0_temp_table, self._l0_column_types, drop_existing=True)
-        self._datafile_to_l0_temp(file_info)
-        datafile_name = file_info.name.split('/')[-1] if file_info else None
-        self.append_l0_temp_to_l0(datafile_name=datafile_name)
-        self.dbi.drop_table(self._l0_temp_table)
+        with self._processing(file_info):
+            self._create_sequence(self._l0_sequence, drop_existing=self.options.force)
+            self._create_table(
+                self._l0_table, self._l0_column_types, drop_existing=self.options.force
+            )
+            self._create_table(
+                self._l0_temp_table,
+                self._l0_column_types,
+                drop_existing=True,
+                unlogged=self.options.unlogged_staging_tables,
+            )
+            self._load_datafile(file_info)
+            datafile_name = file_info.name.split('/')[-1] if file_info else None
+            with self._stage('append_l0') as stage, self._deferred_indexes(
+                self._l0_table, self._l0_temp_table
+            ):
+                stage.rows = self.append_l0_temp_to_l0(datafile_name=datafile_name)
+            self._record_staging_table_size(self._l0_temp_table)
+            self.dbi.drop_table(self._l0_temp_table)
 
     def _datafile_to_l0_temp(self, file_info):
-        csv_data_no_empty_quotes = BytesIO(file_info.data.read().replace(b'""', b''))
-        self.dbi.dsv_buffer_to_table(
+        csv_data_no_empty_quotes = EmptyQuoteRemover(file_info.data)
+        self._dsv_buffer_to_l0_temp(
             csv_buffer=csv_data_no_empty_quotes,
-            fq_table_name=self._l0_temp_table,
-            columns=[c for c, _ in self._l0_data_column_types],
             has_header=True,
             sep=',',
             quote='"',
@@ -127,6 +137,13 @@ class WorldBankTariffTransformPipeline(L1IncrementalDataPipeline):
     subdataset = 'transformed'
     pbar = None
 
+    dependencies = [
+        DITEUCountryMembershipPipeline,
+        ComtradeCountryCodeAndISOPipeline,
+        WorldBankBoundRatesPipeline,
+        WorldBankTariffPipeline,
+    ]
+
     _l0_data_column_types = None
 
     l1_helper_columns = [
@@ -159,11 +176,21 @@ class WorldBankTariffTransformPipeline(L1IncrementalDataPipeline):
     _l0_l1_data_transformations = {}
 
     def process(self, file_info=None, drop_source=True, **kwargs):
-        drop_existing = not self.options.continue_transform
-        self._create_table(self._l1_temp_table, self._l1_column_types, drop_existing=drop_existing)
-        # self.create_indices()  # slows down data insertion a lot
-        self._l0_to_l1()
-        self.finish_processing()
+        with self._processing():
+            resume = self._resume_transform()
+            drop_existing = not (self.options.continue_transform or resume)
+            self._create_table(
+                self._l1_temp_table, self._l1_column_types, drop_existing=drop_existing
+            )
+            if resume:
+                # products after the checkpoint may have been partially inserted
+                self._execute_statement(
+                    f'DELETE FROM {self._l1_temp_table} WHERE product > {int(self.checkpoint)}'
+                )
+            # self.create_indices()  # slows down data insertion a lot
+            with self._stage('l0_to_l1'):
+                self._l0_to_l1()
+            self.finish_processing()
 
     def create_indices(self):
         for field in ['product', 'reporter', 'partner', 'year']:
@@ -224,9 +251,10 @@ class WorldBankTariffTransformPipeline(L1IncrementalDataPipeline):
         p = Pool(processes=10)
         connection_str = str(flask_app.db.engine.url)
         self.pbar = tqdm(total=len(products))
+        results = []
         for i, product in enumerate(products):
             code = str(product[0])
-            p.apply_async(
+            result = p.apply_async(
                 self._clean_and_transform_tariffs,
                 (
                     code,
@@ -234,8 +262,23 @@ class WorldBankTariffTransformPipeline(L1IncrementalDataPipeline):
                     WorldBankBoundRatesPipeline(self.dbi)._l1_table,
                 ),
             )
+            results.append((product[0], result))
         p.close()
-        p.join()
+        try:
+            # products are transformed in order, so every product up to the checkpoint is
+            # in L1.temp; the first failure is raised
+            for product, result in results:
+                result.get()
+                self.save_checkpoint(product)
+        finally:
+            p.terminate()
+            p.join()
+
+    def _resume_transform(self):
+        """Whether L1.temp holds the products of a failed run up to self.checkpoint"""
+        return self.checkpoint is not None and self.dbi.table_exists(
+            self.schema, self.dbi.parse_fully_qualified(self._l1_temp_table).table
+        )
 
     def _fq(self, table_name):
         return self.dbi.to_fully_qualified(table_name, self.schema)
@@ -252,6 +295,8 @@ class WorldBankTariffTransformPipeline(L1IncrementalDataPipeline):
     def get_where_products_clause(self):
         where = ""
         where_clauses = []
+        if self._resume_transform():
+            where_clauses.append(f"product > {int(self.checkpoint)}")
         if self.options.continue_transform or self.options.products:
 
             if self.options.continue_transform:
@@ -264,8 +309,8 @@ class WorldBankTariffTransformPipeline(L1IncrementalDataPipeline):
                     where_clauses.append(f"product = {products[0]}")
                 elif len(products) > 1:
                     where_clauses.append(f"product in {tuple(products)}")
-            if where_clauses:
-                where = 'where ' + ' and '.join(where_clauses)
+        if where_clauses:
+            where = 'where ' + ' and '.join(where_clauses)
         return where
 
     def _get_products(self):
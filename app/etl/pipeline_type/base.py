@@ -1,10 +1,24 @@
+import hashlib
 import re
+import tempfile
 from abc import ABCMeta, abstractmethod
 from collections import namedtuple
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool as Pool
 
+from datatools.io.fileinfo import FileInfo
 from flask import current_app as flask_app
+from psycopg2 import DataError, IntegrityError
 from sqlalchemy import text
 
+from app.etl.utils import (
+    copy_buffer_to_table,
+    CountingReader,
+    FileRangeReader,
+    measure_stage,
+    split_dsv_range,
+)
+
 
 class classproperty(object):
     def __init__(self, f):
@@ -50,6 +64,7 @@ class DataPipeline(metaclass=ABCMeta):
     def __init__(self, dbi, **kwargs):
         self.dbi = dbi
         self.options = self.get_options(kwargs)
+        self.stage_metrics = []
         if not dbi:
             flask_app.logger.error(
                 f'warning: dbi ({dbi}) is not valid; '
@@ -70,9 +85,13 @@ class DataPipeline(metaclass=ABCMeta):
         match = pat.match(name)
         if match:
             num = match.group(1)
-            return self._fully_qualified(f'L{num}')
+            return self._fully_qualified(self._layer_table_name(f'L{num}'))
         raise AttributeError(f'no property named {name}')
 
+    def _layer_table_name(self, table):
+        """Name of the table _lN_table resolves to"""
+        return table
+
     @classproperty
     def id(cls):
         return (
@@ -97,6 +116,16 @@ class DataPipeline(metaclass=ABCMeta):
 
     subdataset, format_version = None, None
 
+    # pipeline classes whose datafiles must be processed before this pipeline runs, see
+    # Manager.pipeline_process_all
+    dependencies = []
+
+    # checkpoint saved by an unfinished run of the datafile being processed, set by the
+    # manager before process is called, see save_checkpoint
+    checkpoint = None
+    # callable persisting a checkpoint, set by the manager
+    on_checkpoint = None
+
     @abstractmethod
     def process(self, fileinfo, **kwargs):
         """Takes a datatools.io.fileinfo.FileInfo object"""
@@ -115,15 +144,847 @@ class DataPipeline(metaclass=ABCMeta):
             return table
         return f'"{self.schema}"."{table}"'
 
+    def _execute_statement(self, stmt, **kwargs):
+        """Executes stmt with dbi.execute_statement
+
+        Returns:
+            int, number of rows affected or None if not known
+        """
+        result = self.dbi.execute_statement(text(stmt), **kwargs)
+        return getattr(result, 'rowcount', None)
+
+    def save_checkpoint(self, checkpoint):
+        """Records how far processing of the current datafile has got
+
+        The manager stores the checkpoint in the datafile registry as it is saved. When
+        processing fails, the next run of the same datafile gets it back as
+        self.checkpoint and can skip the work done so far. The checkpoint is cleared
+        once the datafile is processed.
+
+        Args:
+            checkpoint: JSON serialisable value, e.g. a zip member index, byte offset,
+                product code or chunk id
+        """
+        self.checkpoint = checkpoint
+        if self.on_checkpoint:
+            self.on_checkpoint(checkpoint)
+
+    @contextmanager
+    def _stage(self, stage):
+        """Measures a processing stage and adds it to stage_metrics, see measure_stage"""
+        with measure_stage(stage) as metrics:
+            try:
+                yield metrics
+            finally:
+                self.stage_metrics.append(metrics)
+
 
 class LDataPipeline(DataPipeline, metaclass=ABCMeta):
+    """Abstract class for pipelines that stage data in L0/L1 tables
+
+    Options:
+        unlogged_staging_tables: create the staging tables (L0.temp, L1.temp) as UNLOGGED
+            tables, which skips writing their data to the WAL, and load empty staging
+            tables with COPY FREEZE. Staging tables are dropped at the end of a run, so
+            crash safety and replication of their contents are not needed. The WAL
+            written during a run and the estimated WAL saved are logged.
+        swap_tables: build L0/L1 into shadow tables (L0.shadow, L1.shadow) and swap them
+            with the live tables at the end of a run, so readers never see a partially
+            loaded table. Unless forcing, the shadow tables start as a copy of the live
+            data, which rewrites (and writes to the WAL) the whole table on every run, so
+            it requires force, or delete_previous on snapshot pipelines, where a run
+            replaces the table's data anyway. The indexes declared on the table's
+            SQLAlchemy model are created after the load, then the shadow tables are
+            analyzed and swapped in one transaction. Views on the live tables would be
+            dropped with them, so a run fails before loading anything if there are any.
+        deferred_index_ratio: when appending at least deferred_index_min_rows rows and at
+            least this ratio of the (estimated) rows already in the target table, the
+            secondary indexes of the target table are dropped before the append and
+            rebuilt afterwards, in parallel. The definitions of the dropped indexes are
+            kept in the deferred_indexes table until they are rebuilt, so a run that
+            was killed before rebuilding them has them rebuilt by the next run.
+            Disabled when None.
+        deferred_index_min_rows: see deferred_index_ratio
+        deferred_index_workers: maximum number of indexes rebuilt at a time, each on a
+            connection of its own
+        partition_by_datafile: store L0/L1 as tables list partitioned on datafile_created,
+            with one partition per datafile. A datafile is loaded into a standalone table
+            which is attached as a partition once loaded; reprocessing a datafile replaces
+            its partition and delete_previous drops the partitions of other datafiles
+            instead of deleting rows. L1 gets a datafile_created column. Snapshot data is
+            not deduplicated across datafiles in this layout, each partition holds a full
+            snapshot. Switching an existing table to this layout requires force.
+        l0_to_l1_chunk_size: transform L0 into L1 in chunks of this many L0 ids, each
+            committed in its own transaction together with the last id it covered (in
+            L1.progress). A run interrupted during the transformation resumes after the
+            last committed chunk, as long as neither table was recreated in between.
+            Disabled when None.
+        max_rejected_rows: when set, a COPY into a staging table that fails on bad data
+            is retried on halves of the data until the records that fail on their own
+            are found. Every other record is loaded, the rejected ones are written to
+            L0.rejects with their line number, the error and the datafile. The load
+            fails as before once more than this many records of a datafile are
+            rejected. Disabled when None.
+    """
 
     L0_TABLE = 'L0'
     L1_TABLE = 'L1'
+    SHADOW_SUFFIX = '.shadow'
+    CHUNK_PROGRESS_TABLE = 'L1.progress'
+    REJECTS_TABLE = 'L0.rejects'
+    DEFERRED_INDEXES_TABLE = 'deferred_indexes'
+
+    _unlogged_staging_bytes = None
+    _building_shadow_tables = False
+    _delete_previous_replaces_data = False  # see swap_tables
+    _partition_datafile = None
+    _loading_datafile = None
+    _rejected_rows = 0
+
+    def set_option_defaults(self, options):
+        options.setdefault('unlogged_staging_tables', False)
+        options.setdefault('swap_tables', False)
+        options.setdefault('deferred_index_ratio', None)
+        options.setdefault('deferred_index_min_rows', 100000)
+        options.setdefault('deferred_index_workers', 4)
+        options.setdefault('partition_by_datafile', False)
+        options.setdefault('l0_to_l1_chunk_size', None)
+        options.setdefault('max_rejected_rows', None)
+        options = super().set_option_defaults(options)
+        if options['swap_tables'] and options['partition_by_datafile']:
+            raise ValueError('swap_tables and partition_by_datafile cannot be used together')
+        if (
+            options['swap_tables']
+            and not options['force']
+            and not (self._delete_previous_replaces_data and options['delete_previous'])
+        ):
+            raise ValueError('swap_tables requires force, or delete_previous on snapshot pipelines')
+        return options
 
     @property
     def l1_helper_columns(self):
-        return [
+        columns = [
             ('id', 'serial primary key'),  # primary key
             ('data_source_row_id', 'int'),  # reference to L0 id column
         ]
+        if self.options.partition_by_datafile:
+            columns.append(('datafile_created', 'text'))  # partition key
+        return columns
+
+    @contextmanager
+    def _processing(self, file_info=None):
+        """Wraps a process() run
+
+        See the swap_tables, partition_by_datafile and unlogged_staging_tables options.
+        """
+        with self._shadow_tables(), self._partition(file_info), self._staging_wal_usage():
+            yield
+
+    def _load_datafile(self, file_info):
+        """Runs _datafile_to_l0_temp as the datafile_to_l0_temp stage"""
+        self._loading_datafile = file_info.name.split('/')[-1] if file_info else None
+        self._rejected_rows = 0
+        if self.options.max_rejected_rows is not None and self.checkpoint is None:
+            self._delete_rejects()
+        with self._stage('datafile_to_l0_temp') as stage:
+            if not file_info:
+                self._datafile_to_l0_temp(file_info)
+                return
+            reader = CountingReader(file_info.data)
+            self._datafile_to_l0_temp(FileInfo(file_info.name, reader))
+            stage.bytes_read = reader.bytes_read
+
+    # SHADOW TABLES
+    @property
+    def _swap_layer_tables(self):
+        """The layer tables (L0, L1) this pipeline loads"""
+        layers = [
+            (self.L0_TABLE, '_l0_data_column_types'),
+            (self.L1_TABLE, '_l1_data_column_types'),
+        ]
+        return [table for table, attr in layers if getattr(self, attr, None) is not None]
+
+    def _layer_table_name(self, table):
+        if table in self._swap_layer_tables:
+            if self._building_shadow_tables:
+                return f'{table}{self.SHADOW_SUFFIX}'
+            if self._partition_datafile is not None:
+                return self._partition_table_name(table, self._partition_datafile)
+        return table
+
+    @contextmanager
+    def _shadow_tables(self):
+        """While active, _l0_table and _l1_table resolve to the shadow tables"""
+        if not self.options.swap_tables or self._building_shadow_tables:
+            yield
+            return
+        for table in self._swap_layer_tables:
+            views = self._dependent_views(table)
+            if views:
+                raise ValueError(
+                    f'cannot swap {self._fully_qualified(table)}, '
+                    f"views depend on it: {', '.join(views)}"
+                )
+            self.dbi.drop_table(self._fully_qualified(f'{table}{self.SHADOW_SUFFIX}'))
+        self._seeded_shadow_tables = set()
+        self._building_shadow_tables = True
+        try:
+            yield
+        finally:
+            self._building_shadow_tables = False
+        self._swap_shadow_tables()
+
+    def _dependent_views(self, table):
+        """Names of the views and materialized views that depend on a live layer table"""
+        fq_table = self._fully_qualified(table)
+        stmt = f"""
+            SELECT DISTINCT r.ev_class::regclass::text
+            FROM pg_depend d JOIN pg_rewrite r ON r.oid = d.objid
+            WHERE d.classid = 'pg_rewrite'::regclass
+            AND d.refobjid = to_regclass('{fq_table}')
+            AND r.ev_class <> d.refobjid
+            ORDER BY 1
+        """
+        return [name for name, in self.dbi.execute_query(stmt, raise_if_fail=True)]
+
+    def _seed_shadow_table(self, table_name, column_types):
+        """Copies the live data into a shadow table that has just been created
+
+        Called by _create_table. Nothing is copied when forcing, as the live table would
+        have been dropped, or if table_name is not a shadow table. The copy is a full
+        rewrite of the live table, see swap_tables.
+        """
+        if not self._building_shadow_tables or self.options.force:
+            return
+        shadow_table = self.dbi.parse_fully_qualified(table_name).table
+        if not shadow_table.endswith(self.SHADOW_SUFFIX):
+            return
+        if shadow_table in self._seeded_shadow_tables:
+            return
+        self._seeded_shadow_tables.add(shadow_table)
+        live_table = shadow_table[: -len(self.SHADOW_SUFFIX)]
+        if not self.dbi.table_exists(self.schema, live_table):
+            return
+        column_name_string = ','.join(c for c, _ in column_types)
+        stmt = f"""
+            INSERT INTO {table_name} ({column_name_string})
+            SELECT {column_name_string} FROM {self._fully_qualified(live_table)}
+        """
+        self.dbi.execute_statement(text(stmt), raise_if_fail=True)
+        if any(c == 'id' and 'serial' in t for c, t in column_types):
+            stmt = f"""
+                SELECT setval(
+                    pg_get_serial_sequence('{table_name}', 'id'),
+                    coalesce(max(id), 0) + 1,
+                    false
+                ) FROM {table_name}
+            """
+            self.dbi.execute_statement(text(stmt), raise_if_fail=True)
+
+    def _model_indexes(self, table):
+        """Indexes declared on the SQLAlchemy model of a layer table"""
+        # imported here, the models import the pipelines
+        import app.db.models.external  # noqa: F401
+        from data_engineering.common.db.models import BaseModel
+
+        model_table = BaseModel.metadata.tables.get(f'{self.schema}.{table}')
+        return model_table.indexes if model_table is not None else []
+
+    def _create_shadow_indexes(self, table):
+        """Creates the model indexes on a shadow table
+
+        Index names are unique per schema, so the indexes are created under a temporary
+        name while the live table still exists.
+
+        Returns:
+            dict {temporary index name: model index name}
+        """
+        shadow_table = f'{table}{self.SHADOW_SUFFIX}'
+        index_names = {}
+        for index in self._model_indexes(table):
+            name = str(index.name)
+            shadow_name = f'{shadow_table}.{name}'
+            self._create_model_index(index, self._fully_qualified(shadow_table), shadow_name)
+            index_names[shadow_name] = name
+        return index_names
+
+    def _create_model_index(self, index, table, name=None):
+        """Creates a SQLAlchemy model index on table, Postgres names it if name is None"""
+        columns = ','.join(f'"{c.name}"' for c in index.columns)
+        using = index.dialect_options['postgresql']['using']
+        unique = 'UNIQUE ' if index.unique else ''
+        index_name = f'IF NOT EXISTS "{name}"' if name else ''
+        stmt = f"""
+            CREATE {unique}INDEX {index_name} ON {table}
+            {f'USING {using}' if using else ''} ({columns})
+        """
+        self.dbi.execute_statement(text(stmt), raise_if_fail=True)
+
+    def _shadow_table_relations(self, shadow_table):
+        """Names and kinds of the indexes and owned sequences of a shadow table"""
+        fq_shadow_table = self._fully_qualified(shadow_table)
+        stmt = f"""
+            SELECT c.relname, c.relkind
+            FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE i.indrelid = '{fq_shadow_table}'::regclass
+            UNION ALL
+            SELECT c.relname, c.relkind
+            FROM pg_depend d JOIN pg_class c ON c.oid = d.objid
+            WHERE d.refobjid = '{fq_shadow_table}'::regclass AND c.relkind = 'S'
+        """
+        return self.dbi.execute_query(stmt, raise_if_fail=True)
+
+    def _swap_shadow_tables(self):
+        """Replaces the live layer tables with the shadow tables in one transaction
+
+        The live table is dropped without CASCADE, so the swap fails rather than dropping
+        views created on it since the run started (see _dependent_views). Indexes,
+        constraints and sequences of the shadow table are renamed to the names they would
+        have had if the table had been created as the live table.
+        """
+        stmts = []
+        for table in self._swap_layer_tables:
+            shadow_table = f'{table}{self.SHADOW_SUFFIX}'
+            if not self.dbi.table_exists(self.schema, shadow_table):
+                continue
+            index_names = self._create_shadow_indexes(table)
+            self.dbi.execute_statement(
+                text(f'ANALYZE {self._fully_qualified(shadow_table)}'), raise_if_fail=True
+            )
+            stmts += [
+                f'DROP TABLE IF EXISTS {self._fully_qualified(table)}',
+                f'ALTER TABLE {self._fully_qualified(shadow_table)} RENAME TO "{table}"',
+            ]
+            for name, kind in self._shadow_table_relations(shadow_table):
+                new_name = index_names.get(name, name.replace(shadow_table, table, 1))
+                relation_type = 'SEQUENCE' if kind == 'S' else 'INDEX'
+                stmts.append(
+                    f'ALTER {relation_type} {self._fully_qualified(name)} RENAME TO "{new_name}"'
+                )
+        if stmts:
+            self.dbi.execute_statement(text(';'.join(stmts)), raise_if_fail=True)
+
+    # PARTITIONED TABLES
+    def _partition_table_name(self, table, datafile_name):
+        digest = hashlib.md5(datafile_name.encode()).hexdigest()[:12]
+        return f'{table}.{digest}'
+
+    def _relkind(self, table):
+        stmt = f"SELECT relkind FROM pg_class WHERE oid = to_regclass('{table}')"
+        rows = self.dbi.execute_query(stmt)
+        return rows[0][0] if rows else None
+
+    def _partitions(self, table):
+        """Names of the partitions attached to a partitioned table"""
+        stmt = f"""
+            SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = '{self._fully_qualified(table)}'::regclass
+        """
+        return [name for name, in self.dbi.execute_query(stmt, raise_if_fail=True)]
+
+    @contextmanager
+    def _partition(self, file_info):
+        """While active, _l0_table and _l1_table resolve to this datafile's partitions
+
+        The partition tables are created standalone by the pipeline's _create_table and
+        attached to their partitioned table at the end, in one transaction.
+        """
+        if not self.options.partition_by_datafile or self._partition_datafile is not None:
+            yield
+            return
+        if not file_info:
+            raise ValueError('partition_by_datafile requires a datafile')
+        datafile_name = file_info.name.split('/')[-1]
+        for table in self._swap_layer_tables:
+            fq_table = self._fully_qualified(table)
+            if self.options.force:
+                self.dbi.drop_table(fq_table)
+            elif self._relkind(fq_table) not in (None, 'p'):
+                raise ValueError(
+                    f'{fq_table} is not partitioned, process with force to partition it'
+                )
+            partition = self._partition_table_name(table, datafile_name)
+            self.dbi.drop_table(self._fully_qualified(partition))
+        self._partition_datafile = datafile_name
+        try:
+            yield
+        finally:
+            self._partition_datafile = None
+        self._attach_partitions(datafile_name)
+
+    def _partition_column_types(self, table_name, column_types):
+        """Column types for a partition table created by _create_table
+
+        Ensures the partitioned table exists. Primary keys are only allowed on the
+        partitions and serial columns of a partition draw from the partitioned table's
+        sequence, so ids are unique across partitions.
+        """
+        if self._partition_datafile is None:
+            return column_types
+        table = self.dbi.parse_fully_qualified(table_name).table
+        parents = [
+            t
+            for t in self._swap_layer_tables
+            if self._partition_table_name(t, self._partition_datafile) == table
+        ]
+        if not parents:
+            return column_types
+        fq_parent = self._fully_qualified(parents[0])
+        parent_column_types = [
+            (c, re.sub(r'\s*primary key', '', t, flags=re.IGNORECASE)) for c, t in column_types
+        ]
+        columns = ','.join(f'{c} {t}' for c, t in parent_column_types)
+        stmt = f'''
+            CREATE TABLE IF NOT EXISTS {fq_parent} ({columns})
+            PARTITION BY LIST (datafile_created)
+        '''
+        self.dbi.execute_statement(text(stmt), raise_if_fail=True)
+
+        partition_column_types = []
+        for c, t in column_types:
+            match = re.match(r'(big)?serial', t, flags=re.IGNORECASE)
+            if match:
+                stmt = f"SELECT pg_get_serial_sequence('{fq_parent}', '{c}')"
+                sequence = self.dbi.execute_query(stmt)[0][0]
+                int_type = 'bigint' if match.group(1) else 'int'
+                t = f"{int_type}{t[match.end():]} default nextval('{sequence}')"
+            partition_column_types.append((c, t))
+        return partition_column_types
+
+    def _attach_partitions(self, datafile_name):
+        """Attaches the loaded partition tables and drops partitions of other datafiles
+
+        The CHECK constraint matches the partition constraint, so ATTACH PARTITION does
+        not need to scan the table again while holding its lock on the partitioned table.
+        """
+        stmts = []
+        for table in self._swap_layer_tables:
+            partition = self._partition_table_name(table, datafile_name)
+            fq_partition = self._fully_qualified(partition)
+            if not self.dbi.table_exists(self.schema, partition):
+                continue
+            for index in self._model_indexes(table):
+                self._create_model_index(index, fq_partition)
+            stmt = f"""
+                ALTER TABLE {fq_partition} ADD CONSTRAINT "{partition}_datafile_created_check"
+                CHECK (datafile_created IS NOT NULL AND datafile_created = '{datafile_name}')
+            """
+            self.dbi.execute_statement(text(stmt), raise_if_fail=True)
+            stmts.append(
+                f'ALTER TABLE {self._fully_qualified(table)} ATTACH PARTITION {fq_partition} '
+                f"FOR VALUES IN ('{datafile_name}')"
+            )
+            if not self.options.force and self.options.delete_previous:
+                stmts += [
+                    f'DROP TABLE {self._fully_qualified(p)}'
+                    for p in self._partitions(table)
+                    if p != partition
+                ]
+        if stmts:
+            self.dbi.execute_statement(text(';'.join(stmts)), raise_if_fail=True)
+
+    # CHUNKED L0 TO L1
+    @property
+    def _chunk_progress_table(self):
+        return self._fully_qualified(self.CHUNK_PROGRESS_TABLE)
+
+    def _chunk_progress(self, source_table, target_table, datafile_name=None):
+        """Last source id transformed by an interrupted chunked run, None if there is none
+
+        Progress is ignored once the source or target table has been dropped and
+        recreated, as the ids it refers to are gone, and when either table is unlogged:
+        Postgres truncates unlogged tables after a crash but keeps their oids.
+        """
+        if not self.dbi.table_exists(self.schema, self.CHUNK_PROGRESS_TABLE):
+            return None
+        stmt = f"""
+            SELECT last_id FROM {self._chunk_progress_table}
+            WHERE target_table = '{target_table}' AND datafile = '{datafile_name or ''}'
+            AND source_oid = to_regclass('{source_table}')::oid
+            AND target_oid = to_regclass('{target_table}')::oid
+            AND NOT EXISTS (
+                SELECT 1 FROM pg_class
+                WHERE oid IN (source_oid, target_oid) AND relpersistence = 'u'
+            )
+        """
+        rows = self.dbi.execute_query(stmt, raise_if_fail=True)
+        return rows[0][0] if rows else None
+
+    def _transform_in_chunks(
+        self, build_stmt, source_table, target_table, datafile_name=None, source_filter='TRUE'
+    ):
+        """Runs a statement that reads source_table in chunks of ids
+
+        See the l0_to_l1_chunk_size option. Without it, the statement runs once over the
+        whole table.
+
+        Args:
+            build_stmt: callable taking a sql condition on the source id column and
+                returning the statement transforming the matching rows
+            source_table, target_table: fully qualified table names
+            datafile_name: str, datafile being transformed, progress is kept per datafile
+            source_filter: sql condition selecting the source rows of the datafile
+
+        Returns:
+            int, number of rows affected or None if not known
+        """
+        chunk_size = self.options.l0_to_l1_chunk_size
+        if not chunk_size:
+            return self._execute_statement(build_stmt('TRUE'))
+
+        stmt = f'SELECT min(id), max(id) FROM {source_table} WHERE {source_filter}'
+        min_id, max_id = self.dbi.execute_query(stmt, raise_if_fail=True)[0]
+        if min_id is None:
+            return 0
+        stmt = f"""
+            CREATE TABLE IF NOT EXISTS {self._chunk_progress_table} (
+                target_table text,
+                datafile text,
+                source_oid oid,
+                target_oid oid,
+                last_id bigint,
+                updated_timestamp timestamp,
+                PRIMARY KEY (target_table, datafile)
+            )
+        """
+        self.dbi.execute_statement(text(stmt), raise_if_fail=True)
+        datafile = datafile_name or ''
+        last_id = self._chunk_progress(source_table, target_table, datafile_name)
+        if last_id is not None:
+            flask_app.logger.info(f'{self}: resuming {target_table} after id {last_id}')
+        start = min_id if last_id is None else max(min_id, last_id + 1)
+
+        rows = 0
+        for lower in range(start, max_id + 1, chunk_size):
+            upper = min(lower + chunk_size, max_id + 1)
+            progress = f"""
+                INSERT INTO {self._chunk_progress_table} VALUES (
+                    '{target_table}',
+                    '{datafile}',
+                    to_regclass('{source_table}')::oid,
+                    to_regclass('{target_table}')::oid,
+                    {upper - 1},
+                    now()
+                )
+                ON CONFLICT (target_table, datafile) DO UPDATE SET
+                    source_oid = EXCLUDED.source_oid,
+                    target_oid = EXCLUDED.target_oid,
+                    last_id = EXCLUDED.last_id,
+                    updated_timestamp = EXCLUDED.updated_timestamp
+            """
+            # one transaction, the rowcount is the one of the last statement
+            stmt = ';'.join([progress, build_stmt(f'id >= {lower} AND id < {upper}')])
+            rows += self._execute_statement(stmt, raise_if_fail=True) or 0
+
+        stmt = f"""
+            DELETE FROM {self._chunk_progress_table}
+            WHERE target_table = '{target_table}' AND datafile = '{datafile}'
+        """
+        self.dbi.execute_statement(text(stmt), raise_if_fail=True)
+        return rows
+
+    # BULK APPEND
+    @contextmanager
+    def _deferred_indexes(self, table, source_table):
+        """Drops the secondary indexes of table while appending source_table to it
+
+        Updating every index row by row is much slower than building it once when the
+        batch is large compared to the table. Indexes backing a constraint (primary key,
+        unique) are kept, the append may rely on them (e.g. ON CONFLICT). The dropped
+        indexes are rebuilt even if the append fails, and by the next run if the process
+        dies first (see _rebuild_deferred_indexes).
+        """
+        self._rebuild_deferred_indexes()
+        if self.options.deferred_index_ratio is None:
+            yield
+            return
+        num_rows = self.dbi.execute_query(f'SELECT count(*) FROM {source_table}')[0][0]
+        stmt = f"SELECT greatest(reltuples, 0) FROM pg_class WHERE oid = '{table}'::regclass"
+        table_rows = self.dbi.execute_query(stmt)[0][0]
+        if (
+            num_rows < self.options.deferred_index_min_rows
+            or num_rows < self.options.deferred_index_ratio * table_rows
+        ):
+            yield
+            return
+
+        stmt = f"""
+            SELECT i.indexrelid::regclass::text, pg_get_indexdef(i.indexrelid)
+            FROM pg_index i
+            WHERE i.indrelid = '{table}'::regclass
+            AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = i.indexrelid)
+        """
+        index_definitions = self.dbi.execute_query(stmt, raise_if_fail=True)
+        if not index_definitions:
+            yield
+            return
+        # the definitions are saved in the transaction dropping the indexes
+        stmts = [
+            f"""
+            CREATE TABLE IF NOT EXISTS {self._deferred_indexes_table} (
+                index_name text primary key,
+                table_name text,
+                definition text
+            )
+            """
+        ]
+        for index_name, definition in index_definitions:
+            stmts += [
+                f"""
+                INSERT INTO {self._deferred_indexes_table}
+                VALUES ('{index_name}', '{table}', $${definition}$$)
+                ON CONFLICT (index_name) DO NOTHING
+                """,
+                f'DROP INDEX {index_name}',
+            ]
+        self.dbi.execute_statement(text(';'.join(stmts)), raise_if_fail=True)
+        try:
+            yield
+        finally:
+            self._rebuild_deferred_indexes()
+
+    @property
+    def _deferred_indexes_table(self):
+        return self._fully_qualified(self.DEFERRED_INDEXES_TABLE)
+
+    def _rebuild_deferred_indexes(self):
+        """Rebuilds the indexes dropped by _deferred_indexes that have not been rebuilt
+
+        Indexes of tables that have been dropped since are forgotten.
+        """
+        if not self.dbi.table_exists(self.schema, self.DEFERRED_INDEXES_TABLE):
+            return
+        stmt = f"""
+            SELECT definition FROM {self._deferred_indexes_table}
+            WHERE to_regclass(table_name) IS NOT NULL
+        """
+        # indexes rebuilt before the process died already exist
+        self._create_indexes(
+            [
+                definition.replace(' INDEX ', ' INDEX IF NOT EXISTS ', 1)
+                for definition, in self.dbi.execute_query(stmt)
+            ]
+        )
+        stmt = f'DELETE FROM {self._deferred_indexes_table}'
+        self.dbi.execute_statement(text(stmt), raise_if_fail=True)
+
+    def _create_indexes(self, index_definitions):
+        """Runs CREATE INDEX statements concurrently, see deferred_index_workers"""
+        if not index_definitions:
+            return
+        engine = flask_app.db.engine
+
+        def create_index(stmt):
+            connection = engine.raw_connection()
+            try:
+                connection.cursor().execute(stmt)
+                connection.commit()
+            finally:
+                connection.close()
+
+        workers = min(len(index_definitions), self.options.deferred_index_workers)
+        with Pool(processes=workers) as pool:
+            pool.map(create_index, index_definitions)
+
+    # STAGING TABLES
+    def _dsv_buffer_to_staging_table(
+        self,
+        csv_buffer,
+        fq_table_name,
+        columns=None,
+        has_header=True,
+        sep=',',
+        quote='"',
+        encoding=None,
+        null=None,
+    ):
+        """Copies delimited data into a staging table
+
+        With the unlogged_staging_tables option set, the COPY runs with FREEZE when the
+        table is still empty (see app.etl.utils.copy_buffer_to_table). See the
+        max_rejected_rows option for loading data with bad records.
+        """
+
+        def copy(buffer, has_header):
+            if not self.options.unlogged_staging_tables:
+                kwargs = {'encoding': encoding} if encoding else {}
+                if null is not None:
+                    kwargs['null'] = null
+                self.dbi.dsv_buffer_to_table(
+                    csv_buffer=buffer,
+                    fq_table_name=fq_table_name,
+                    columns=columns,
+                    has_header=has_header,
+                    sep=sep,
+                    quote=quote,
+                    **kwargs,
+                )
+                return
+            connection = flask_app.db.engine.raw_connection()
+            try:
+                copy_buffer_to_table(
+                    connection,
+                    fq_table_name,
+                    buffer,
+                    columns=columns,
+                    has_header=has_header,
+                    sep=sep,
+                    quote=quote,
+                    null=null,
+                    encoding=encoding,
+                    freeze=True,
+                )
+            finally:
+                connection.close()
+
+        if self.options.max_rejected_rows is None:
+            copy(csv_buffer, has_header)
+        else:
+            self._copy_rejecting_bad_rows(copy, csv_buffer, has_header, quote, encoding)
+
+    # REJECTED ROWS
+    @property
+    def _rejects_table(self):
+        return self._fully_qualified(self.REJECTS_TABLE)
+
+    def _copy_rejecting_bad_rows(
+        self, copy, csv_buffer, has_header=False, quote='"', encoding=None
+    ):
+        """Copies delimited data with copy, rejecting the records it fails on
+
+        The data is spooled to a local file and copied whole. If that fails on bad data,
+        the data is split in two on a record boundary and each half is copied on its own,
+        recursively, until the records that fail alone are found. Those are written to
+        L0.rejects, see the max_rejected_rows option.
+
+        Args:
+            copy: callable(buffer, has_header) copying a binary buffer of delimited data
+            csv_buffer: file-like object of the data, text or binary (utf-8 is assumed
+                when text is spooled)
+            has_header: bool, whether the data starts with a header line
+            quote: str, quote character of the data, None if values are not quoted
+            encoding: PostgreSQL name of the encoding of binary data, used to decode
+                rejected records
+        """
+        with tempfile.TemporaryFile() as spool:
+            while True:
+                chunk = csv_buffer.read(2**20)
+                if not chunk:
+                    break
+                spool.write(chunk.encode() if isinstance(chunk, str) else chunk)
+            size = spool.tell()
+            spool.seek(0)
+            try:
+                copy(spool, has_header)
+                return
+            except (DataError, IntegrityError) as e:
+                flask_app.logger.warning(f'{self}: COPY failed, finding the bad records: {e}')
+                error = e
+
+            start, line_number = 0, 1
+            if has_header:
+                header = split_dsv_range(spool, 0, size, quote, at=0)
+                if header is None:
+                    # nothing but the header
+                    raise error
+                start, line_number = header[0], 1 + header[1]
+            self._bisect_copy(copy, spool, start, size, line_number, quote, encoding)
+
+    def _bisect_copy(self, copy, spool, start, end, line_number, quote, encoding):
+        """Copies the bytes [start, end) of spool, bisecting them if the COPY fails
+
+        line_number is the line of the datafile the range starts at.
+        """
+        if start >= end:
+            return
+        try:
+            copy(FileRangeReader(spool.fileno(), start, end), False)
+            return
+        except (DataError, IntegrityError) as e:
+            split = split_dsv_range(spool, start, end, quote)
+            if split is None:
+                spool.seek(start)
+                self._reject_record(spool.read(end - start), line_number, e, encoding)
+                return
+        offset, num_lines = split
+        self._bisect_copy(copy, spool, start, offset, line_number, quote, encoding)
+        self._bisect_copy(copy, spool, offset, end, line_number + num_lines, quote, encoding)
+
+    def _reject_record(self, record, line_number, error, encoding):
+        """Writes a record copy failed on to L0.rejects
+
+        The error is raised again if more than max_rejected_rows records were rejected.
+        """
+        self._rejected_rows += 1
+        if self._rejected_rows > self.options.max_rejected_rows:
+            flask_app.logger.error(
+                f'{self}: more than {self.options.max_rejected_rows} rows rejected'
+            )
+            raise error
+        try:
+            record = record.decode(re.sub('^WIN', 'cp', encoding or 'utf-8'))
+        except (LookupError, UnicodeDecodeError):
+            record = record.decode('utf-8', errors='replace')
+        stmt = f"""
+            CREATE TABLE IF NOT EXISTS {self._rejects_table} (
+                id serial primary key,
+                datafile text,
+                line_number bigint,
+                error text,
+                record text,
+                rejected_timestamp timestamp default now()
+            )
+        """
+        self.dbi.execute_statement(text(stmt), raise_if_fail=True)
+        stmt = text(
+            f"""
+            INSERT INTO {self._rejects_table} (datafile, line_number, error, record)
+            VALUES (:datafile, :line_number, :error, :record)
+            """
+        ).bindparams(
+            datafile=self._loading_datafile,
+            line_number=line_number,
+            error=str(error).strip(),
+            record=record.rstrip('\r\n').replace('\x00', ''),
+        )
+        self.dbi.execute_statement(stmt, raise_if_fail=True)
+        flask_app.logger.warning(f'{self}: rejected line {line_number}: {error}')
+
+    def _delete_rejects(self):
+        """Deletes the rejected records of the datafile being loaded from a previous run"""
+        if self.dbi.table_exists(self.schema, self.REJECTS_TABLE):
+            stmt = text(f'DELETE FROM {self._rejects_table} WHERE datafile = :datafile')
+            self.dbi.execute_statement(
+                stmt.bindparams(datafile=self._loading_datafile), raise_if_fail=True
+            )
+
+    def _record_staging_table_size(self, table):
+        """Adds the size of a staging table about to be dropped to the WAL saving estimate"""
+        if self._unlogged_staging_bytes is None:
+            return
+        stmt = f"SELECT coalesce(pg_total_relation_size(to_regclass('{table}')), 0)"
+        self._unlogged_staging_bytes += self.dbi.execute_query(stmt)[0][0]
+
+    @contextmanager
+    def _staging_wal_usage(self):
+        """Logs the WAL written while processing a datafile
+
+        The WAL saved by unlogged staging tables is estimated as the total size of the
+        staging tables, which is what a logged COPY into them would have written at least.
+        pg_current_wal_lsn is cluster wide, so WAL written by other sessions is included.
+        """
+        if not self.options.unlogged_staging_tables or self._unlogged_staging_bytes is not None:
+            yield
+            return
+        start_lsn = self.dbi.execute_query('SELECT pg_current_wal_lsn()')[0][0]
+        self._unlogged_staging_bytes = 0
+        try:
+            yield
+            stmt = f"SELECT pg_wal_lsn_diff(pg_current_wal_lsn(), '{start_lsn}')"
+            wal_bytes = int(self.dbi.execute_query(stmt)[0][0])
+            flask_app.logger.info(
+                f'{self}: {wal_bytes} bytes of WAL written, unlogged staging tables '
+                f'saved an estimated {self._unlogged_staging_bytes} bytes of WAL'
+            )
+        finally:
+            self._unlogged_staging_bytes = None
@@ -1,6 +1,5 @@
-from io import BytesIO
-
 from app.etl.pipeline_type.incremental_data import L0IncrementalDataPipeline
+from app.etl.utils import EmptyQuoteRemover
 from app.utils import trigger_dataflow_dag
 
 
@@ -16,14 +15,12 @@ class DSVToTablePipeline(L0IncrementalDataPipeline):
         super().__init__(dbi, force=True, **kwargs)
 
     def _datafile_to_l0_temp(self, file_info):
-        csv_data_no_empty_quotes = BytesIO(file_info.data.read().replace(b'""', b''))
-        self.dbi.dsv_buffer_to_table(
+        csv_data_no_empty_quotes = EmptyQuoteRemover(file_info.data)
+        self._dsv_buffer_to_l0_temp(
             csv_buffer=csv_data_no_empty_quotes,
-            fq_table_name=self._l0_temp_table,
             has_header=True,
             sep=self.separator,
             quote=self.quote,
-            columns=[c for c, _ in self._l0_data_column_types],
         )
 
     def _format_column_names(self, column_types):
@@ -1,10 +1,19 @@
+import shutil
+import tempfile
 from abc import abstractmethod
+from collections import namedtuple
+from functools import partial
+from multiprocessing.pool import ThreadPool as Pool
 
+from flask import current_app as flask_app
 from sqlalchemy import text
 
 from app.etl.pipeline_type.base import LDataPipeline
+from app.etl.utils import copy_buffer_to_table, FileRangeReader, split_dsv_into_ranges
 from app.utils import trigger_dataflow_dag
 
+CopyPart = namedtuple('CopyPart', 'open_buffer num_records has_header')
+
 
 class L0IncrementalDataPipeline(LDataPipeline):
     """Abstract class for standard pipelines that ingests data incrementally
@@ -18,8 +27,23 @@ class L0IncrementalDataPipeline(LDataPipeline):
     to process the current data. At the end of the pipeline the temporary data
     is merged with existing L0 data and cleaned up.
 
+    Options:
+        parallel_copy_workers: when greater than 1, delimited datafiles are split into
+            this many ranges which are copied into L0.temp concurrently (see
+            _dsv_buffer_to_l0_temp). L0 ids are the same as with a single COPY. The
+            ranges are not copied with COPY FREEZE (see unlogged_staging_tables).
+
     """
 
+    PART_SEQUENCE_SETTING = 'dss.l0_part_sequence'  # see _copy_parts_to_l0_temp
+
+    def set_option_defaults(self, options):
+        options.setdefault('parallel_copy_workers', 1)
+        options = super().set_option_defaults(options)
+        if options['parallel_copy_workers'] > 1 and options['max_rejected_rows'] is not None:
+            raise ValueError('parallel_copy_workers and max_rejected_rows cannot be used together')
+        return options
+
     @property
     def l0_helper_columns(self):
         return [
@@ -47,35 +71,163 @@ class L0IncrementalDataPipeline(LDataPipeline):
     def _l0_column_types(self):
         return self.l0_helper_columns + self._l0_data_column_types
 
-    def create_tables(self):
+    def create_tables(self, drop_staging_tables=True):
         self._create_sequence(self._l0_sequence, drop_existing=self.options.force)
         self._create_table(self._l0_table, self._l0_column_types, drop_existing=self.options.force)
-        self._create_table(self._l0_temp_table, self._l0_column_types, drop_existing=True)
+        self._create_table(
+            self._l0_temp_table,
+            self._l0_column_types,
+            drop_existing=drop_staging_tables,
+            unlogged=self.options.unlogged_staging_tables,
+        )
 
     def process(self, file_info, drop_source=True, **kwargs):
-        self.create_tables()
-        self._datafile_to_l0_temp(file_info)
-
-        if file_info:  # append and include filename in target table
-            datafile_name = file_info.name.split('/')[-1] if file_info else None
-            self.append_l0_temp_to_l0(datafile_name=datafile_name)
-            self.dbi.drop_table(self._l0_temp_table)
-        else:  # append as is
-            self.dbi.append_table(self._l0_temp_table, self._l0_table, drop_source=True)
-
-    def _create_table(self, table_name, column_types, drop_existing=False):
+        with self._processing(file_info):
+            # when resuming from a checkpoint, L0.temp is kept from the failed run
+            self.create_tables(drop_staging_tables=self.checkpoint is None)
+            self._load_datafile(file_info)
+
+            self._append_l0_temp(file_info)
+
+    def _append_l0_temp(self, file_info):
+        self._record_staging_table_size(self._l0_temp_table)
+        with self._stage('append_l0') as stage, self._deferred_indexes(
+            self._l0_table, self._l0_temp_table
+        ):
+            if file_info:  # append and include filename in target table
+                datafile_name = file_info.name.split('/')[-1] if file_info else None
+                stage.rows = self.append_l0_temp_to_l0(datafile_name=datafile_name)
+                self.dbi.drop_table(self._l0_temp_table)
+            else:  # append as is
+                self.dbi.append_table(self._l0_temp_table, self._l0_table, drop_source=True)
+
+    def _create_table(self, table_name, column_types, drop_existing=False, unlogged=False):
         if drop_existing:
             self.dbi.drop_table(table_name)
+        column_types = self._partition_column_types(table_name, column_types)
         columns = ','.join(f'{c} {t}' for c, t in column_types)
-        stmt = f'CREATE TABLE IF NOT EXISTS {table_name} ({columns})'
+        table_type = 'UNLOGGED TABLE' if unlogged else 'TABLE'
+        stmt = f'CREATE {table_type} IF NOT EXISTS {table_name} ({columns})'
         self.dbi.execute_statement(text(stmt))
+        self._seed_shadow_table(table_name, column_types)
 
-    def _create_sequence(self, sequence_name, drop_existing=False):
+    def _create_sequence(self, sequence_name, drop_existing=False, start=None):
         if drop_existing:
             self.dbi.drop_sequence(sequence_name)
-        stmt = f'CREATE SEQUENCE IF NOT EXISTS {sequence_name}'
+        start_with = f' START WITH {start}' if start is not None else ''
+        stmt = f'CREATE SEQUENCE IF NOT EXISTS {sequence_name}{start_with}'
         self.dbi.execute_statement(text(stmt))
 
+    # DATA TO L0.temp
+    def _dsv_buffer_to_l0_temp(self, csv_buffer, has_header=True, sep=',', quote='"'):
+        """Copies delimited data into the L0.temp data columns
+
+        With the parallel_copy_workers option set, the data is spooled to a local file,
+        split into ranges on record boundaries and each range is copied concurrently.
+        """
+        if self.options.parallel_copy_workers > 1:
+            self._parallel_dsv_buffer_to_l0_temp(csv_buffer, has_header, sep, quote)
+        else:
+            self._dsv_buffer_to_staging_table(
+                csv_buffer=csv_buffer,
+                fq_table_name=self._l0_temp_table,
+                columns=[c for c, _ in self._l0_data_column_types],
+                has_header=has_header,
+                sep=sep,
+                quote=quote,
+            )
+
+    def _parallel_dsv_buffer_to_l0_temp(self, csv_buffer, has_header, sep, quote):
+        with tempfile.TemporaryFile() as spool:
+            shutil.copyfileobj(csv_buffer, spool)
+            spool.flush()
+            ranges = split_dsv_into_ranges(
+                spool, self.options.parallel_copy_workers, has_header=has_header, quote=quote
+            )
+            parts = [
+                CopyPart(
+                    open_buffer=partial(FileRangeReader, spool.fileno(), r.start, r.end),
+                    num_records=r.num_records,
+                    has_header=has_header and i == 0,
+                )
+                for i, r in enumerate(ranges)
+            ]
+            self._copy_parts_to_l0_temp(parts, sep=sep, quote=quote)
+
+    def _copy_parts_to_l0_temp(self, parts, sep=',', quote='"', null=None, workers=None):
+        """Copies parts of a datafile into L0.temp concurrently, one connection per part
+
+        A block of ids is reserved up front and each part draws its ids from a sequence
+        starting at the part's offset in the block: while the parts are copied, the
+        default of the L0.temp id column takes the sequence named in a setting of the
+        connection. Ids are therefore identical to copying the parts one after another,
+        and every row is written once. The parts are not copied with COPY FREEZE, which
+        needs the table to be created or truncated in the copying transaction.
+
+        Args:
+            parts: list of CopyPart(open_buffer, num_records, has_header) tuples, where
+                open_buffer is a callable returning a file-like object for the part
+            sep, quote, null: delimited data format shared by all parts
+            workers: number of parts copied at a time, parallel_copy_workers by default
+        """
+        num_records = sum(part.num_records for part in parts)
+        first_id = self.dbi.execute_query(
+            f"SELECT nextval('{self._l0_sequence}')", raise_if_fail=True
+        )[0][0]
+        # reserve ids first_id ... first_id + num_records - 1
+        self.dbi.execute_statement(
+            text(f"SELECT setval('{self._l0_sequence}', {first_id + num_records}, false)"),
+            raise_if_fail=True,
+        )
+
+        part_sequences, start = [], first_id
+        for i, part in enumerate(parts):
+            part_sequence = f'"{self.schema}"."{self.L0_TABLE}_SEQUENCE.part{i}"'
+            self._create_sequence(part_sequence, drop_existing=True, start=start)
+            part_sequences.append(part_sequence)
+            start += part.num_records
+
+        columns = [c for c, _ in self._l0_data_column_types]
+        engine = flask_app.db.engine
+
+        def copy_part(args):
+            part, part_sequence = args
+            connection = engine.raw_connection()
+            try:
+                cursor = connection.cursor()
+                cursor.execute(
+                    f"SELECT set_config('{self.PART_SEQUENCE_SETTING}', %s, false)",
+                    (part_sequence,),
+                )
+                with part.open_buffer() as buffer:
+                    copy_buffer_to_table(
+                        connection,
+                        self._l0_temp_table,
+                        buffer,
+                        columns=columns,
+                        has_header=part.has_header,
+                        sep=sep,
+                        quote=quote,
+                        null=null,
+                    )
+            finally:
+                connection.close()
+
+        part_id_default = f"nextval(current_setting('{self.PART_SEQUENCE_SETTING}')::regclass)"
+        self._set_l0_temp_id_default(part_id_default)
+        try:
+            workers = workers or self.options.parallel_copy_workers
+            with Pool(processes=min(len(parts), workers)) as pool:
+                pool.map(copy_part, zip(parts, part_sequences))
+        finally:
+            self._set_l0_temp_id_default(f"nextval('{self._l0_sequence}')")
+            for part_sequence in part_sequences:
+                self.dbi.drop_sequence(part_sequence)
+
+    def _set_l0_temp_id_default(self, default):
+        stmt = f'ALTER TABLE {self._l0_temp_table} ALTER COLUMN id SET DEFAULT {default}'
+        self.dbi.execute_statement(text(stmt), raise_if_fail=True)
+
     # append L0.temp TO L0
     def append_l0_temp_to_l0(self, datafile_name):
         l0_data_column_names = [c for c, _ in self._l0_data_column_types]
@@ -94,7 +246,7 @@ class L0IncrementalDataPipeline(LDataPipeline):
                 {selection}
             FROM {self._l0_temp_table}
         """
-        self.dbi.execute_statement(text(stmt))
+        return self._execute_statement(stmt)
 
     def trigger_dataflow_dag(self):
         return trigger_dataflow_dag(self.schema, self.L0_TABLE)
@@ -136,24 +288,34 @@ class L1IncrementalDataPipeline(L0IncrementalDataPipeline):
     def _l1_column_types(self):
         return self.l1_helper_columns + self._l1_data_column_types
 
-    def create_tables(self):
-        super().create_tables()
+    def create_tables(self, drop_staging_tables=True):
+        super().create_tables(drop_staging_tables=drop_staging_tables)
         self._create_sequence(self._l1_sequence, drop_existing=self.options.force)
         self._create_table(self._l1_table, self._l1_column_types, drop_existing=self.options.force)
-        self._create_table(self._l1_temp_table, self._l1_column_types, drop_existing=True)
+        self._create_table(
+            self._l1_temp_table,
+            self._l1_column_types,
+            drop_existing=drop_staging_tables,
+            unlogged=self.options.unlogged_staging_tables,
+        )
 
     def process(self, file_info, drop_source=True, **kwargs):
-        self.create_tables()
-        self._datafile_to_l0_temp(file_info)
-        self._l0_to_l1()
-
-        if file_info:  # append and include filename in target table
-            datafile_name = file_info.name.split('/')[-1] if file_info else None
-            self.append_l0_temp_to_l0(datafile_name=datafile_name)
-            self.dbi.drop_table(self._l0_temp_table)
-        else:  # append as is
-            self.dbi.append_table(self._l0_temp_table, self._l0_table, drop_source=True)
-        self.dbi.append_table(source_table=self._l1_temp_table, target_table=self._l1_table)
+        with self._processing(file_info):
+            if self._resume_l0_to_l1(file_info):
+                # L0.temp and L1.temp are kept from the interrupted run
+                self.create_tables(drop_staging_tables=False)
+            else:
+                self.create_tables()
+                self._load_datafile(file_info)
+            with self._stage('l0_to_l1') as stage:
+                stage.rows = self._l0_to_l1(file_info)
+
+            self._append_l0_temp(file_info)
+            self._record_staging_table_size(self._l1_temp_table)
+            with self._stage('append_l1'), self._deferred_indexes(
+                self._l1_table, self._l1_temp_table
+            ):
+                self.dbi.append_table(source_table=self._l1_temp_table, target_table=self._l1_table)
 
     # LO.temp TO L1.temp
     @property
@@ -170,23 +332,45 @@ class L1IncrementalDataPipeline(L0IncrementalDataPipeline):
     def _l0_l1_transformations(self):
         """Include transformation for id and a data_source_row_id that references the L0 record"""
         transformations = {'id': f"nextval('{self._l1_sequence}')", 'data_source_row_id': 'id'}
+        if self._partition_datafile is not None:
+            # L0.temp rows only get their datafile_created when appended to L0
+            transformations['datafile_created'] = f"'{self._partition_datafile}'"
         transformations.update(self._l0_l1_data_transformations)
         return transformations
 
-    def _l0_to_l1(self):
+    def _resume_l0_to_l1(self, file_info):
+        """Whether a chunked _l0_to_l1 of this datafile was interrupted and can resume"""
+        if not self.options.l0_to_l1_chunk_size:
+            return False
+        last_id = self._chunk_progress(
+            self._l0_temp_table, self._l1_temp_table, self._datafile_name(file_info)
+        )
+        return last_id is not None
+
+    @staticmethod
+    def _datafile_name(file_info):
+        return file_info.name.split('/')[-1] if file_info else None
+
+    def _l0_to_l1(self, file_info=None):
         l1_column_names = [c for c, _ in self._l1_column_types]
         selection = ','.join([self._l0_l1_transformations.get(c, c) for c in l1_column_names])
         column_name_string = ','.join(l1_column_names)
-        stmt = f"""
-            INSERT INTO {self._l1_temp_table}
-            (
-                {column_name_string}
-            )
-            SELECT
-                {selection}
-            FROM {self._l0_temp_table}
-        """
-        self.dbi.execute_statement(text(stmt))
+
+        def build_stmt(id_condition):
+            return f"""
+                INSERT INTO {self._l1_temp_table}
+                (
+                    {column_name_string}
+                )
+                SELECT
+                    {selection}
+                FROM {self._l0_temp_table}
+                WHERE {id_condition}
+            """
+
+        return self._transform_in_chunks(
+            build_stmt, self._l0_temp_table, self._l1_temp_table, self._datafile_name(file_info)
+        )
 
     def trigger_dataflow_dag(self):
         return trigger_dataflow_dag(self.schema, self.L1_TABLE)
@@ -33,3 +33,22 @@ class RebuildSchemaPipeline(DataPipeline):
     def sql_alchemy_model(cls):
         '''data model for this table'''
         ...
+
+    @classproperty
+    def dependencies(cls):
+        '''pipelines loading the tables this table has foreign keys to'''
+        model_table = getattr(cls.sql_alchemy_model, '__table__', None)
+        if model_table is None:
+            return []
+        referred_tables = {fk.column.table for fk in model_table.foreign_keys} - {model_table}
+        return [
+            pipeline
+            for pipeline in _subclasses(RebuildSchemaPipeline)
+            if getattr(pipeline.sql_alchemy_model, '__table__', None) in referred_tables
+        ]
+
+
+def _subclasses(cls):
+    for subclass in cls.__subclasses__():
+        yield subclass
+        yield from _subclasses(subclass)
@@ -22,6 +22,8 @@ class L0SnapshotDataPipeline(LDataPipeline):
             snapshot file in which the record was present
     """
 
+    _delete_previous_replaces_data = True
+
     @property
     def l0_helper_columns(self):
         return [
@@ -55,7 +57,12 @@ class L0SnapshotDataPipeline(LDataPipeline):
     def l0_process(self, file_info):
         datafile_name = file_info.name.split('/')[-1]
 
-        self._create_table(self._l0_temp_table, self._l0_data_column_types, drop_existing=True)
+        self._create_table(
+            self._l0_temp_table,
+            self._l0_data_column_types,
+            drop_existing=True,
+            unlogged=self.options.unlogged_staging_tables,
+        )
         self._create_table(
             self._l0_table,
             self._l0_column_types,
@@ -63,28 +70,54 @@ class L0SnapshotDataPipeline(LDataPipeline):
             drop_existing=self.options.force,
         )
 
-        self._datafile_to_l0_temp(file_info)
-        self._l0_temp_to_l0(datafile_name)
+        self._load_datafile(file_info)
+        with self._stage('l0_temp_to_l0') as stage, self._deferred_indexes(
+            self._l0_table, self._l0_temp_table
+        ):
+            stage.rows = self._l0_temp_to_l0(datafile_name)
 
+        self._record_staging_table_size(self._l0_temp_table)
         self.dbi.drop_table(self._l0_temp_table)
 
     def process(self, file_info, **kwargs):
-        self.l0_process(file_info)
+        with self._processing(file_info):
+            self.l0_process(file_info)
 
-        if not self.options.force and self.options.delete_previous:
-            self._delete_from_l0(file_info.name.split('/')[-1])
+            if self._delete_previous_rows:
+                with self._stage('delete_previous') as stage:
+                    stage.rows = self._delete_from_l0(file_info.name.split('/')[-1])
 
     def _create_table(
-        self, table_name, column_types, unique_column_names=None, drop_existing=False
+        self,
+        table_name,
+        column_types,
+        unique_column_names=None,
+        drop_existing=False,
+        unlogged=False,
     ):
         if drop_existing:
             self.dbi.drop_table(table_name)
+        column_types = self._partition_column_types(table_name, column_types)
         columns = ','.join(f'{c} {t}' for c, t in column_types)
         unique_constraint = (
             f", UNIQUE({','.join(unique_column_names)})" if unique_column_names else None
         )
-        stmt = f"CREATE TABLE IF NOT EXISTS {table_name} ({columns}{unique_constraint or ''})"
+        table_type = 'UNLOGGED TABLE' if unlogged else 'TABLE'
+        stmt = (
+            f"CREATE {table_type} IF NOT EXISTS {table_name} "
+            f"({columns}{unique_constraint or ''})"
+        )
         self.dbi.execute_statement(text(stmt))
+        self._seed_shadow_table(table_name, column_types)
+
+    @property
+    def _delete_previous_rows(self):
+        """Partitions of previous datafiles are dropped instead, see _attach_partitions"""
+        return (
+            not self.options.force
+            and self.options.delete_previous
+            and not self.options.partition_by_datafile
+        )
 
     # DATA TO L0.temp
     @abstractmethod
@@ -126,7 +159,7 @@ class L0SnapshotDataPipeline(LDataPipeline):
             ON CONFLICT ({data_hash})
             DO UPDATE SET datafile_updated = '{datafile_name}'
         """
-        self.dbi.execute_statement(text(stmt))
+        return self._execute_statement(stmt)
 
     def _delete_from_l0(self, file_name):
         delete = f"""
@@ -142,7 +175,7 @@ class L0SnapshotDataPipeline(LDataPipeline):
                         where dl0.id = l0.id
                     )
                 """
-        self.dbi.execute_statement(text(delete))
+        return self._execute_statement(delete)
 
     def trigger_dataflow_dag(self):
         return trigger_dataflow_dag(self.schema, self.L0_TABLE)
@@ -178,21 +211,29 @@ class L1SnapshotDataPipeline(L0SnapshotDataPipeline):
     def _l1_column_types(self):
         return self.l1_helper_columns + self._l1_data_column_types
 
-    def process(self, file_info, **kwargs):
-        super().l0_process(file_info)
+    # L1 records are unique per L0 record, _l0_to_l1 relies on this (ON CONFLICT)
+    _l1_unique_column_names = ['data_source_row_id']
 
-        datafile_name = file_info.name.split('/')[-1]
-        self._create_table(
-            self._l1_table,
-            self._l1_column_types,
-            unique_column_names=['data_source_row_id'],
-            drop_existing=self.options.force,
-        )
-        self._l0_to_l1(datafile_name)
+    def process(self, file_info, **kwargs):
+        with self._processing(file_info):
+            super().l0_process(file_info)
+
+            datafile_name = file_info.name.split('/')[-1]
+            self._create_table(
+                self._l1_table,
+                self._l1_column_types,
+                unique_column_names=self._l1_unique_column_names,
+                drop_existing=self.options.force,
+            )
+            with self._stage('l0_to_l1') as stage:
+                stage.rows = self._l0_to_l1(datafile_name)
 
-        if not self.options.force and self.options.delete_previous:
-            self._delete_from_l1(datafile_name)
-            self._delete_from_l0(datafile_name)
+            if self._delete_previous_rows:
+                with self._stage('delete_previous') as stage:
+                    l1_rows = self._delete_from_l1(datafile_name)
+                    l0_rows = self._delete_from_l0(datafile_name)
+                    if l1_rows is not None and l0_rows is not None:
+                        stage.rows = l1_rows + l0_rows
 
     # LO TO L1
     @property
@@ -217,18 +258,24 @@ class L1SnapshotDataPipeline(L0SnapshotDataPipeline):
         l1_column_names = [c for c, _ in self._l1_column_types[1:]]
         selection = ','.join([self._l0_l1_transformations.get(c, c) for c in l1_column_names])
         column_name_string = ','.join(l1_column_names)
-        stmt = f"""
-            INSERT INTO {self._l1_table}
-            (
-                {column_name_string}
-            )
-            SELECT DISTINCT
-                {selection}
-            FROM {self._l0_table}
-            WHERE datafile_created = '{datafile_name}'
-            ON CONFLICT (data_source_row_id) DO NOTHING
-        """
-        self.dbi.execute_statement(text(stmt))
+        source_filter = f"datafile_created = '{datafile_name}'"
+
+        def build_stmt(id_condition):
+            return f"""
+                INSERT INTO {self._l1_table}
+                (
+                    {column_name_string}
+                )
+                SELECT DISTINCT
+                    {selection}
+                FROM {self._l0_table}
+                WHERE {source_filter} AND {id_condition}
+                ON CONFLICT (data_source_row_id) DO NOTHING
+            """
+
+        return self._transform_in_chunks(
+            build_stmt, self._l0_table, self._l1_table, datafile_name, source_filter
+        )
 
     def _delete_from_l1(self, file_name):
         delete = f"""
@@ -252,7 +299,7 @@ class L1SnapshotDataPipeline(L0SnapshotDataPipeline):
                 where dl1.l1_id = l1.id
             )
         """
-        self.dbi.execute_statement(text(delete))
+        return self._execute_statement(delete)
 
     def trigger_dataflow_dag(self):
         return trigger_dataflow_dag(self.schema, self.L1_TABLE)
@@ -0,0 +1,347 @@
+import datetime
+import io
+import os
+import resource
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+
+class EmptyQuoteRemover(io.RawIOBase):
+    """Read-only file-like wrapper that removes empty quotes (`""`) from a byte stream
+
+    Behaves like `BytesIO(stream.read().replace(b'""', b''))` but reads the wrapped
+    stream in chunks, so memory usage stays constant regardless of the file size.
+
+    A run of quotes at the end of a chunk is held back until the next chunk has been
+    read, which means pairs that straddle a chunk boundary are removed exactly as they
+    would be if the whole file was processed at once.
+    """
+
+    QUOTE = b'"'
+    EMPTY_QUOTES = b'""'
+    CHUNK_SIZE = 2**20
+
+    def __init__(self, stream, chunk_size=CHUNK_SIZE):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self._pending_quotes = b''
+        self._buffer = b''
+        self._offset = 0
+        self._eof = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while self._offset == len(self._buffer) and not self._eof:
+            self._fill_buffer()
+        size = min(len(b), len(self._buffer) - self._offset)
+        b[:size] = self._buffer[self._offset : self._offset + size]
+        self._offset += size
+        return size
+
+    def _fill_buffer(self):
+        chunk = self.stream.read(self.chunk_size)
+        data = self._pending_quotes + chunk
+        if chunk:
+            # hold back trailing quotes, they may pair up with quotes in the next chunk
+            without_trailing_quotes = data.rstrip(self.QUOTE)
+            self._pending_quotes = data[len(without_trailing_quotes) :]
+            data = without_trailing_quotes
+        else:
+            self._eof = True
+            self._pending_quotes = b''
+        self._buffer = data.replace(self.EMPTY_QUOTES, b'')
+        self._offset = 0
+
+
+class IteratorReader(io.RawIOBase):
+    """Read-only binary file-like object over an iterator of bytes chunks
+
+    Only the chunk being read is held in memory, so data generated on the fly can be
+    streamed to a COPY.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._chunk = b''
+        self._offset = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while self._offset >= len(self._chunk):
+            self._chunk = next(self._chunks, None)
+            self._offset = 0
+            if self._chunk is None:
+                self._chunk = b''
+                return 0
+        data = self._chunk[self._offset : self._offset + len(b)]
+        b[: len(data)] = data
+        self._offset += len(data)
+        return len(data)
+
+
+DSVRange = namedtuple('DSVRange', 'start end num_records')
+
+
+def split_dsv_into_ranges(stream, num_ranges, has_header=False, quote='"', chunk_size=2**20):
+    """Splits a seekable delimited file into byte ranges that end on record boundaries
+
+    The file is scanned once, line by line, keeping track of whether the scan is inside a
+    quoted value so that line breaks inside quoted values are never used as a split point.
+
+    Args:
+        stream: seekable binary file object
+        num_ranges: int, maximum number of ranges to return
+        has_header: bool, the header line is kept in the first range but not counted
+        quote: str, quote character used in the file, None if values are not quoted
+        chunk_size: int, number of bytes to read at a time
+
+    Returns:
+        list of DSVRange(start, end, num_records) tuples covering the whole file
+    """
+    stream.seek(0, io.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+
+    quote = quote.encode() if isinstance(quote, str) else quote
+    targets = [size * i // num_ranges for i in range(1, num_ranges)]
+    ranges = []
+    range_start, position, num_records = 0, 0, 0
+    in_quotes, is_header = False, has_header
+    remainder = b''
+    while True:
+        chunk = stream.read(chunk_size)
+        if chunk:
+            lines = (remainder + chunk).split(b'\n')
+            remainder = lines.pop()
+            line_ends = [1] * len(lines)
+        else:
+            lines = [remainder] if remainder else []
+            line_ends = [0] * len(lines)
+        for line, line_end in zip(lines, line_ends):
+            position += len(line) + line_end
+            if quote and line.count(quote) % 2:
+                in_quotes = not in_quotes
+            if in_quotes:
+                continue
+            if is_header:
+                is_header = False
+            else:
+                num_records += 1
+            if targets and position >= targets[0]:
+                ranges.append(DSVRange(range_start, position, num_records))
+                range_start, num_records = position, 0
+                while targets and targets[0] <= position:
+                    targets.pop(0)
+        if not chunk:
+            break
+    if range_start < size or not ranges:
+        ranges.append(DSVRange(range_start, size, num_records))
+    stream.seek(0)
+    return ranges
+
+
+def split_dsv_range(stream, start, end, quote='"', at=None, chunk_size=2**20):
+    """Splits the byte range [start, end) of a delimited file in two on a record boundary
+
+    The range is scanned from start, as in split_dsv_into_ranges, up to the first record
+    boundary at or after at, or to its end if there is none.
+
+    Args:
+        stream: seekable binary file object
+        start, end: int, byte offsets of the range, start must be a record boundary
+        quote: str, quote character used in the file, None if values are not quoted
+        at: int, byte offset to split at, the middle of the range by default
+        chunk_size: int, number of bytes to read at a time
+
+    Returns:
+        (offset, num_lines): offset of the split and number of lines before it, or None
+        if the range holds a single record
+    """
+    quote = quote.encode() if isinstance(quote, str) else quote
+    at = start + (end - start) // 2 if at is None else at
+    split = None
+    position, num_lines, in_quotes = start, 0, False
+    remainder = b''
+    stream.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        chunk = stream.read(min(chunk_size, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        lines = (remainder + chunk).split(b'\n')
+        remainder = lines.pop()
+        for line in lines:
+            position += len(line) + 1
+            num_lines += 1
+            if quote and line.count(quote) % 2:
+                in_quotes = not in_quotes
+            if in_quotes or position >= end:
+                continue
+            split = position, num_lines
+            if position >= at:
+                return split
+    return split
+
+
+class FileRangeReader(io.RawIOBase):
+    """Read-only file-like view of the bytes [start, end) of an open file
+
+    Reads use os.pread, which does not move the file offset, so several readers can
+    share one file descriptor from different threads.
+    """
+
+    def __init__(self, fileno, start, end):
+        self._fileno = fileno
+        self.position = start
+        self.end = end
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        size = min(len(b), self.end - self.position)
+        if size <= 0:
+            return 0
+        data = os.pread(self._fileno, size, self.position)
+        b[: len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+
+def copy_from_stdin_statement(
+    fq_table_name,
+    columns=None,
+    has_header=False,
+    sep=',',
+    quote='"',
+    null=None,
+    encoding=None,
+    freeze=False,
+):
+    """Returns a COPY ... FROM STDIN statement for csv formatted data"""
+    options = ['FORMAT csv', f"HEADER {'true' if has_header else 'false'}", f"DELIMITER '{sep}'"]
+    if quote:
+        options.append(f"QUOTE '{quote}'")
+    if null is not None:
+        options.append(f"NULL '{null}'")
+    if encoding:
+        options.append(f"ENCODING '{encoding}'")
+    if freeze:
+        options.append('FREEZE true')
+    column_string = f" ({','.join(columns)})" if columns else ''
+    return f"COPY {fq_table_name}{column_string} FROM STDIN WITH ({', '.join(options)})"
+
+
+def copy_buffer_to_table(
+    connection,
+    fq_table_name,
+    buffer,
+    columns=None,
+    has_header=False,
+    sep=',',
+    quote='"',
+    null=None,
+    encoding=None,
+    freeze=False,
+):
+    """Copies csv data into a table on a raw DBAPI connection and commits
+
+    COPY FREEZE is only allowed when the table was created or truncated in the same
+    transaction. With freeze set, an empty table is therefore truncated first, in the
+    same transaction as the COPY, and the rows are written already frozen so they are
+    not rewritten later by vacuum or when hint bits are set. Tables that already
+    contain rows are copied into normally.
+    """
+    cursor = connection.cursor()
+    if freeze:
+        cursor.execute(f'SELECT NOT EXISTS (SELECT 1 FROM {fq_table_name})')
+        freeze = cursor.fetchone()[0]
+        if freeze:
+            cursor.execute(f'TRUNCATE {fq_table_name}')
+    stmt = copy_from_stdin_statement(
+        fq_table_name, columns, has_header, sep, quote, null, encoding, freeze
+    )
+    cursor.copy_expert(stmt, buffer)
+    connection.commit()
+
+
+class CountingReader:
+    """File-like proxy that counts the bytes (or characters) read from the wrapped stream
+
+    Seeking and every other attribute are passed through to the wrapped stream.
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+        self.bytes_read = 0
+
+    def read(self, *args):
+        return self._count(self._stream.read(*args))
+
+    def read1(self, *args):
+        return self._count(self._stream.read1(*args))
+
+    def readline(self, *args):
+        return self._count(self._stream.readline(*args))
+
+    def readinto(self, b):
+        size = self._stream.readinto(b)
+        self.bytes_read += size or 0
+        return size
+
+    def __iter__(self):
+        for line in self._stream:
+            yield self._count(line)
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+    def _count(self, data):
+        self.bytes_read += len(data)
+        return data
+
+
+class StageMetrics:
+    """Wall time, rows affected, bytes read and peak RSS of a processing stage"""
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.started_timestamp = None
+        self.duration = None
+        self.rows = None
+        self.bytes_read = None
+        self.peak_rss = None
+
+    def __repr__(self):
+        return (
+            f'<StageMetrics {self.stage}: {self.duration}s, {self.rows} rows, '
+            f'{self.bytes_read} bytes read, {self.peak_rss} bytes peak RSS>'
+        )
+
+
+def peak_rss():
+    """Peak resident set size of this process in bytes (ru_maxrss is in KiB on Linux)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+@contextmanager
+def measure_stage(stage):
+    """Yields a StageMetrics whose duration and peak RSS are set when the block exits
+
+    The block can set the rows and bytes_read attributes. peak_rss is the peak of the
+    process so far, the kernel does not track it per stage.
+    """
+    metrics = StageMetrics(stage)
+    metrics.started_timestamp = datetime.datetime.utcnow()
+    start = time.perf_counter()
+    try:
+        yield metrics
+    finally:
+        metrics.duration = time.perf_counter() - start
+        metrics.peak_rss = peak_rss()
@@ -0,0 +1,253 @@
+import json
+import secrets
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+import redis
+from flask import current_app as flask_app
+
+WorkItem = namedtuple('WorkItem', 'pipeline_id file_name')
+Lease = namedtuple('Lease', 'item token')
+
+
+def redis_from_config(config):
+    """Returns a Redis client for a config block with host, port, password and ssl keys
+
+    host is a url, e.g. redis://dss_redis, see the cache block of the app config.
+    """
+    url = f"{config['host']}:{config['port']}"
+    if config.get('ssl') and url.startswith('redis://'):
+        url = f"rediss://{url[len('redis://'):]}"
+    return redis.Redis.from_url(url, password=config.get('password') or None)
+
+
+def _to_str(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class WorkQueue:
+    """Queue of (pipeline_id, file_name) work items shared by workers through Redis
+
+    Items are queued per pipeline and an item is only queued once while it is pending
+    or leased. A worker claims an item with a lease that expires after lease_seconds
+    unless renewed (see heartbeat); leases that expired, e.g. because the worker died,
+    are put back at the front of their pipeline's queue by the next claim. Pipelines
+    stage data in shared tables, so only one item of a pipeline is leased at a time.
+    Items that failed are removed from the queue and counted as failures of their
+    pipeline until clear_failed.
+
+    Keys:
+        {name}:pending:{pipeline_id}: list of the pending items of a pipeline
+        {name}:items: set of the pending and leased items
+        {name}:leases: sorted set of the leased items, scored by lease expiry time
+        {name}:owners: hash of leased item to the token of its lease
+        {name}:busy: set of the pipeline ids with a leased item
+        {name}:outstanding: hash of pipeline id to its number of pending and leased items
+        {name}:failed: hash of pipeline id to its number of failed items
+    """
+
+    def __init__(self, client, name='dss:work_queue', lease_seconds=300):
+        """
+        Args:
+            client: redis.Redis instance
+            name: str, prefix of the Redis keys
+            lease_seconds: number of seconds a lease lasts unless renewed
+        """
+        self.client = client
+        self.name = name
+        self.lease_seconds = lease_seconds
+
+    def _key(self, *parts):
+        return ':'.join((self.name,) + parts)
+
+    @staticmethod
+    def _encode(item):
+        return json.dumps([item.pipeline_id, item.file_name])
+
+    @staticmethod
+    def _decode(value):
+        return WorkItem(*json.loads(value))
+
+    def enqueue(self, pipeline_id, file_name=None):
+        """Queues an item at the back of its pipeline's queue
+
+        Returns:
+            bool, whether the item was queued (False if it is already pending or leased)
+        """
+        value = self._encode(WorkItem(pipeline_id, file_name))
+        items_key = self._key('items')
+
+        def queue(pipe):
+            if pipe.sismember(items_key, value):
+                return False
+            pipe.multi()
+            pipe.sadd(items_key, value)
+            pipe.rpush(self._key('pending', pipeline_id), value)
+            pipe.hincrby(self._key('outstanding'), pipeline_id, 1)
+            return True
+
+        return self.client.transaction(queue, items_key, value_from_callable=True)
+
+    def claim(self, pipeline_ids):
+        """Leases the next pending item of the first of pipeline_ids with one
+
+        Pipelines with a leased item are skipped. Expired leases are requeued first.
+
+        Returns:
+            Lease(item, token) or None if there is no item to claim
+        """
+        self.requeue_expired()
+        token = secrets.token_hex(16)
+        busy_key = self._key('busy')
+        for pipeline_id in pipeline_ids:
+            pending_key = self._key('pending', pipeline_id)
+
+            def pop(pipe):
+                value = pipe.lindex(pending_key, 0)
+                if value is None or pipe.sismember(busy_key, pipeline_id):
+                    return None
+                pipe.multi()
+                pipe.lpop(pending_key)
+                pipe.zadd(self._key('leases'), {value: time.time() + self.lease_seconds})
+                pipe.hset(self._key('owners'), value, token)
+                pipe.sadd(busy_key, pipeline_id)
+                return value
+
+            value = self.client.transaction(pop, pending_key, busy_key, value_from_callable=True)
+            if value is not None:
+                return Lease(self._decode(value), token)
+        return None
+
+    def _if_owner(self, lease, update):
+        """Runs update(pipe, value) in a transaction if lease has not expired and been lost
+
+        Returns:
+            bool, whether lease is still held
+        """
+        value = self._encode(lease.item)
+        owners_key = self._key('owners')
+
+        def run(pipe):
+            if _to_str(pipe.hget(owners_key, value)) != lease.token:
+                return False
+            pipe.multi()
+            update(pipe, value)
+            return True
+
+        return self.client.transaction(run, owners_key, value_from_callable=True)
+
+    def _remove_lease(self, pipe, value, pipeline_id):
+        pipe.zrem(self._key('leases'), value)
+        pipe.hdel(self._key('owners'), value)
+        pipe.srem(self._key('busy'), pipeline_id)
+
+    def renew(self, lease):
+        """Extends lease by lease_seconds
+
+        Returns:
+            bool, whether lease is still held
+        """
+
+        def update(pipe, value):
+            pipe.zadd(self._key('leases'), {value: time.time() + self.lease_seconds})
+
+        return self._if_owner(lease, update)
+
+    def complete(self, lease):
+        """Removes the leased item from the queue
+
+        Returns:
+            bool, whether lease was still held; if not the item was requeued
+        """
+        return self._remove(lease)
+
+    def fail(self, lease):
+        """Removes the leased item from the queue and counts it as failed, see failed
+
+        Returns:
+            bool, whether lease was still held; if not the item was requeued
+        """
+        return self._remove(lease, failed=True)
+
+    def _remove(self, lease, failed=False):
+        pipeline_id = lease.item.pipeline_id
+
+        def update(pipe, value):
+            self._remove_lease(pipe, value, pipeline_id)
+            pipe.srem(self._key('items'), value)
+            pipe.hincrby(self._key('outstanding'), pipeline_id, -1)
+            if failed:
+                pipe.hincrby(self._key('failed'), pipeline_id, 1)
+
+        return self._if_owner(lease, update)
+
+    def release(self, lease):
+        """Puts the leased item back at the front of its pipeline's queue"""
+        pipeline_id = lease.item.pipeline_id
+
+        def update(pipe, value):
+            self._remove_lease(pipe, value, pipeline_id)
+            pipe.lpush(self._key('pending', pipeline_id), value)
+
+        return self._if_owner(lease, update)
+
+    def requeue_expired(self):
+        """Puts the items whose lease expired back at the front of their pipeline's queue
+
+        Returns:
+            list of the requeued WorkItems
+        """
+        leases_key = self._key('leases')
+        requeued = []
+        for value in self.client.zrangebyscore(leases_key, '-inf', time.time()):
+            item = self._decode(value)
+
+            def requeue(pipe):
+                expiry = pipe.zscore(leases_key, value)
+                if expiry is None or expiry > time.time():
+                    return False
+                pipe.multi()
+                self._remove_lease(pipe, value, item.pipeline_id)
+                pipe.lpush(self._key('pending', item.pipeline_id), value)
+                return True
+
+            if self.client.transaction(requeue, leases_key, value_from_callable=True):
+                flask_app.logger.warning(f'lease of {item} expired, requeued')
+                requeued.append(item)
+        return requeued
+
+    def outstanding(self, pipeline_id):
+        """Number of pending and leased items of a pipeline"""
+        return int(self.client.hget(self._key('outstanding'), pipeline_id) or 0)
+
+    def failed(self, pipeline_id):
+        """Number of failed items of a pipeline since its failures were last cleared"""
+        return int(self.client.hget(self._key('failed'), pipeline_id) or 0)
+
+    def clear_failed(self, pipeline_id):
+        """Forgets the failed items of a pipeline"""
+        self.client.hdel(self._key('failed'), pipeline_id)
+
+    @contextmanager
+    def heartbeat(self, lease, interval=None):
+        """Renews lease in a background thread every interval seconds while active
+
+        interval defaults to a third of lease_seconds. Renewal stops if the lease is lost.
+        """
+        interval = interval or self.lease_seconds / 3
+        stop = threading.Event()
+
+        def renew():
+            while not stop.wait(interval):
+                if not self.renew(lease):
+                    return
+
+        thread = threading.Thread(target=renew, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
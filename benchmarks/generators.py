@@ -0,0 +1,230 @@
+"""Seeded synthetic datafiles in the formats the pipelines ingest
+
+Every generator takes the number of records to generate and a seed, and returns the
+datafile as bytes. The same size and seed always give the same bytes.
+"""
+
+import csv
+import datetime
+import io
+import random
+import string
+import zipfile
+
+from app.etl.organisation.dit import DITBACIPipeline, DITReferencePostcodesPipeline
+from app.etl.organisation.ons import ONSPostcodeDirectoryPipeline
+
+DSV_UPLOAD_COLUMN_TYPES = [
+    ('company_name', 'text'),
+    ('amount', 'numeric'),
+    ('quantity', 'integer'),
+    ('created', 'date'),
+]
+
+# ids of the generated SPIRE rows start here, above any real id
+SPIRE_ID_OFFSET = 10**9
+
+
+def _csv_bytes(header, rows, quoting=csv.QUOTE_MINIMAL, encoding='utf-8'):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, quoting=quoting, lineterminator='\n')
+    writer.writerow(header)
+    writer.writerows(rows)
+    return buffer.getvalue().encode(encoding)
+
+
+def _zip_bytes(members):
+    """members: iterable of (name, bytes) tuples"""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for name, data in members:
+            zf.writestr(name, data)
+    return buffer.getvalue()
+
+
+def _postcode(rng):
+    letters = string.ascii_uppercase
+    return (
+        f'{rng.choice(letters)}{rng.choice(letters)}{rng.randint(1, 99)} '
+        f'{rng.randint(0, 9)}{rng.choice(letters)}{rng.choice(letters)}'
+    )
+
+
+def _company_name(rng):
+    words = ['trade', 'global', 'export', 'north', 'works', 'parts', 'foods', 'tech']
+    return f"{' '.join(rng.choice(words) for _ in range(2)).title()} {rng.randint(1, 9999)} Ltd"
+
+
+def _date(rng, start_year=2000, end_year=2020):
+    start = datetime.date(start_year, 1, 1)
+    return start + datetime.timedelta(days=rng.randint(0, (end_year - start_year) * 365))
+
+
+def reference_postcodes_csv(size, seed=0):
+    """DIT reference postcodes csv (L1 snapshot pipeline)"""
+    rng = random.Random(seed)
+    header = [c for c, _ in DITReferencePostcodesPipeline._l0_data_column_types]
+    rows = []
+    for _ in range(size):
+        district, lep, region = rng.randint(1, 400), rng.randint(1, 40), rng.randint(1, 9)
+        rows.append(
+            [
+                _postcode(rng),
+                f'E0{6000000 + district}',
+                f'District {district}',
+                f'E3{7000000 + lep}',
+                f'Enterprise Partnership {lep}',
+                '',
+                '',
+                f'E1{2000000 + region}',
+                f'Region {region}',
+                rng.randint(100000, 650000),
+                rng.randint(10000, 1200000),
+                _date(rng).isoformat(),
+                _date(rng).isoformat() if rng.random() < 0.1 else '',
+            ]
+        )
+    return _csv_bytes(header, rows)
+
+
+def baci_csv(size, seed=0):
+    """DIT BACI trade flows csv (L1 incremental pipeline)"""
+    rng = random.Random(seed)
+    header = [c for c, _ in DITBACIPipeline._l0_data_column_types]
+    rows = [
+        [
+            rng.randint(1995, 2018),
+            rng.randint(10000, 999999),
+            rng.randint(1, 900),
+            rng.randint(1, 900),
+            round(rng.uniform(0, 100000), 3),
+            round(rng.uniform(0, 1000), 3) if rng.random() < 0.9 else '',
+        ]
+        for _ in range(size)
+    ]
+    return _csv_bytes(header, rows)
+
+
+def dsv_upload_csv(size, seed=0):
+    """csv of DSV_UPLOAD_COLUMN_TYPES columns (DSV to table pipeline)"""
+    rng = random.Random(seed)
+    header = [c for c, _ in DSV_UPLOAD_COLUMN_TYPES]
+    rows = [
+        [
+            _company_name(rng),
+            round(rng.uniform(-1000, 100000), 2),
+            rng.randint(0, 10000),
+            _date(rng).isoformat(),
+        ]
+        for _ in range(size)
+    ]
+    return _csv_bytes(header, rows)
+
+
+XBRL_TEMPLATE = '''<?xml version="1.0"?>
+<xbrl xmlns="http://www.xbrl.org/2003/instance"
+      xmlns:ae="http://www.companieshouse.gov.uk/ef/xbrl/uk/fr/gaap/ae/2009-06-21"
+      xmlns:gc="http://www.xbrl.org/uk/fr/gcd/2004-12-01"
+      xmlns:pt="http://www.xbrl.org/uk/fr/gaap/pt/2004-12-01">
+    <ae:CompanyNotDormant contextRef="y1">true</ae:CompanyNotDormant>
+    <gc:EntityCurrentLegalName contextRef="y1">{name}</gc:EntityCurrentLegalName>
+    <ae:CompaniesHouseRegisteredNumber contextRef="y1">{number}</ae:CompaniesHouseRegisteredNumber>
+    <gc:BalanceSheetDate contextRef="e1">{end}</gc:BalanceSheetDate>
+    <ae:AverageNumberEmployeesDuringPeriod contextRef="y1"
+        >{employees}</ae:AverageNumberEmployeesDuringPeriod>
+{facts}
+    <context id="y1">
+        <period><startDate>{start}</startDate><endDate>{end}</endDate></period>
+    </context>
+    <context id="e1"><period><instant>{end}</instant></period></context>
+    <context id="e0"><period><instant>{start}</instant></period></context>
+</xbrl>
+'''
+
+XBRL_FACTS = [
+    'TangibleFixedAssets',
+    'Debtors',
+    'CashBankInHand',
+    'CurrentAssets',
+    'NetCurrentAssetsLiabilities',
+    'TotalAssetsLessCurrentLiabilities',
+    'CalledUpShareCapital',
+    'ProfitLossAccountReserve',
+    'ShareholderFunds',
+]
+
+
+def xbrl_zip(size, seed=0):
+    """Companies House accounts zip of size XBRL documents (XBRL zip pipeline)"""
+    rng = random.Random(seed)
+
+    def documents():
+        for i in range(size):
+            end = _date(rng, 2010, 2020)
+            start = end - datetime.timedelta(days=365)
+            number = f'{rng.randint(0, 99999999):08d}'
+            facts = '\n'.join(
+                f'    <pt:{fact} contextRef="{context}" unitRef="GBP">'
+                f'{rng.randint(0, 10 ** 7)}</pt:{fact}>'
+                for fact in XBRL_FACTS
+                for context in ('e1', 'e0')
+            )
+            document = XBRL_TEMPLATE.format(
+                name=_company_name(rng),
+                number=number,
+                start=start.isoformat(),
+                end=end.isoformat(),
+                employees=rng.randint(0, 250),
+                facts=facts,
+            )
+            yield f'Prod223_{i}_{number}_{end:%Y%m%d}.xml', document.encode()
+
+    return _zip_bytes(documents())
+
+
+def hmrc_exporters_zip(size, seed=0, months=12):
+    """HMRC exporters zip of monthly zips of tab separated lines (nested zip pipeline)"""
+    rng = random.Random(seed)
+
+    def monthly_zips():
+        for month in range(months):
+            year_month = f'{2019 + month // 12}{month % 12 + 1:02d}'
+            lines = []
+            for _ in range(size // months + (month < size % months)):
+                address = [f'{rng.randint(1, 200)} High Street', 'Town', '', '', '']
+                codes = [f'{rng.randint(1000000, 99999999)}' for _ in range(rng.randint(1, 6))]
+                values = [year_month, 'E', _company_name(rng)] + address + [_postcode(rng)]
+                lines.append('\t'.join(values + codes))
+            data = '\n'.join(lines).encode('mac-roman')
+            name = f'exporters{year_month}'
+            yield f'{name}.zip', _zip_bytes([(f'{name}.txt', data)])
+
+    return _zip_bytes(monthly_zips())
+
+
+def onspd_zip(size, seed=0):
+    """ONS postcode directory zip with a quoted csv (ONSPD zip pipeline)"""
+    rng = random.Random(seed)
+    header = [c for c, _ in ONSPostcodeDirectoryPipeline._l0_data_column_types]
+    rows = []
+    for _ in range(size):
+        postcode = _postcode(rng)
+        row = [f'E0{rng.randint(1000000, 9999999)}' for _ in header]
+        row[:5] = [postcode, postcode, postcode, f'{_date(rng):%Y%m}', '']
+        row[header.index('usertype')] = str(rng.randint(0, 1))
+        row[header.index('lat')] = f'{rng.uniform(49.9, 60.8):.6f}'
+        row[header.index('long')] = f'{rng.uniform(-8.6, 1.8):.6f}'
+        row[header.index('lep2')] = ''
+        rows.append(row)
+    data = _csv_bytes(header, rows, quoting=csv.QUOTE_ALL)
+    return _zip_bytes([('Data/ONSPD_MAY_2020_UK.csv', data)])
+
+
+def spire_ref_country_mappings_csv(size, seed=0):
+    """SPIRE ref_country_mappings csv (rebuild schema pipeline)"""
+    rng = random.Random(seed)
+    rows = [
+        [SPIRE_ID_OFFSET + i, f"Country {''.join(rng.choices(string.ascii_uppercase, k=8))}"]
+        for i in range(size)
+    ]
+    return _csv_bytes(['country_id', 'country_name'], rows)
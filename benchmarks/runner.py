@@ -0,0 +1,231 @@
+"""Runs pipelines on synthetic datafiles and compares their throughput with a baseline"""
+
+import multiprocessing
+from collections import defaultdict, namedtuple, OrderedDict
+from io import BytesIO
+
+from datatools.io.fileinfo import FileInfo
+from flask import current_app as flask_app
+from sqlalchemy import text
+
+from app.etl.organisation.companies_house import CompaniesHouseAccountsPipeline
+from app.etl.organisation.dit import DITBACIPipeline, DITReferencePostcodesPipeline
+from app.etl.organisation.hmrc import HMRCExportersPipeline
+from app.etl.organisation.ons import ONSPostcodeDirectoryPipeline
+from app.etl.organisation.spire import SPIRERefCountryMappingPipeline
+from app.etl.pipeline_type.dsv_to_table import DSVToTablePipeline
+from app.etl.utils import measure_stage
+from benchmarks import generators
+
+# schemas of the benchmarked pipelines are "benchmark.<dataset>"
+BENCHMARK_ORGANISATION = 'benchmark'
+
+# pipeline: callable(dbi, **options) returning the pipeline to benchmark
+# generate: callable(size, seed) returning the datafile bytes, see generators
+# file_name: name of the generated datafile
+# cleanup: callable(dbi, pipeline) removing the data loaded by the benchmark
+Benchmark = namedtuple('Benchmark', 'pipeline generate file_name cleanup')
+
+BenchmarkResult = namedtuple(
+    'BenchmarkResult',
+    'name size records bytes duration records_per_second mb_per_second peak_rss stages',
+)
+
+
+def _benchmark_pipeline(pipeline_class):
+    """Subclass of pipeline_class that keeps its tables in a benchmark schema"""
+    return type(
+        pipeline_class.__name__, (pipeline_class,), {'organisation': BENCHMARK_ORGANISATION}
+    )
+
+
+def _drop_schema(dbi, pipeline):
+    dbi.drop_schema(pipeline.schema)
+
+
+def _delete_spire_rows(dbi, pipeline):
+    table = pipeline.sql_alchemy_model.__table__
+    dbi.execute_statement(
+        text(
+            f'DELETE FROM "{table.schema}"."{table.name}" '
+            f'WHERE country_id >= {generators.SPIRE_ID_OFFSET}'
+        )
+    )
+
+
+def _dsv_upload_pipeline(dbi, force=True, **options):
+    # DSVToTablePipeline always forces
+    return DSVToTablePipeline(
+        dbi,
+        organisation=BENCHMARK_ORGANISATION,
+        dataset='dsv_upload',
+        data_column_types=generators.DSV_UPLOAD_COLUMN_TYPES,
+        **options,
+    )
+
+
+BENCHMARKS = OrderedDict(
+    [
+        (
+            'snapshot_l1',
+            Benchmark(
+                _benchmark_pipeline(DITReferencePostcodesPipeline),
+                generators.reference_postcodes_csv,
+                'reference_postcodes.csv',
+                _drop_schema,
+            ),
+        ),
+        (
+            'incremental_l1',
+            Benchmark(
+                _benchmark_pipeline(DITBACIPipeline),
+                generators.baci_csv,
+                'baci.csv',
+                _drop_schema,
+            ),
+        ),
+        (
+            'dsv_upload',
+            Benchmark(_dsv_upload_pipeline, generators.dsv_upload_csv, 'upload.csv', _drop_schema),
+        ),
+        (
+            'xbrl_zip',
+            Benchmark(
+                _benchmark_pipeline(CompaniesHouseAccountsPipeline),
+                generators.xbrl_zip,
+                'Accounts_Bulk_Data-2020-01-01.zip',
+                _drop_schema,
+            ),
+        ),
+        (
+            'hmrc_nested_zip',
+            Benchmark(
+                _benchmark_pipeline(HMRCExportersPipeline),
+                generators.hmrc_exporters_zip,
+                'exporters2019.zip',
+                _drop_schema,
+            ),
+        ),
+        (
+            'onspd_zip',
+            Benchmark(
+                _benchmark_pipeline(ONSPostcodeDirectoryPipeline),
+                generators.onspd_zip,
+                'ONSPD_MAY_2020_UK.zip',
+                _drop_schema,
+            ),
+        ),
+        (
+            'spire_rebuild',
+            Benchmark(
+                SPIRERefCountryMappingPipeline,
+                generators.spire_ref_country_mappings_csv,
+                'ref_country_mappings.csv',
+                _delete_spire_rows,
+            ),
+        ),
+    ]
+)
+
+
+def run_benchmark(name, dbi, size, seed=0, **options):
+    """Generates a datafile of size records and processes it with the benchmarked pipeline
+
+    The data loaded is removed afterwards. peak_rss is the peak of the whole process,
+    see run_benchmarks to measure it per benchmark.
+
+    Returns:
+        BenchmarkResult, durations in seconds, stages {stage: seconds}
+    """
+    benchmark = BENCHMARKS[name]
+    data = benchmark.generate(size, seed)
+    pipeline = benchmark.pipeline(dbi, force=True, **options)
+    try:
+        with measure_stage('total') as total:
+            pipeline.process(FileInfo(benchmark.file_name, BytesIO(data)))
+    finally:
+        benchmark.cleanup(dbi, pipeline)
+    stages = defaultdict(float)
+    for metrics in getattr(pipeline, 'stage_metrics', []):
+        stages[metrics.stage] += metrics.duration
+    return BenchmarkResult(
+        name=name,
+        size=size,
+        records=size,
+        bytes=len(data),
+        duration=total.duration,
+        records_per_second=size / total.duration,
+        mb_per_second=len(data) / 2**20 / total.duration,
+        peak_rss=total.peak_rss,
+        stages=dict(stages),
+    )
+
+
+# set before forking a benchmark process, which inherits it
+_benchmark_app = None
+
+
+def _init_benchmark_process():
+    _benchmark_app.app_context().push()
+    # the pooled connections belong to the parent process, open new ones
+    flask_app.db.engine.dispose(close=False)
+
+
+def _run_benchmark_in_process(name, size, seed, options):
+    return run_benchmark(name, flask_app.dbi, size, seed, **options)
+
+
+def run_benchmarks(names, size, seed=0, **options):
+    """Runs each benchmark in a process of its own, so peak RSS is measured per benchmark
+
+    Returns:
+        list of BenchmarkResult
+    """
+    global _benchmark_app
+    _benchmark_app = flask_app._get_current_object()
+    context = multiprocessing.get_context('fork')
+    results = []
+    for name in names:
+        with context.Pool(1, initializer=_init_benchmark_process) as pool:
+            results.append(pool.apply(_run_benchmark_in_process, (name, size, seed, options)))
+    return results
+
+
+# metric: whether higher values are better
+COMPARED_METRICS = {'records_per_second': True, 'mb_per_second': True, 'peak_rss': False}
+
+Regression = namedtuple('Regression', 'name metric baseline value')
+
+
+def compare_with_baseline(results, baseline, tolerance=0.1):
+    """Compares results with the baseline results of the same benchmark and size
+
+    Stage durations are compared as well as COMPARED_METRICS.
+
+    Args:
+        results: list of BenchmarkResult
+        baseline: {name: BenchmarkResult._asdict()}, as saved by the benchmark command
+        tolerance: relative change that is not reported as a regression
+    Returns:
+        list of Regression(name, metric, baseline value, value)
+    """
+    regressions = []
+    for result in results:
+        expected = baseline.get(result.name)
+        if not expected or expected['size'] != result.size:
+            continue
+        compared = [
+            (metric, higher, getattr(result, metric), expected[metric])
+            for metric, higher in COMPARED_METRICS.items()
+        ]
+        compared += [
+            (f'stages.{stage}', False, duration, expected['stages'][stage])
+            for stage, duration in result.stages.items()
+            if stage in expected['stages']
+        ]
+        for metric, higher, value, expected_value in compared:
+            if higher and value < expected_value * (1 - tolerance):
+                regressions.append(Regression(result.name, metric, expected_value, value))
+            elif not higher and value > expected_value * (1 + tolerance):
+                regressions.append(Regression(result.name, metric, expected_value, value))
+    return regressions
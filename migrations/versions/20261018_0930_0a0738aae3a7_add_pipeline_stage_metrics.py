@@ -0,0 +1,73 @@
+"""add pipeline stage metrics table
+
+Revision ID: 0a0738aae3a7
+Revises: ac7dbd72d46e
+Create Date: 2026-10-18 09:30:12.418305
+
+"""
+import sqlalchemy as sa
+from alembic import context, op
+from sqlalchemy.sql.schema import quoted_name  # noqa: F401
+
+from app.db.models import get_schemas
+
+revision = '0a0738aae3a7'
+down_revision = 'ac7dbd72d46e'
+
+
+def create_schemas():
+    conn = op.get_bind()
+    for schema_name in get_schemas():
+        if not conn.dialect.has_schema(conn, schema_name):
+            conn.execute(sa.schema.CreateSchema(schema_name))
+
+
+def upgrade():
+    create_schemas()
+    schema_upgrades()
+    if context.get_x_argument(as_dictionary=True).get('data', None):
+        data_upgrades()
+
+
+def downgrade():
+    if context.get_x_argument(as_dictionary=True).get('data', None):
+        data_downgrades()
+    schema_downgrades()
+
+
+def schema_upgrades():
+    """schema upgrade migrations go here."""
+    op.create_table(
+        'pipeline_stage_metrics',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('datafile_registry_id', sa.Integer(), nullable=True),
+        sa.Column('source', sa.Text(), nullable=False),
+        sa.Column('file_name', sa.Text(), nullable=True),
+        sa.Column('stage', sa.Text(), nullable=False),
+        sa.Column('started_timestamp', sa.DateTime(), nullable=False),
+        sa.Column('duration', sa.Float(), nullable=False),
+        sa.Column('rows', sa.BigInteger(), nullable=True),
+        sa.Column('bytes_read', sa.BigInteger(), nullable=True),
+        sa.Column('peak_rss', sa.BigInteger(), nullable=True),
+        sa.ForeignKeyConstraint(
+            ['datafile_registry_id'],
+            ['operations.datafile_registry.id'],
+        ),
+        sa.PrimaryKeyConstraint('id'),
+        schema=quoted_name('operations', quote=True),
+    )
+
+
+def schema_downgrades():
+    """schema downgrade migrations go here."""
+    op.drop_table('pipeline_stage_metrics', schema=quoted_name('operations', quote=True))
+
+
+def data_upgrades():
+    """Add any optional data upgrade migrations here!"""
+    pass
+
+
+def data_downgrades():
+    """Add any optional data downgrade migrations here!"""
+    pass
@@ -0,0 +1,118 @@
+"""add datafile registry content digest and size
+
+Revision ID: 5c1d2e8f4b6a
+Revises: 0a0738aae3a7
+Create Date: 2026-10-18 10:15:42.118023
+
+"""
+
+import sqlalchemy as sa
+from alembic import context, op
+from sqlalchemy.sql.schema import quoted_name  # noqa: F401
+
+from app.db.models import get_schemas
+
+revision = '5c1d2e8f4b6a'
+down_revision = '0a0738aae3a7'
+
+# registry rows of a datafile but its latest, with the id of its latest row
+DUPLICATE_DATAFILES = '''
+    SELECT id, first_value(id) OVER latest AS latest_id, row_number() OVER latest AS position
+    FROM operations.datafile_registry
+    WHERE file_name IS NOT NULL
+    WINDOW latest AS (
+        PARTITION BY source, file_name
+        ORDER BY coalesce(updated_timestamp, created_timestamp) DESC, id DESC
+    )
+'''
+
+
+def create_schemas():
+    conn = op.get_bind()
+    for schema_name in get_schemas():
+        if not conn.dialect.has_schema(conn, schema_name):
+            conn.execute(sa.schema.CreateSchema(schema_name))
+
+
+def upgrade():
+    create_schemas()
+    schema_upgrades()
+    if context.get_x_argument(as_dictionary=True).get('data', None):
+        data_upgrades()
+
+
+def downgrade():
+    if context.get_x_argument(as_dictionary=True).get('data', None):
+        data_downgrades()
+    schema_downgrades()
+
+
+def schema_upgrades():
+    """schema upgrade migrations go here."""
+    op.add_column(
+        'datafile_registry',
+        sa.Column('content_digest', sa.Text(), nullable=True),
+        schema=quoted_name('operations', quote=True),
+    )
+    op.add_column(
+        'datafile_registry',
+        sa.Column('size', sa.BigInteger(), nullable=True),
+        schema=quoted_name('operations', quote=True),
+    )
+    # the registry may hold several rows of a datafile, keep the latest one
+    op.execute(
+        f'''
+        WITH duplicates AS ({DUPLICATE_DATAFILES})
+        UPDATE operations.pipeline_stage_metrics m SET datafile_registry_id = d.latest_id
+        FROM duplicates d WHERE m.datafile_registry_id = d.id AND d.position > 1
+        '''
+    )
+    op.execute(
+        f'''
+        WITH duplicates AS ({DUPLICATE_DATAFILES})
+        DELETE FROM operations.datafile_registry r
+        USING duplicates d WHERE r.id = d.id AND d.position > 1
+        '''
+    )
+    op.create_index(
+        'datafile_registry_source_file_name_idx',
+        'datafile_registry',
+        ['source', 'file_name'],
+        unique=True,
+        schema=quoted_name('operations', quote=True),
+    )
+    op.create_index(
+        'datafile_registry_source_content_digest_idx',
+        'datafile_registry',
+        ['source', 'content_digest'],
+        unique=False,
+        schema=quoted_name('operations', quote=True),
+    )
+
+
+def schema_downgrades():
+    """schema downgrade migrations go here."""
+    op.drop_index(
+        'datafile_registry_source_content_digest_idx',
+        table_name='datafile_registry',
+        schema=quoted_name('operations', quote=True),
+    )
+    op.drop_index(
+        'datafile_registry_source_file_name_idx',
+        table_name='datafile_registry',
+        schema=quoted_name('operations', quote=True),
+    )
+    op.drop_column('datafile_registry', 'size', schema=quoted_name('operations', quote=True))
+    op.drop_column(
+        'datafile_registry', 'content_digest', schema=quoted_name('operations', quote=True)
+    )
+
+
+def data_upgrades():
+    """Add any optional data upgrade migrations here!"""
+    pass
+
+
+def data_downgrades():
+    """Add any optional data downgrade migrations here!"""
+    pass
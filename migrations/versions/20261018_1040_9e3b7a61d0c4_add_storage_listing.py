@@ -0,0 +1,76 @@
+"""add storage listing table
+
+Revision ID: 9e3b7a61d0c4
+Revises: 5c1d2e8f4b6a
+Create Date: 2026-10-18 10:40:07.502217
+
+"""
+
+import sqlalchemy as sa
+from alembic import context, op
+from sqlalchemy.sql.schema import quoted_name  # noqa: F401
+
+from app.db.models import get_schemas
+
+revision = '9e3b7a61d0c4'
+down_revision = '5c1d2e8f4b6a'
+
+
+def create_schemas():
+    conn = op.get_bind()
+    for schema_name in get_schemas():
+        if not conn.dialect.has_schema(conn, schema_name):
+            conn.execute(sa.schema.CreateSchema(schema_name))
+
+
+def upgrade():
+    create_schemas()
+    schema_upgrades()
+    if context.get_x_argument(as_dictionary=True).get('data', None):
+        data_upgrades()
+
+
+def downgrade():
+    if context.get_x_argument(as_dictionary=True).get('data', None):
+        data_downgrades()
+    schema_downgrades()
+
+
+def schema_upgrades():
+    """schema upgrade migrations go here."""
+    op.create_table(
+        'storage_listing',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('location', sa.Text(), nullable=False),
+        sa.Column('file_name', sa.Text(), nullable=False),
+        sa.Column('listed_timestamp', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        schema=quoted_name('operations', quote=True),
+    )
+    op.create_index(
+        'storage_listing_location_file_name_idx',
+        'storage_listing',
+        ['location', 'file_name'],
+        unique=True,
+        schema=quoted_name('operations', quote=True),
+    )
+
+
+def schema_downgrades():
+    """schema downgrade migrations go here."""
+    op.drop_index(
+        'storage_listing_location_file_name_idx',
+        table_name='storage_listing',
+        schema=quoted_name('operations', quote=True),
+    )
+    op.drop_table('storage_listing', schema=quoted_name('operations', quote=True))
+
+
+def data_upgrades():
+    """Add any optional data upgrade migrations here!"""
+    pass
+
+
+def data_downgrades():
+    """Add any optional data downgrade migrations here!"""
+    pass
@@ -0,0 +1,60 @@
+"""add datafile registry checkpoint
+
+Revision ID: 3f6a9c2d7e15
+Revises: 9e3b7a61d0c4
+Create Date: 2026-10-18 11:05:41.113054
+
+"""
+
+import sqlalchemy as sa
+from alembic import context, op
+from sqlalchemy.sql.schema import quoted_name  # noqa: F401
+
+from app.db.models import get_schemas
+
+revision = '3f6a9c2d7e15'
+down_revision = '9e3b7a61d0c4'
+
+
+def create_schemas():
+    conn = op.get_bind()
+    for schema_name in get_schemas():
+        if not conn.dialect.has_schema(conn, schema_name):
+            conn.execute(sa.schema.CreateSchema(schema_name))
+
+
+def upgrade():
+    create_schemas()
+    schema_upgrades()
+    if context.get_x_argument(as_dictionary=True).get('data', None):
+        data_upgrades()
+
+
+def downgrade():
+    if context.get_x_argument(as_dictionary=True).get('data', None):
+        data_downgrades()
+    schema_downgrades()
+
+
+def schema_upgrades():
+    """schema upgrade migrations go here."""
+    op.add_column(
+        'datafile_registry',
+        sa.Column('checkpoint', sa.JSON(), nullable=True),
+        schema=quoted_name('operations', quote=True),
+    )
+
+
+def schema_downgrades():
+    """schema downgrade migrations go here."""
+    op.drop_column('datafile_registry', 'checkpoint', schema=quoted_name('operations', quote=True))
+
+
+def data_upgrades():
+    """Add any optional data upgrade migrations here!"""
+    pass
+
+
+def data_downgrades():
+    """Add any optional data downgrade migrations here!"""
+    pass
@@ -0,0 +1,79 @@
+"""add normalised postcode to dit reference postcodes
+
+Revision ID: 7b2e4c9d1a06
+Revises: 3f6a9c2d7e15
+Create Date: 2026-10-18 11:30:12.540871
+
+"""
+
+import sqlalchemy as sa
+from alembic import context, op
+from sqlalchemy.sql.schema import quoted_name  # noqa: F401
+
+from app.db.models import get_schemas
+
+revision = '7b2e4c9d1a06'
+down_revision = '3f6a9c2d7e15'
+
+
+def create_schemas():
+    conn = op.get_bind()
+    for schema_name in get_schemas():
+        if not conn.dialect.has_schema(conn, schema_name):
+            conn.execute(sa.schema.CreateSchema(schema_name))
+
+
+def upgrade():
+    create_schemas()
+    schema_upgrades()
+    if context.get_x_argument(as_dictionary=True).get('data', None):
+        data_upgrades()
+
+
+def downgrade():
+    if context.get_x_argument(as_dictionary=True).get('data', None):
+        data_downgrades()
+    schema_downgrades()
+
+
+def schema_upgrades():
+    """schema upgrade migrations go here."""
+    op.add_column(
+        'L1',
+        sa.Column('postcode_normalised', sa.Text(), nullable=True),
+        schema=quoted_name('dit.reference_postcodes', quote=True),
+    )
+    # the postcode API looks rows up by this column
+    op.execute(
+        '''UPDATE "dit.reference_postcodes"."L1" '''
+        '''SET postcode_normalised = lower(replace(postcode, ' ', ''))'''
+    )
+    op.create_index(
+        op.f('ix_dit_reference_postcodes_L1_postcode_normalised'),
+        'L1',
+        ['postcode_normalised'],
+        unique=False,
+        schema=quoted_name('dit.reference_postcodes', quote=True),
+    )
+
+
+def schema_downgrades():
+    """schema downgrade migrations go here."""
+    op.drop_index(
+        op.f('ix_dit_reference_postcodes_L1_postcode_normalised'),
+        table_name='L1',
+        schema=quoted_name('dit.reference_postcodes', quote=True),
+    )
+    op.drop_column(
+        'L1', 'postcode_normalised', schema=quoted_name('dit.reference_postcodes', quote=True)
+    )
+
+
+def data_upgrades():
+    """Add any optional data upgrade migrations here!"""
+    pass
+
+
+def data_downgrades():
+    """Add any optional data downgrade migrations here!"""
+    pass
@@ -0,0 +1,68 @@
+"""add integer grid reference to ons postcode directory
+
+Revision ID: 9d4f1b3e8c27
+Revises: 7b2e4c9d1a06
+Create Date: 2026-10-18 14:00:41.208315
+
+"""
+
+import sqlalchemy as sa
+from alembic import context, op
+from sqlalchemy.sql.schema import quoted_name  # noqa: F401
+
+from app.db.models import get_schemas
+
+revision = '9d4f1b3e8c27'
+down_revision = '7b2e4c9d1a06'
+
+
+def create_schemas():
+    conn = op.get_bind()
+    for schema_name in get_schemas():
+        if not conn.dialect.has_schema(conn, schema_name):
+            conn.execute(sa.schema.CreateSchema(schema_name))
+
+
+def upgrade():
+    create_schemas()
+    schema_upgrades()
+    if context.get_x_argument(as_dictionary=True).get('data', None):
+        data_upgrades()
+
+
+def downgrade():
+    if context.get_x_argument(as_dictionary=True).get('data', None):
+        data_downgrades()
+    schema_downgrades()
+
+
+def schema_upgrades():
+    """schema upgrade migrations go here."""
+    for column in ('easting', 'northing'):
+        op.add_column(
+            'L1',
+            sa.Column(column, sa.Integer(), nullable=True),
+            schema=quoted_name('ons.postcode_directory', quote=True),
+        )
+    # the nearest postcodes API indexes the grid references
+    op.execute(
+        '''UPDATE "ons.postcode_directory"."L1" SET '''
+        '''easting = CASE WHEN oseast1m ~ '^[0-9]+$' THEN oseast1m::int END, '''
+        '''northing = CASE WHEN osnrth1m ~ '^[0-9]+$' THEN osnrth1m::int END'''
+    )
+
+
+def schema_downgrades():
+    """schema downgrade migrations go here."""
+    for column in ('easting', 'northing'):
+        op.drop_column('L1', column, schema=quoted_name('ons.postcode_directory', quote=True))
+
+
+def data_upgrades():
+    """Add any optional data upgrade migrations here!"""
+    pass
+
+
+def data_downgrades():
+    """Add any optional data downgrade migrations here!"""
+    pass
@@ -1,13 +1,13 @@
 from mohawk import Sender
 
 
-def get_mohawk_sender(url):
+def get_mohawk_sender(url, method='GET', content='', content_type=''):
     sender = Sender(
         credentials={'id': 'iss1', 'key': 'secret1', 'algorithm': 'sha256'},
         url=url,
-        method='GET',
-        content='',
-        content_type='',
+        method=method,
+        content=content,
+        content_type=content_type,
     )
     return sender
 
@@ -18,6 +18,17 @@ def make_hawk_auth_request(client, url):
     return response
 
 
+def make_hawk_auth_post_request(client, url, content, content_type):
+    sender = get_mohawk_sender('http://localhost:80' + url, 'POST', content, content_type)
+    response = client.post(
+        url,
+        data=content,
+        content_type=content_type,
+        headers={'Authorization': sender.request_header},
+    )
+    return response
+
+
 def make_sso_request(client, url):
     response = client.get(url)
     return response
@@ -1,4 +1,14 @@
-from tests.api.views import make_hawk_auth_request
+import datetime
+import json
+from unittest import mock
+
+import pytest
+
+from app.api.postcode_index import PostcodeIndex
+from app.constants import DatafileState
+from app.db.models.internal import DatafileRegistryModel
+from app.etl.organisation.dit import DITReferencePostcodesPipeline
+from tests.api.views import make_hawk_auth_post_request, make_hawk_auth_request
 
 
 def test_alias_postcode_route(add_dit_reference_postcodes, app_with_hawk_user, app_with_mock_cache):
@@ -84,3 +94,139 @@ def test_lower_case_and_whitespace_dit_reference_postcode(
     assert response.status_code == 200
     assert len(response.json['values']) == 1
     assert response.json['values'][0][:2] == ['ZZ10 1ZZ', 'zzzz']
+
+
+@mock.patch(
+    'app.api.views.dit_reference_postcodes.postcode_index', PostcodeIndex(reload_check_seconds=0)
+)
+def test_get_dit_reference_postcode_from_index(
+    add_dit_reference_postcodes, app_with_hawk_user, app_with_mock_cache
+):
+    app_with_hawk_user.config['app']['postcode_index'] = True
+    add_dit_reference_postcodes([{'postcode': 'AB10 1AA', 'local_authority_district_code': 'asdf'}])
+    client = app_with_hawk_user.test_client()
+    url = '/api/v1/get-dit-reference-postcode/?postcode=ab101aa'
+    response = make_hawk_auth_request(client, url)
+    assert response.status_code == 200
+    assert response.json['headers'][:2] == ['postcode', 'local_authority_district_code']
+    assert response.json['values'][0][:2] == ['AB10 1AA', 'asdf']
+
+    # the index is reloaded once a datafile has been processed
+    add_dit_reference_postcodes([{'postcode': 'ZZ10 1ZZ', 'local_authority_district_code': 'zzzz'}])
+    url = '/api/v1/get-dit-reference-postcode/?postcode=ZZ10%201ZZ'
+    assert make_hawk_auth_request(client, url).json['values'] == []
+    DatafileRegistryModel.get_update_or_create(
+        source=DITReferencePostcodesPipeline.id,
+        file_name='snapshot2.csv',
+        state=DatafileState.PROCESSED.value,
+    )
+    assert make_hawk_auth_request(client, url).json['values'][0][:2] == ['ZZ10 1ZZ', 'zzzz']
+
+
+@mock.patch(
+    'app.api.views.dit_reference_postcodes.postcode_index', PostcodeIndex(reload_check_seconds=0)
+)
+def test_get_dit_reference_postcode_from_index_equals_database(
+    add_dit_reference_postcodes, app_with_hawk_user, app_with_mock_cache
+):
+    add_dit_reference_postcodes(
+        [
+            # an older row of the postcode, both return the row with the highest id
+            {'postcode': 'AB10 1AA', 'local_authority_district_code': 'old'},
+            {
+                'postcode': 'AB10 1AA',
+                'local_authority_district_code': 'asdf',
+                'date_of_introduction': datetime.date(2011, 9, 1),
+                'date_of_termination': datetime.date(2016, 10, 1),
+            },
+            {
+                'postcode': 'ZZ10 1ZZ',
+                'local_authority_district_code': 'zzzz',
+                'date_of_introduction': datetime.date(1980, 1, 1),
+            },
+        ]
+    )
+    client = app_with_hawk_user.test_client()
+    url = '/api/v1/get-dit-reference-postcode/?postcode=AB10%201AA'
+    assert make_hawk_auth_request(client, url).json['values'][0][1] == 'asdf'
+    for postcode in ('AB10%201AA', 'ZZ10%201ZZ', 'XX1%201XX'):
+        url = f'/api/v1/get-dit-reference-postcode/?postcode={postcode}'
+        app_with_hawk_user.config['app']['postcode_index'] = False
+        from_database = make_hawk_auth_request(client, url).json
+        app_with_hawk_user.config['app']['postcode_index'] = True
+        from_index = make_hawk_auth_request(client, url).json
+        assert from_index == from_database
+    assert from_database['values'] == []
+    app_with_hawk_user.config['app']['postcode_index'] = False
+
+
+BATCH_URL = '/api/v1/get-postcode-data/batch/'
+
+
+def test_get_dit_reference_postcodes_batch(
+    add_dit_reference_postcodes, app_with_hawk_user, app_with_mock_cache
+):
+    add_dit_reference_postcodes(
+        [
+            {
+                'postcode': 'AB10 1AA',
+                'local_authority_district_code': 'asdf',
+                'date_of_introduction': datetime.date(2011, 9, 1),
+                'date_of_termination': datetime.date(2016, 10, 1),
+            },
+            {
+                'postcode': 'ZZ10 1ZZ',
+                'local_authority_district_code': 'zzzz',
+                'date_of_introduction': datetime.date(1980, 1, 1),
+            },
+        ]
+    )
+    client = app_with_hawk_user.test_client()
+    content = json.dumps({'postcodes': ['zz101zz', 'XX1 1XX', 'AB10 1AA', 'zz10 1zz']})
+    response = make_hawk_auth_post_request(client, BATCH_URL, content, 'application/json')
+    assert response.status_code == 200
+    assert response.json['headers'][:4] == [
+        'query',
+        'found',
+        'postcode',
+        'local_authority_district_code',
+    ]
+    # in the posted order, unknown postcodes inline
+    assert [row[:4] for row in response.json['values']] == [
+        ['zz101zz', True, 'ZZ10 1ZZ', 'zzzz'],
+        ['XX1 1XX', False, None, None],
+        ['AB10 1AA', True, 'AB10 1AA', 'asdf'],
+        ['zz10 1zz', True, 'ZZ10 1ZZ', 'zzzz'],
+    ]
+    # the rows are serialised like the rows of the single lookup
+    for row in response.json['values']:
+        if row[1]:
+            url = f'/api/v1/get-dit-reference-postcode/?postcode={row[2].replace(" ", "%20")}'
+            assert row[2:] == make_hawk_auth_request(client, url).json['values'][0]
+
+    content = 'postcode\nab10 1aa\nXX1 1XX\n'
+    response = make_hawk_auth_post_request(client, BATCH_URL, content, 'text/csv')
+    assert response.status_code == 200
+    lines = response.get_data(as_text=True).splitlines()
+    assert lines[0].startswith('query,found,postcode,local_authority_district_code,')
+    assert lines[1].startswith('ab10 1aa,True,AB10 1AA,asdf,')
+    assert lines[2].startswith('XX1 1XX,False,,,')
+
+
+@pytest.mark.parametrize(
+    'content,content_type,error',
+    (
+        ('[]', 'application/json', 'No postcodes specified'),
+        ('{"postcode": "AB10 1AA"}', 'application/json', 'Expected a JSON list of postcodes'),
+        ('["AB10 1AA", "AB10 1AB", "AB10 1AD"]', 'application/json', 'More than 2 postcodes'),
+        ('postcode\n', 'text/csv', 'No postcodes specified'),
+    ),
+)
+def test_get_dit_reference_postcodes_batch_bad_request(
+    app_with_hawk_user, app_with_mock_cache, content, content_type, error
+):
+    app_with_hawk_user.config['app']['postcode_batch_max_size'] = 2
+    client = app_with_hawk_user.test_client()
+    response = make_hawk_auth_post_request(client, BATCH_URL, content, content_type)
+    assert response.status_code == 400
+    assert response.json['error'].startswith(error)
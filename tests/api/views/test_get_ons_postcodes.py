@@ -1,3 +1,9 @@
+import datetime
+from unittest import mock
+
+import pytest
+
+from app.api.postcode_grid import PostcodeGrid
 from tests.api.views import make_hawk_auth_request
 
 ONS_POSTCODE_FIELDS = [
@@ -127,3 +133,88 @@ def test_get_ons_postcodes_when_next_id_specified(
         'next': None,
         'values': [expected_result],
     }
+
+
+NEAREST_URL = '/api/v1/get-ons-postcodes/nearest/'
+
+NEAREST_POSTCODES = [
+    {'postcode': 'AB1 0AA', 'easting': 385386, 'northing': 801193, 'ctry': 'S92000003'},
+    {'postcode': 'AB1 0AB', 'easting': 385086, 'northing': 801593, 'ctry': 'S92000003'},
+    {'postcode': 'AB1 0AD', 'easting': 387386, 'northing': 801193, 'ctry': 'S92000003'},
+    # terminated
+    {
+        'postcode': 'AB1 0AE',
+        'easting': 385386,
+        'northing': 801194,
+        'ctry': 'S92000003',
+        'doterm': datetime.date(2019, 1, 1),
+    },
+    # no grid reference
+    {'postcode': 'GY1 1AA', 'easting': None, 'northing': None, 'ctry': 'L93000001'},
+    # Irish Grid reference
+    {'postcode': 'BT1 1AA', 'easting': 333800, 'northing': 374500, 'ctry': 'N92000002'},
+]
+
+
+@mock.patch('app.api.views.ons_postcodes.postcode_grid', PostcodeGrid(reload_check_seconds=0))
+def test_get_nearest_ons_postcodes(app_with_hawk_user, app_with_mock_cache, add_ons_postcode):
+    add_ons_postcode(NEAREST_POSTCODES)
+    client = app_with_hawk_user.test_client()
+
+    response = make_hawk_auth_request(client, f'{NEAREST_URL}?postcode=ab10aa')
+    assert response.status_code == 200
+    assert response.json == {
+        'headers': ['pcds', 'easting', 'northing', 'distance'],
+        'values': [
+            ['AB1 0AA', 385386, 801193, 0.0],
+            ['AB1 0AB', 385086, 801593, 500.0],
+            ['AB1 0AD', 387386, 801193, 2000.0],
+        ],
+    }
+
+    response = make_hawk_auth_request(client, f'{NEAREST_URL}?postcode=AB1%200AA&limit=1')
+    assert [row[0] for row in response.json['values']] == ['AB1 0AA']
+
+    response = make_hawk_auth_request(client, f'{NEAREST_URL}?postcode=AB1%200AA&radius=1000')
+    assert [row[0] for row in response.json['values']] == ['AB1 0AA', 'AB1 0AB']
+
+    url = f'{NEAREST_URL}?easting=387386&northing=801000&limit=2'
+    response = make_hawk_auth_request(client, url)
+    assert response.json['values'] == [
+        ['AB1 0AD', 387386, 801193, 193.0],
+        ['AB1 0AA', 385386, 801193, 2009.3],
+    ]
+
+    # Northern Ireland postcodes are only near each other
+    response = make_hawk_auth_request(client, f'{NEAREST_URL}?postcode=BT1%201AA')
+    assert [row[0] for row in response.json['values']] == ['BT1 1AA']
+    url = f'{NEAREST_URL}?easting=333800&northing=374500&grid=osi'
+    response = make_hawk_auth_request(client, url)
+    assert [row[0] for row in response.json['values']] == ['BT1 1AA']
+
+    for postcode in ('AB1 0AE', 'GY1 1AA', 'ZZ1 1ZZ'):
+        response = make_hawk_auth_request(client, f'{NEAREST_URL}?postcode={postcode}')
+        assert response.status_code == 200
+        assert response.json['values'] == []
+
+
+@pytest.mark.parametrize(
+    'query,error',
+    (
+        ('', 'No postcode or easting and northing specified'),
+        ('easting=385386', 'No postcode or easting and northing specified'),
+        ('easting=east&northing=801193', 'easting must be a number'),
+        ('easting=985386&northing=801193', 'easting or northing out of the grid'),
+        ('easting=385386&northing=801193&grid=utm', 'grid must be one of osgb, osi'),
+        ('postcode=AB1%200AA&limit=0', 'limit must be between 1 and 1000'),
+        ('postcode=AB1%200AA&limit=ten', 'limit must be a number'),
+        ('postcode=AB1%200AA&radius=-1', 'radius must be a positive number of metres'),
+    ),
+)
+def test_get_nearest_ons_postcodes_bad_request(
+    app_with_hawk_user, app_with_mock_cache, query, error
+):
+    client = app_with_hawk_user.test_client()
+    response = make_hawk_auth_request(client, f'{NEAREST_URL}?{query}')
+    assert response.status_code == 400
+    assert response.json['error'] == error
@@ -0,0 +1,83 @@
+import csv
+import io
+import zipfile
+
+import pytest
+
+from app.etl.organisation.companies_house import XBRLParser
+from app.etl.organisation.hmrc import DatafileToL0Process
+from benchmarks import generators
+from benchmarks.runner import BENCHMARKS, BenchmarkResult, compare_with_baseline, Regression
+
+
+@pytest.mark.parametrize('name', BENCHMARKS)
+def test_generators_are_seeded(name):
+    generate = BENCHMARKS[name].generate
+    assert generate(20, seed=1) == generate(20, seed=1)
+    assert generate(20, seed=1) != generate(20, seed=2)
+
+
+@pytest.mark.parametrize(
+    'generate',
+    (
+        generators.reference_postcodes_csv,
+        generators.baci_csv,
+        generators.dsv_upload_csv,
+        generators.spire_ref_country_mappings_csv,
+    ),
+)
+def test_csv_generators(generate):
+    rows = list(csv.reader(io.StringIO(generate(10).decode())))
+    assert len(rows) == 11
+    assert len({len(row) for row in rows}) == 1
+
+
+def test_xbrl_zip():
+    with zipfile.ZipFile(io.BytesIO(generators.xbrl_zip(3))) as zf:
+        names = zf.namelist()
+        assert len(names) == 3
+        with zf.open(names[0]) as document:
+            lines = XBRLParser().xbrl_to_tsv(document)
+    # one row per balance sheet date
+    assert len(lines) == 2
+    assert all(len(line.split('\t')) == len(XBRLParser.columns) for line in lines)
+
+
+def test_hmrc_exporters_zip():
+    data = io.BytesIO(generators.hmrc_exporters_zip(30, months=4))
+    csv_data = DatafileToL0Process()._get_csv_data(data)
+    assert len(csv_data.readlines()) == 30
+
+
+def test_onspd_zip():
+    with zipfile.ZipFile(io.BytesIO(generators.onspd_zip(5))) as zf:
+        assert zf.namelist() == ['Data/ONSPD_MAY_2020_UK.csv']
+        data = zf.read('Data/ONSPD_MAY_2020_UK.csv')
+    assert len(data.splitlines()) == 6
+    assert b',"",' in data
+
+
+def test_compare_with_baseline():
+    def result(records_per_second, peak_rss, load_duration, size=100):
+        return BenchmarkResult(
+            name='dsv_upload',
+            size=size,
+            records=size,
+            bytes=1000,
+            duration=1,
+            records_per_second=records_per_second,
+            mb_per_second=1,
+            peak_rss=peak_rss,
+            stages={'datafile_to_l0_temp': load_duration},
+        )
+
+    baseline = {'dsv_upload': result(1000, 100, 1.0)._asdict()}
+
+    assert compare_with_baseline([result(950, 105, 1.05)], baseline, tolerance=0.1) == []
+    assert compare_with_baseline([result(800, 200, 2.0)], baseline, tolerance=0.1) == [
+        Regression('dsv_upload', 'records_per_second', 1000, 800),
+        Regression('dsv_upload', 'peak_rss', 100, 200),
+        Regression('dsv_upload', 'stages.datafile_to_l0_temp', 1.0, 2.0),
+    ]
+    # results of another size are not compared
+    assert compare_with_baseline([result(1, 1, 1, size=10)], baseline) == []
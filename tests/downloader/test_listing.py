@@ -0,0 +1,94 @@
+from unittest import mock
+
+from botocore.exceptions import ClientError
+
+from app.db.models.internal import StorageListingModel
+from app.downloader.listing import IncrementallyListedStorage, s3_object_checksum
+from tests.downloader.mocks import storage_mock
+
+location = 's3://bucket/datasets/hmrc/exporters'
+
+
+def s3_client_mock(keys):
+    client = mock.Mock()
+    client.get_paginator.return_value.paginate.return_value = [
+        {'Contents': [{'Key': key} for key in keys]}
+    ]
+    return client
+
+
+@mock.patch('app.downloader.listing.boto3')
+class TestIncrementallyListedStorage:
+    def test_first_listing_is_full(self, boto3, app_with_db):
+        storage = storage_mock(['exporters2002.zip', 'exporters2001.zip'])
+        listed_storage = IncrementallyListedStorage(storage, location)
+
+        assert listed_storage.get_file_names() == ['exporters2001.zip', 'exporters2002.zip']
+        assert StorageListingModel.get_file_names(location) == [
+            'exporters2001.zip',
+            'exporters2002.zip',
+        ]
+        boto3.client.assert_not_called()
+
+    def test_lists_after_last_file_name(self, boto3, app_with_db):
+        StorageListingModel.add_file_names(location, ['exporters2001.zip', 'exporters2002.zip'])
+        client = s3_client_mock(['datasets/hmrc/exporters/exporters2003.zip'])
+        boto3.client.return_value = client
+        storage = storage_mock(['not listed'])
+        listed_storage = IncrementallyListedStorage(storage, location)
+
+        assert listed_storage.get_file_names() == [
+            'exporters2001.zip',
+            'exporters2002.zip',
+            'exporters2003.zip',
+        ]
+        client.get_paginator.return_value.paginate.assert_called_once_with(
+            Bucket='bucket',
+            Prefix='datasets/hmrc/exporters/',
+            StartAfter='datasets/hmrc/exporters/exporters2002.zip',
+        )
+        storage.get_file_names.assert_not_called()
+        assert StorageListingModel.get_file_names(location)[-1] == 'exporters2003.zip'
+
+    def test_relist(self, boto3, app_with_db):
+        StorageListingModel.add_file_names(location, ['exporters2001.zip', 'exporters2002.zip'])
+        storage = storage_mock(['exporters2002.zip'])
+        listed_storage = IncrementallyListedStorage(storage, location, relist=True)
+
+        assert listed_storage.get_file_names() == ['exporters2002.zip']
+        assert StorageListingModel.get_file_names(location) == ['exporters2002.zip']
+        boto3.client.assert_not_called()
+
+    def test_forget_if_missing(self, boto3, app_with_db):
+        StorageListingModel.add_file_names(location, ['exporters2001.zip', 'exporters2002.zip'])
+        client = mock.Mock()
+        boto3.client.return_value = client
+        listed_storage = IncrementallyListedStorage(storage_mock([]), location)
+
+        assert not listed_storage.forget_if_missing('exporters2002.zip')
+        client.head_object.side_effect = ClientError({'Error': {'Code': '404'}}, 'HeadObject')
+        assert listed_storage.forget_if_missing('exporters2001.zip')
+        client.head_object.assert_called_with(
+            Bucket='bucket', Key='datasets/hmrc/exporters/exporters2001.zip'
+        )
+        assert StorageListingModel.get_file_names(location) == ['exporters2002.zip']
+
+    def test_local_storage_is_listed_in_full(self, boto3, app_with_db):
+        storage = storage_mock(['exporters2001.zip'])
+        listed_storage = IncrementallyListedStorage(storage, 'inputs/datasets/hmrc/exporters')
+
+        assert listed_storage.get_file_names() == ['exporters2001.zip']
+        assert StorageListingModel.get_file_names('inputs/datasets/hmrc/exporters') == []
+        listed_storage.write_file('exporters2002.zip', b'data')
+        storage.write_file.assert_called_once_with('exporters2002.zip', b'data')
+
+
+@mock.patch('app.downloader.listing.boto3')
+def test_s3_object_checksum(boto3):
+    boto3.client.return_value.head_object.return_value = {'ETag': '"abc-2"', 'ContentLength': 3}
+
+    assert s3_object_checksum(location, 'exporters2001.zip') == ('etag:abc-2', 3)
+    boto3.client.return_value.head_object.assert_called_once_with(
+        Bucket='bucket', Key='datasets/hmrc/exporters/exporters2001.zip'
+    )
+    assert s3_object_checksum('inputs/datasets', 'exporters2001.zip') is None
@@ -1,16 +1,22 @@
 import datetime
 from decimal import Decimal
+from io import BytesIO
 from unittest import mock
 
+import pytest
 from datatools.io.fileinfo import FileInfo
+from sqlalchemy import text
 
-from app.etl.organisation.companies_house import CompaniesHouseAccountsPipeline
+from app.etl.organisation.companies_house import CompaniesHouseAccountsPipeline, XBRLParser
 
 
-def test_process_ch_accounts_datafile(app_with_db):
+@pytest.mark.parametrize('parse_workers', (1, 2))
+def test_process_ch_accounts_datafile(app_with_db, parse_workers):
     # run tests
     fi = FileInfo.from_path('tests/fixtures/companies_house/accounts/test_datafile_1.zip')
-    pipeline = CompaniesHouseAccountsPipeline(app_with_db.dbi, trigger_dataflow_dag=True)
+    pipeline = CompaniesHouseAccountsPipeline(
+        app_with_db.dbi, trigger_dataflow_dag=True, parse_workers=parse_workers
+    )
     pipeline.process(fi)
 
     # check output of l0
@@ -182,6 +188,85 @@ def test_process_ch_accounts_datafile(app_with_db):
     ]
     rows_l0 = app_with_db.dbi.execute_query(f'SELECT * FROM {pipeline._l0_table} order by id')
     assert rows_l0 == expected_rows_l0
+    if parse_workers > 1:
+        assert 'parse_worker_0' in [metrics.stage for metrics in pipeline.stage_metrics]
+
+
+XBRL_DOCUMENT = b'''<?xml version="1.0"?>
+<xbrl xmlns="http://www.xbrl.org/2003/instance" xmlns:x="urn:x" xmlns:ix="urn:ix">
+  <ix:nonFraction name="x:Creditors:Creditors" contextRef="c1WithinOneYear">7</ix:nonFraction>
+  <ix:nonFraction name="x:Creditors" contextRef="c1WithinOneYear">1,000</ix:nonFraction>
+  <ix:nonFraction name="x:Equity" contextRef="c1segment">6</ix:nonFraction>
+  <ix:nonFraction name="x:Equity" contextRef="c1" sign="-" scale="3">5</ix:nonFraction>
+  <x:Debtors contextRef="c1">3</x:Debtors>
+  <ix:nonFraction name="x:Debtors" contextRef="c2">4</ix:nonFraction>
+  <div name="a:EntityCurrentLegalOrRegisteredName"><p><span>First</span></p><span>Other</span></div>
+  <ix:nonNumeric name="a:AverageNumberEmployeesDuringPeriod">Employees: 12</ix:nonNumeric>
+  <context id="c1"><period><instant>2020-03-31</instant></period></context>
+  <context id="c1WithinOneYear"><period><instant>2020-03-31</instant></period></context>
+  <context id="c1segment"><period><instant>2020-03-31</instant></period></context>
+  <context id="c2">
+    <period><startDate>2019-01-01</startDate><endDate>2019-12-31</endDate></period>
+  </context>
+</xbrl>'''
+
+
+def test_xbrl_to_tsv():
+    xbrl_file = BytesIO(XBRL_DOCUMENT)
+    xbrl_file.name = 'Prod223_1_1234_20200331.xml'
+
+    rows = [line[:-1].split('\t') for line in XBRLParser().xbrl_to_tsv(xbrl_file)]
+
+    rows = [dict(zip(XBRLParser.columns, row)) for row in rows]
+    assert [(row['period_start'], row['period_end']) for row in rows] == [
+        ('2020-03-31', '2020-03-31'),
+        ('2019-01-01', '2019-12-31'),
+    ]
+    assert [row['debtors'] for row in rows] == ['3.0', '4.0']
+    # a name attribute only matches where its first ":Creditors" ends it
+    assert rows[0]['creditors_due_within_one_year'] == '1000.0'
+    assert rows[0]['shareholder_funds'] == '-5000.0'
+    for row in rows:
+        assert row['entity_current_legal_name'] == 'First'
+        assert row['average_number_employees_during_period'] == '12.0'
+
+
+def add_l0_temp_rows(dbi, pipeline, company_ids):
+    pipeline.create_tables()
+    values = ','.join(f"('{company_id}')" for company_id in company_ids)
+    dbi.execute_statement(
+        text(f'INSERT INTO {pipeline._l0_temp_table} (company_id) VALUES {values}')
+    )
+
+
+def test_process_resumes_from_checkpoint(app_with_db):
+    fi = FileInfo.from_path('tests/fixtures/companies_house/accounts/test_datafile_1.zip')
+    pipeline = CompaniesHouseAccountsPipeline(app_with_db.dbi)
+    add_l0_temp_rows(app_with_db.dbi, pipeline, ['loaded', 'not checkpointed'])
+
+    # all zip members were loaded before the checkpoint
+    pipeline.checkpoint = {'member_index': 1000, 'last_id': 1}
+    pipeline.process(fi)
+
+    rows_l0 = app_with_db.dbi.execute_query(
+        f'SELECT id, company_id FROM {pipeline._l0_table} order by id'
+    )
+    assert rows_l0 == [(1, 'loaded')]
+
+
+def test_process_restarts_when_l0_temp_is_behind_checkpoint(app_with_db):
+    fi = FileInfo.from_path('tests/fixtures/companies_house/accounts/test_datafile_1.zip')
+    pipeline = CompaniesHouseAccountsPipeline(app_with_db.dbi)
+    add_l0_temp_rows(app_with_db.dbi, pipeline, ['stale'])
+
+    pipeline.checkpoint = {'member_index': 1000, 'last_id': 5}
+    pipeline.process(fi)
+
+    rows_l0 = app_with_db.dbi.execute_query(
+        f'SELECT company_id FROM {pipeline._l0_table} order by id'
+    )
+    assert ('12345',) in rows_l0
+    assert ('stale',) not in rows_l0
 
 
 @mock.patch('app.utils.hawk_api_request')
@@ -1,4 +1,6 @@
+import pytest
 from datatools.io.fileinfo import FileInfo
+from sqlalchemy import text
 
 from app.etl.organisation.dit import DITReferencePostcodesPipeline
 from tests.utils import rows_equal_table
@@ -46,3 +48,93 @@ class TestDITReferencePostcodesPipeline:
 
         assert rows_equal_table(app_with_db.dbi, expected_rows, pipeline._l0_table, pipeline)
         assert rows_equal_table(app_with_db.dbi, expected_rows, pipeline._l1_table, pipeline)
+
+    def test_stage_metrics_rows(self, app_with_db):
+        pipeline = DITReferencePostcodesPipeline(app_with_db.dbi, force=True)
+        pipeline.process(FileInfo.from_path(snapshot1))
+        rows = {m.stage: m.rows for m in pipeline.stage_metrics}
+        assert rows['l0_temp_to_l0'] == 2
+        assert rows['l0_to_l1'] == 2
+
+        # the rows already in L0 are updated, the ones already in L1 are left as they are
+        pipeline = DITReferencePostcodesPipeline(app_with_db.dbi, force=False)
+        pipeline.process(FileInfo.from_path(snapshot1))
+        rows = {m.stage: m.rows for m in pipeline.stage_metrics}
+        assert rows['l0_temp_to_l0'] == 2
+        assert rows['l0_to_l1'] == 0
+
+    def test_swap_tables(self, app_with_db):
+        pipeline = DITReferencePostcodesPipeline(app_with_db.dbi, force=False)
+        pipeline.process(FileInfo.from_path(snapshot1))
+        query = f'SELECT * FROM {pipeline._l1_table} ORDER BY id'
+        l1_rows = [tuple(r) for r in app_with_db.dbi.execute_query(query)]
+
+        pipeline = DITReferencePostcodesPipeline(
+            app_with_db.dbi, force=False, delete_previous=True, swap_tables=True
+        )
+        pipeline.process(FileInfo.from_path(snapshot1))
+
+        # the live data is carried over into the swapped in table
+        assert [tuple(r) for r in app_with_db.dbi.execute_query(query)] == l1_rows
+        assert not app_with_db.dbi.table_exists(pipeline.schema, 'L0.shadow')
+        assert not app_with_db.dbi.table_exists(pipeline.schema, 'L1.shadow')
+
+        # constraints are renamed as if the table was created as L1
+        constraints = app_with_db.dbi.execute_query(
+            f"""
+            SELECT conname FROM pg_constraint
+            WHERE conrelid = '{pipeline._l1_table}'::regclass ORDER BY conname
+            """
+        )
+        assert [c for c, in constraints] == ['L1_data_source_row_id_key', 'L1_pkey']
+
+    def test_swap_tables_requires_rebuild(self, app_with_db):
+        with pytest.raises(ValueError):
+            DITReferencePostcodesPipeline(app_with_db.dbi, force=False, swap_tables=True)
+
+    def test_swap_tables_refuses_dependent_views(self, app_with_db):
+        pipeline = DITReferencePostcodesPipeline(app_with_db.dbi, force=True)
+        pipeline.process(FileInfo.from_path(snapshot1))
+        view = f'"{pipeline.schema}"."postcodes_view"'
+        app_with_db.dbi.execute_statement(
+            text(f'CREATE VIEW {view} AS SELECT postcode FROM {pipeline._l1_table}'),
+            raise_if_fail=True,
+        )
+
+        pipeline = DITReferencePostcodesPipeline(app_with_db.dbi, force=True, swap_tables=True)
+        with pytest.raises(ValueError):
+            pipeline.process(FileInfo.from_path(snapshot1))
+
+        # the view is left as it was
+        rows = app_with_db.dbi.execute_query(f"SELECT to_regclass('{view}') IS NOT NULL")
+        assert rows[0][0]
+        app_with_db.dbi.execute_statement(text(f'DROP VIEW {view}'), raise_if_fail=True)
+
+    def test_l0_to_l1_in_chunks(self, app_with_db):
+        pipeline = DITReferencePostcodesPipeline(app_with_db.dbi, force=True)
+        pipeline.process(FileInfo.from_path(snapshot1))
+        query = f'SELECT data_source_row_id, postcode FROM {pipeline._l1_table} ORDER BY 1'
+        l1_rows = [tuple(r) for r in app_with_db.dbi.execute_query(query)]
+
+        pipeline = DITReferencePostcodesPipeline(app_with_db.dbi, force=True, l0_to_l1_chunk_size=1)
+        pipeline.process(FileInfo.from_path(snapshot1))
+
+        assert [tuple(r) for r in app_with_db.dbi.execute_query(query)] == l1_rows
+        assert pipeline.stage_metrics[-1].stage == 'l0_to_l1'
+        assert pipeline.stage_metrics[-1].rows == 2
+
+    def test_postcode_normalised(self, app_with_db):
+        pipeline = DITReferencePostcodesPipeline(app_with_db.dbi, force=True)
+        pipeline.process(FileInfo.from_path(snapshot1))
+        query = f'SELECT postcode_normalised FROM {pipeline._l1_table} ORDER BY 1'
+        assert [r[0] for r in app_with_db.dbi.execute_query(query)] == ['ab101aa', 'hu47sw']
+
+        # the lookup index is created again on the recreated table
+        indexes = app_with_db.dbi.execute_query(
+            f"""
+            SELECT indexname FROM pg_indexes
+            WHERE schemaname = '{pipeline.schema}' AND tablename = 'L1'
+            AND indexdef LIKE '%postcode_normalised%'
+            """
+        )
+        assert len(indexes) == 1
@@ -80,3 +80,8 @@ class TestProcess:
             session = app_with_db.db.session
             rows = session.query(pipeline.sql_alchemy_model).all()
             assert len(rows) > 0
+
+    def test_dependencies(self):
+        assert SPIRECountryGroupPipeline.dependencies == []
+        assert set(SPIRECountryGroupEntryPipeline.dependencies) == {SPIRECountryGroupPipeline}
+        assert set(SPIREApplicationPipeline.dependencies) == {SPIREBatchPipeline}
@@ -1,4 +1,8 @@
+from io import BytesIO
+
+import pytest
 from datatools.io.fileinfo import FileInfo
+from psycopg2 import DataError
 
 from app.etl.pipeline_type.dsv_to_table import DSVToTablePipeline
 from tests.utils import rows_equal_table
@@ -53,6 +57,65 @@ class TestDSVToTablePipeline:
         ]
         assert rows_equal_table(app_with_db.dbi, expected_rows, pipeline._l0_table, pipeline)
 
+    def test_pipeline_with_parallel_copy(self, app_with_db):
+        pipeline = DSVToTablePipeline(
+            app_with_db.dbi,
+            organisation='comtrade',
+            dataset='country_code_and_iso',
+            data_column_types=[
+                ('ctyCode', 'int'),
+                ('cty Name English', 'text'),
+                ('cty Fullname English', 'text'),
+                ('Cty Abbreviation', 'text'),
+                ('Cty Comments', 'text'),
+                ('ISO2-digit Alpha', 'text'),
+                ('ISO3-digit Alpha', 'text'),
+                ('Start Valid Year', 'text'),
+                ('End Valid Year', 'text'),
+            ],
+            parallel_copy_workers=2,
+        )
+        fi = FileInfo.from_path('tests/fixtures/generic_dsv/country_list.csv')
+        pipeline.process(fi)
+
+        # ids are assigned in file order, as with a single COPY
+        rows = app_with_db.dbi.execute_query(
+            f'SELECT id, "ctyCode" FROM {pipeline._l0_table} ORDER BY id'
+        )
+        assert [tuple(r) for r in rows] == [(1, 0), (2, 4), (3, 899), (4, 918)]
+
+    def test_pipeline_with_unlogged_staging_tables(self, app_with_db):
+        pipeline = DSVToTablePipeline(
+            app_with_db.dbi,
+            organisation='comtrade',
+            dataset='country_code_and_iso',
+            data_column_types=[
+                ('ctyCode', 'int'),
+                ('cty Name English', 'text'),
+                ('cty Fullname English', 'text'),
+                ('Cty Abbreviation', 'text'),
+                ('Cty Comments', 'text'),
+                ('ISO2-digit Alpha', 'text'),
+                ('ISO3-digit Alpha', 'text'),
+                ('Start Valid Year', 'text'),
+                ('End Valid Year', 'text'),
+            ],
+            unlogged_staging_tables=True,
+        )
+        fi = FileInfo.from_path('tests/fixtures/generic_dsv/country_list.csv')
+        pipeline.process(fi)
+
+        rows = app_with_db.dbi.execute_query(
+            f'SELECT id, "ctyCode" FROM {pipeline._l0_table} ORDER BY id'
+        )
+        assert [tuple(r) for r in rows] == [(1, 0), (2, 4), (3, 899), (4, 918)]
+        # the staging table is dropped, L0 itself stays logged
+        persistence = app_with_db.dbi.execute_query(
+            f"SELECT relpersistence FROM pg_class WHERE oid = '{pipeline._l0_table}'::regclass"
+        )
+        assert persistence[0][0] == 'p'
+        assert not app_with_db.dbi.table_exists(pipeline.schema, 'L0.temp')
+
     def test_pipeline_with_comtrade_csv_with_duplicate_rows(self, app_with_db):
         pipeline = DSVToTablePipeline(
             app_with_db.dbi,
@@ -445,3 +508,43 @@ class TestDSVToTablePipeline:
             ),
         ]
         assert rows_equal_table(app_with_db.dbi, expected_rows, pipeline._l0_table, pipeline)
+
+
+class TestRejectedRows:
+    data = b'code,name\n1,a\nx,b\n3,"c\nd"\n4,e,extra\n5,f\n'
+
+    def pipeline(self, dbi, **kwargs):
+        return DSVToTablePipeline(
+            dbi,
+            organisation='test',
+            dataset='rejects',
+            data_column_types=[('code', 'int'), ('name', 'text')],
+            **kwargs,
+        )
+
+    def test_loads_good_rows_and_rejects_bad_rows(self, app_with_db):
+        pipeline = self.pipeline(app_with_db.dbi, max_rejected_rows=2)
+        for _ in range(2):
+            pipeline.process(FileInfo('bad_rows.csv', BytesIO(self.data)))
+
+        rows = app_with_db.dbi.execute_query(
+            f'SELECT code, name FROM {pipeline._l0_table} ORDER BY id'
+        )
+        assert [tuple(r) for r in rows] == [(1, 'a'), (3, 'c\nd'), (5, 'f')]
+        # rejects of a previous run of the datafile are replaced
+        rejects = app_with_db.dbi.execute_query(
+            f'SELECT datafile, line_number, record FROM {pipeline._rejects_table} ORDER BY id'
+        )
+        assert [tuple(r) for r in rejects] == [
+            ('bad_rows.csv', 3, 'x,b'),
+            ('bad_rows.csv', 6, '4,e,extra'),
+        ]
+
+    def test_fails_when_too_many_rows_are_rejected(self, app_with_db):
+        pipeline = self.pipeline(app_with_db.dbi, max_rejected_rows=1)
+        with pytest.raises(DataError):
+            pipeline.process(FileInfo('bad_rows.csv', BytesIO(self.data)))
+
+    def test_cannot_be_used_with_parallel_copy(self, app_with_db):
+        with pytest.raises(ValueError):
+            self.pipeline(app_with_db.dbi, max_rejected_rows=1, parallel_copy_workers=2)
@@ -1,12 +1,17 @@
+from io import BytesIO
+from zipfile import ZipFile
+
+import pytest
 from datatools.io.fileinfo import FileInfo
 
-from app.etl.organisation.hmrc import HMRCExportersPipeline
+from app.etl.organisation.hmrc import DatafileToL0Process, HMRCExportersPipeline
 from tests.utils import rows_equal_table
 
 
-def test_raw_to_events(app_with_db):
+@pytest.mark.parametrize('parse_workers', (1, 2))
+def test_raw_to_events(app_with_db, parse_workers):
     fi = FileInfo.from_path('tests/fixtures/hmrc/exporters/exporters_2016_mock.zip')
-    pipeline = HMRCExportersPipeline(app_with_db.dbi)
+    pipeline = HMRCExportersPipeline(app_with_db.dbi, parse_workers=parse_workers)
     pipeline.process(fi)
 
     expected_rows = [
@@ -34,6 +39,12 @@ def test_raw_to_events(app_with_db):
     ]
     assert rows_equal_table(app_with_db.dbi, expected_rows, pipeline._l1_table, pipeline)
 
+    # ids follow the order of the monthly zips whether or not they are formatted in parallel
+    rows_l0 = app_with_db.dbi.execute_query(
+        f'SELECT id, company_name FROM {pipeline._l0_table} order by id'
+    )
+    assert rows_l0 == [(1, 'ABC COMPANY LTD'), (2, 'AAA LIMITED'), (3, 'BBB LIMITED')]
+
 
 def test_loading_new_data_into_existing_schema(app_with_db):
     fi = FileInfo.from_path('tests/fixtures/hmrc/exporters/exporters_2016_mock.zip')
@@ -90,3 +101,30 @@ def test_loading_new_data_into_existing_schema(app_with_db):
         ),
     ]
     assert rows_equal_table(app_with_db.dbi, expected_rows, pipeline._l1_table, pipeline)
+
+
+def zip_bytes(members):
+    data = BytesIO()
+    with ZipFile(data, 'w') as zf:
+        for name, member_data in members:
+            zf.writestr(name, member_data)
+    return data.getvalue()
+
+
+def test_csv_data_is_streamed_in_chunks(mocker):
+    mocker.patch.object(DatafileToL0Process, 'COPY_CHUNK_SIZE', 10)
+    line = '201601\tE\tA "B" Ltd\t1 Street\t\t\t\t\tAB1 1AB\t1234\t5678'
+    lines = '\r\n'.join([line, 'short\tline', line.replace('A "B"', 'Caf\u00e9')])
+    inner_zip = zip_bytes([('exporters201601.txt', lines.encode('mac-roman'))])
+    data = zip_bytes(
+        [('exporters201601.zip', inner_zip), ('exporters201602.txt', line.encode('mac-roman'))]
+    )
+
+    chunks = list(DatafileToL0Process()._get_csv_chunks(BytesIO(data)))
+
+    expected_line = '"201601","E","A B Ltd","1 Street","","","","","AB1 1AB","1234,5678"\n'
+    assert chunks == [
+        expected_line.encode(),
+        expected_line.replace('A B', 'Caf\u00e9').encode(),
+        expected_line.encode(),
+    ]
@@ -1,13 +1,25 @@
 import os.path
+import threading
 from datetime import datetime
+from hashlib import sha256
+from io import BytesIO
 from unittest import mock
 
+import fakeredis
 import pytest
 from freezegun import freeze_time
 
 from app.constants import DatafileState
-from app.db.models.internal import DatafileRegistryModel
-from app.etl.manager import DSSDatafileProvider, Manager, PipelineConfig
+from app.db.models.internal import DatafileRegistryModel, PipelineStageMetricsModel
+from app.etl.manager import (
+    DatafilePrefetcher,
+    DSSDatafileProvider,
+    fetch_datafile,
+    Manager,
+    MissingDatafileError,
+    PipelineConfig,
+)
+from app.etl.work_queue import WorkQueue
 
 
 class FakePipeline:
@@ -20,6 +32,88 @@ class FakePipeline:
             raise Exception(self.raise_processing_exception)
 
 
+class FakeFileInfo:
+    def __init__(self, name, data):
+        self.name = name
+        self.data = BytesIO(data)
+
+
+@pytest.mark.parametrize('stream', (False, True))
+def test_fetch_datafile_with_checksum(stream):
+    file_info = FakeFileInfo('a', b'aaa')
+    datafile = fetch_datafile(
+        lambda file_name: file_info,
+        'a',
+        checksum=lambda file_name: ('etag:abc', 3),
+        stream=stream,
+    )
+    assert (datafile.content_digest, datafile.size) == ('etag:abc', 3)
+    assert (datafile.file_info is file_info) == stream
+    assert datafile.file_info.data.read() == b'aaa'
+
+
+class TestDatafilePrefetcher:
+    def test_yields_files_in_order(self):
+        def fetch(file_name):
+            return FakeFileInfo(f'unpacked/{file_name}', file_name.encode() * 3)
+
+        prefetcher = DatafilePrefetcher(fetch, ['a', 'b', 'c'], num_files=2, memory_bytes=4)
+        actual = [
+            (d.file_name, d.file_info.name, d.file_info.data.read(), d.size) for d in prefetcher
+        ]
+        assert actual == [
+            ('a', 'unpacked/a', b'aaa', 3),
+            ('b', 'unpacked/b', b'bbb', 3),
+            ('c', 'unpacked/c', b'ccc', 3),
+        ]
+
+    @pytest.mark.parametrize(
+        'num_files,max_bytes,expected_fetched',
+        (
+            (1, None, ['a', 'b']),
+            (2, None, ['a', 'b', 'c']),
+            (2, 5, ['a', 'b']),
+            (2, 2, ['a']),
+        ),
+    )
+    def test_fetches_ahead_within_budget(self, num_files, max_bytes, expected_fetched):
+        fetched = []
+        all_fetched = threading.Event()
+
+        def fetch(file_name):
+            fetched.append(file_name)
+            if len(fetched) == len(expected_fetched):
+                all_fetched.set()
+            return FakeFileInfo(file_name, b'xxx')
+
+        prefetcher = DatafilePrefetcher(fetch, ['a', 'b', 'c', 'd'], num_files, max_bytes)
+        files = iter(prefetcher)
+        next(files)
+        assert all_fetched.wait(timeout=5)
+        assert fetched == expected_fetched
+        files.close()
+
+    def test_raises_fetch_error_when_reached(self):
+        def fetch(file_name):
+            if file_name == 'b':
+                raise ValueError('download failed')
+            return FakeFileInfo(file_name, b'')
+
+        files = iter(DatafilePrefetcher(fetch, ['a', 'b', 'c'], num_files=2))
+        assert next(files)[0] == 'a'
+        with pytest.raises(ValueError):
+            next(files)
+
+    def test_skips_missing_files(self):
+        def fetch(file_name):
+            if file_name == 'b':
+                raise MissingDatafileError(file_name)
+            return FakeFileInfo(file_name, b'')
+
+        files = DatafilePrefetcher(fetch, ['a', 'b', 'c'], num_files=2)
+        assert [d.file_name for d in files] == ['a', 'c']
+
+
 class TestETLManager:
     @pytest.mark.parametrize(
         'pipeline,expected_result',
@@ -97,7 +191,7 @@ class TestETLManager:
         expected_error_message,
     ):
         def read_files(*args, **kwargs):
-            yield ['fake_file.txt']
+            yield FakeFileInfo('fake_file.txt', b'a,b\n1,2\n')
 
         mock_get_file_names.return_value = ['fake_file.txt']
         mock_read_files.side_effect = read_files
@@ -122,6 +216,78 @@ class TestETLManager:
         assert actual_data_file_registry.created_timestamp == datetime.utcnow()
         assert actual_data_file_registry.updated_timestamp == datetime.utcnow()
         assert actual_data_file_registry.source == '1234'
+        assert actual_data_file_registry.content_digest == sha256(b'a,b\n1,2\n').hexdigest()
+        assert actual_data_file_registry.size == 8
+        actual_stage_metrics = PipelineStageMetricsModel.query.all()
+        assert [m.stage for m in actual_stage_metrics] == ['fetch']
+        assert actual_stage_metrics[0].source == '1234'
+        assert actual_stage_metrics[0].file_name == 'fake_file.txt'
+        assert actual_stage_metrics[0].datafile_registry_id == actual_data_file_registry.id
+        assert actual_stage_metrics[0].duration >= 0
+
+    def test_pipeline_process_resumes_from_checkpoint(self, app_with_db):
+        checkpoints = []
+
+        class CheckpointingPipeline(FakePipeline):
+            def process(self, *args, **kwargs):
+                checkpoints.append(self.checkpoint)
+                self.on_checkpoint((self.checkpoint or 0) + 1)
+                super().process(*args, **kwargs)
+
+        manager = Manager(dbi=app_with_db.dbi)
+        pipeline = CheckpointingPipeline(1234, raise_processing_exception='Processing Error')
+        manager._pipelines['fake_pipeline'] = PipelineConfig(
+            pipeline=pipeline,
+            sub_directory=None,
+            force=False,
+            unpack=False,
+            trigger_dataflow_dag=False,
+        )
+        manager.pipeline_process('fake_pipeline')
+        manager.pipeline_process('fake_pipeline')
+        pipeline.raise_processing_exception = None
+        manager.pipeline_process('fake_pipeline')
+        manager.pipeline_process('fake_pipeline')
+
+        assert checkpoints == [None, 1, 2, None]
+        entries = DatafileRegistryModel.query.order_by(DatafileRegistryModel.id).all()
+        assert [(e.state, e.checkpoint) for e in entries] == [
+            (DatafileState.FAILED.value, 1),
+            (DatafileState.FAILED.value, 2),
+            (DatafileState.PROCESSED.value, None),
+            (DatafileState.PROCESSED.value, None),
+        ]
+
+    @mock.patch.object(FakePipeline, 'process')
+    @mock.patch.object(DSSDatafileProvider, 'get_file_names')
+    @mock.patch.object(DSSDatafileProvider, 'read_files')
+    def test_pipeline_process_ignores_duplicate_content(
+        self, mock_read_files, mock_get_file_names, mock_process, app_with_db
+    ):
+        def read_files(file_name, **kwargs):
+            yield FakeFileInfo(file_name, b'a,b\n1,2\n')
+
+        mock_get_file_names.return_value = ['file_1.csv', 'file_2.csv']
+        mock_read_files.side_effect = read_files
+
+        bucket = app_with_db.config['s3']['bucket_url']
+        source_folder = os.path.join(bucket, app_with_db.config['s3']['datasets_folder'])
+        manager = Manager(storage=source_folder, dbi=app_with_db.dbi)
+        manager._pipelines['fake_pipeline'] = PipelineConfig(
+            pipeline=FakePipeline(1234),
+            sub_directory='/tmp/fake_pipeline',
+            force=False,
+            unpack=False,
+            trigger_dataflow_dag=False,
+        )
+        manager.pipeline_process('fake_pipeline')
+
+        assert mock_process.call_count == 1
+        states = {entry.file_name: entry.state for entry in DatafileRegistryModel.query.all()}
+        assert states == {
+            'file_1.csv': DatafileState.PROCESSED.value,
+            'file_2.csv': DatafileState.IGNORED.value,
+        }
 
     @mock.patch.object(Manager, 'pipeline_process')
     def test_pipeline_process_all(self, mock_pipeline_process):
@@ -133,6 +299,154 @@ class TestETLManager:
         assert mock_pipeline_process.call_args_list[0][0][0] == 'fake_pipeline'
         assert mock_pipeline_process.call_args_list[1][0][0] == 'fake_pipeline_2'
 
+    def test_pipeline_process_all_in_workers(self, app_with_db, tmp_path):
+        processed = tmp_path / 'processed.txt'
+
+        class RecordingPipeline(FakePipeline):
+            def process(self, *args, **kwargs):
+                # the pipelines run in worker processes
+                with open(processed, 'a') as f:
+                    f.write(f'{self.id}\n')
+                super().process(*args, **kwargs)
+
+        class LoadPipeline(RecordingPipeline):
+            pass
+
+        class TransformPipeline(RecordingPipeline):
+            dependencies = [LoadPipeline]
+
+        manager = Manager(dbi=app_with_db.dbi)
+        manager.pipeline_register(
+            LoadPipeline('load', raise_processing_exception='load failed'), pipeline_id='load'
+        )
+        manager.pipeline_register(TransformPipeline('transform'), pipeline_id='transform')
+        manager.pipeline_register(RecordingPipeline('other'), pipeline_id='other')
+        manager.pipeline_process_all(workers=2)
+
+        # the failed load is registered, not raised, and its dependent is skipped
+        assert sorted(processed.read_text().split()) == ['load', 'other']
+
+    def test_pipeline_dependencies(self):
+        class LoadPipeline(FakePipeline):
+            pass
+
+        class TransformPipeline(FakePipeline):
+            dependencies = [LoadPipeline]
+
+        manager = Manager()
+        for pipeline in (TransformPipeline(1), LoadPipeline(2), LoadPipeline(3), FakePipeline(4)):
+            manager.pipeline_register(pipeline)
+        assert manager.pipeline_dependencies() == {
+            '1': {'2', '3'},
+            '2': set(),
+            '3': set(),
+            '4': set(),
+        }
+
+    @mock.patch.object(DSSDatafileProvider, 'get_file_names')
+    @mock.patch.object(DSSDatafileProvider, 'read_files')
+    def test_pipeline_enqueue_all_and_work(self, mock_read_files, mock_get_file_names, app_with_db):
+        processed = []
+
+        class LoadPipeline(FakePipeline):
+            def process(self, file_info=None, **kwargs):
+                processed.append((self.id, file_info.name))
+
+        class TransformPipeline(FakePipeline):
+            dependencies = [LoadPipeline]
+
+            def process(self, file_info=None, **kwargs):
+                processed.append((self.id, None))
+
+        def read_files(file_name, **kwargs):
+            yield FakeFileInfo(file_name, file_name.encode())
+
+        mock_get_file_names.return_value = ['file_1.csv', 'file_2.csv']
+        mock_read_files.side_effect = read_files
+
+        bucket = app_with_db.config['s3']['bucket_url']
+        source_folder = os.path.join(bucket, app_with_db.config['s3']['datasets_folder'])
+        manager = Manager(storage=source_folder, dbi=app_with_db.dbi)
+        manager.pipeline_register(TransformPipeline('transform'), pipeline_id='transform')
+        manager.pipeline_register(
+            LoadPipeline('load'), sub_directory='/tmp/load', pipeline_id='load'
+        )
+        work_queue = WorkQueue(fakeredis.FakeRedis(), name='test_queue')
+
+        assert manager.pipeline_enqueue_all(work_queue) == 3
+        manager.pipeline_work(work_queue, poll_seconds=0)
+
+        assert processed == [('load', 'file_1.csv'), ('load', 'file_2.csv'), ('transform', None)]
+        assert work_queue.outstanding('load') == work_queue.outstanding('transform') == 0
+        states = {
+            (entry.source, entry.file_name): entry.state
+            for entry in DatafileRegistryModel.query.all()
+        }
+        assert states == {
+            ('load', 'file_1.csv'): DatafileState.PROCESSED.value,
+            ('load', 'file_2.csv'): DatafileState.PROCESSED.value,
+            ('transform', None): DatafileState.PROCESSED.value,
+        }
+        # processed datafiles are not queued again
+        assert manager.pipeline_enqueue_all(work_queue) == 1
+
+    @mock.patch.object(DSSDatafileProvider, 'get_file_names')
+    @mock.patch.object(DSSDatafileProvider, 'read_files')
+    def test_pipeline_work_when_dependency_fails(
+        self, mock_read_files, mock_get_file_names, app_with_db
+    ):
+        processed = []
+
+        class LoadPipeline(FakePipeline):
+            def process(self, file_info=None, **kwargs):
+                if file_info.name == 'file_1.csv':
+                    raise Exception('load failed')
+                processed.append((self.id, file_info.name))
+
+        class TransformPipeline(FakePipeline):
+            dependencies = [LoadPipeline]
+
+            def process(self, file_info=None, **kwargs):
+                processed.append((self.id, None))
+
+        def read_files(file_name, **kwargs):
+            yield FakeFileInfo(file_name, file_name.encode())
+
+        mock_get_file_names.return_value = ['file_1.csv', 'file_2.csv']
+        mock_read_files.side_effect = read_files
+
+        bucket = app_with_db.config['s3']['bucket_url']
+        source_folder = os.path.join(bucket, app_with_db.config['s3']['datasets_folder'])
+        manager = Manager(storage=source_folder, dbi=app_with_db.dbi)
+        manager.pipeline_register(TransformPipeline('transform'), pipeline_id='transform')
+        manager.pipeline_register(
+            LoadPipeline('load'), sub_directory='/tmp/load', pipeline_id='load'
+        )
+        work_queue = WorkQueue(fakeredis.FakeRedis(), name='test_queue')
+
+        assert manager.pipeline_enqueue_all(work_queue) == 3
+        manager.pipeline_work(work_queue, poll_seconds=0)
+
+        # the transform is not run on the partly loaded data and stays queued
+        assert processed == [('load', 'file_2.csv')]
+        assert work_queue.failed('load') == 1
+        assert work_queue.outstanding('load') == 0
+        assert work_queue.outstanding('transform') == 1
+        # the next run clears the failures, retrying the failed datafile
+        assert manager.pipeline_enqueue_all(work_queue) == 1
+        assert work_queue.failed('load') == 0
+
+    def test_pipeline_dependencies_when_circular(self):
+        class CircularPipeline(FakePipeline):
+            pass
+
+        CircularPipeline.dependencies = [CircularPipeline]
+        manager = Manager()
+        manager.pipeline_register(CircularPipeline(1))
+        manager.pipeline_register(CircularPipeline(2))
+        with pytest.raises(ValueError):
+            manager.pipeline_dependencies()
+
     def test_pipeline_register(self):
         manager = Manager()
         manager.pipeline_register(
@@ -1,4 +1,8 @@
+from unittest import mock
+
+import pytest
 from datatools.io.fileinfo import FileInfo
+from sqlalchemy import text
 
 from app.etl.organisation.ons import ONSPostcodeDirectoryPipeline
 from tests.utils import rows_equal_table
@@ -774,3 +778,184 @@ class TestONSPostcodeDirectoryPipeline:
             ),
         ]
         assert rows_equal_table(app_with_db.dbi, expected_rows, pipeline._l1_table, pipeline)
+
+    def test_deferred_indexes(self, app_with_db):
+        pipeline = ONSPostcodeDirectoryPipeline(
+            app_with_db.dbi, force=False, deferred_index_ratio=0, deferred_index_min_rows=0
+        )
+        query = f"""
+            SELECT indexdef FROM pg_indexes
+            WHERE schemaname = '{pipeline.schema}' AND tablename = 'L1' ORDER BY indexname
+        """
+        indexes = [tuple(r) for r in app_with_db.dbi.execute_query(query)]
+        pipeline.process(FileInfo.from_path(file1))
+
+        # the pcds index is dropped while appending and rebuilt with the same definition
+        assert [tuple(r) for r in app_with_db.dbi.execute_query(query)] == indexes
+        rows = app_with_db.dbi.execute_query(f'SELECT pcds FROM {pipeline._l1_table}')
+        assert sorted(r[0] for r in rows) == ['AB1 0AA', 'AB1 0AB']
+
+    def test_deferred_indexes_rebuilt_by_next_run(self, app_with_db):
+        pipeline = ONSPostcodeDirectoryPipeline(
+            app_with_db.dbi, force=False, deferred_index_ratio=0, deferred_index_min_rows=0
+        )
+        query = f"""
+            SELECT indexdef FROM pg_indexes
+            WHERE schemaname = '{pipeline.schema}' AND tablename = 'L1' ORDER BY indexname
+        """
+        indexes = [tuple(r) for r in app_with_db.dbi.execute_query(query)]
+
+        def create_indexes(index_definitions):
+            if index_definitions:
+                raise Exception('connection lost')
+
+        # the process dies before the dropped indexes are rebuilt
+        with mock.patch.object(pipeline, '_create_indexes', side_effect=create_indexes):
+            with pytest.raises(Exception):
+                pipeline.process(FileInfo.from_path(file1))
+        assert [tuple(r) for r in app_with_db.dbi.execute_query(query)] != indexes
+
+        pipeline = ONSPostcodeDirectoryPipeline(app_with_db.dbi, force=False)
+        pipeline.process(FileInfo.from_path(file1))
+        assert [tuple(r) for r in app_with_db.dbi.execute_query(query)] == indexes
+
+    def test_partition_by_datafile(self, app_with_db):
+        pipeline = ONSPostcodeDirectoryPipeline(
+            app_with_db.dbi, force=True, partition_by_datafile=True
+        )
+        pipeline.process(FileInfo.from_path(file1))
+        pipeline = ONSPostcodeDirectoryPipeline(
+            app_with_db.dbi, force=False, delete_previous=True, partition_by_datafile=True
+        )
+        pipeline.process(FileInfo.from_path(file2))
+
+        for table in ('L0', 'L1'):
+            partitions = app_with_db.dbi.execute_query(
+                f"""
+                SELECT count(*) FROM pg_inherits
+                WHERE inhparent = '{pipeline._fully_qualified(table)}'::regclass
+                """
+            )
+            assert partitions[0][0] == 1
+            rows = app_with_db.dbi.execute_query(
+                f'SELECT DISTINCT datafile_created FROM {pipeline._fully_qualified(table)}'
+            )
+            assert [tuple(r) for r in rows] == [('ONSPD_JUL_2019_UK.zip',)]
+
+        rows = app_with_db.dbi.execute_query(
+            f'SELECT DISTINCT publication_date::text FROM {pipeline._l1_table}'
+        )
+        assert [tuple(r) for r in rows] == [('2019-07-01',)]
+
+    def test_partition_by_datafile_requires_force(self, app_with_db):
+        pipeline = ONSPostcodeDirectoryPipeline(
+            app_with_db.dbi, force=False, partition_by_datafile=True
+        )
+        with pytest.raises(ValueError):
+            pipeline.process(FileInfo.from_path(file1))
+
+    def test_l0_to_l1_resumes_after_failure(self, app_with_db):
+        pipeline = ONSPostcodeDirectoryPipeline(app_with_db.dbi, force=True, l0_to_l1_chunk_size=1)
+        execute_statement = pipeline._execute_statement
+        chunks = []
+
+        def fail_on_second_chunk(stmt, **kwargs):
+            if pipeline.CHUNK_PROGRESS_TABLE in stmt:
+                chunks.append(stmt)
+                if len(chunks) == 2:
+                    raise Exception('connection lost')
+            return execute_statement(stmt, **kwargs)
+
+        with mock.patch.object(pipeline, '_execute_statement', side_effect=fail_on_second_chunk):
+            with pytest.raises(Exception):
+                pipeline.process(FileInfo.from_path(file1))
+        rows = app_with_db.dbi.execute_query(f'SELECT count(*) FROM {pipeline._l1_temp_table}')
+        assert rows[0][0] == 1
+
+        pipeline = ONSPostcodeDirectoryPipeline(app_with_db.dbi, force=False, l0_to_l1_chunk_size=1)
+        pipeline.process(FileInfo.from_path(file1))
+        rows = app_with_db.dbi.execute_query(f'SELECT pcds FROM {pipeline._l1_table}')
+        assert sorted(r[0] for r in rows) == ['AB1 0AA', 'AB1 0AB']
+        rows = app_with_db.dbi.execute_query(
+            f'SELECT count(*) FROM {pipeline._chunk_progress_table}'
+        )
+        assert rows[0][0] == 0
+
+    def test_l0_to_l1_restarts_on_unlogged_staging_tables(self, app_with_db):
+        options = {'l0_to_l1_chunk_size': 1, 'unlogged_staging_tables': True}
+        pipeline = ONSPostcodeDirectoryPipeline(app_with_db.dbi, force=True, **options)
+        execute_statement = pipeline._execute_statement
+        chunks = []
+
+        def fail_on_second_chunk(stmt, **kwargs):
+            if pipeline.CHUNK_PROGRESS_TABLE in stmt:
+                chunks.append(stmt)
+                if len(chunks) == 2:
+                    raise Exception('connection lost')
+            return execute_statement(stmt, **kwargs)
+
+        with mock.patch.object(pipeline, '_execute_statement', side_effect=fail_on_second_chunk):
+            with pytest.raises(Exception):
+                pipeline.process(FileInfo.from_path(file1))
+        # crash recovery truncates unlogged tables, their oids stay the same
+        for table in (pipeline._l0_temp_table, pipeline._l1_temp_table):
+            app_with_db.dbi.execute_statement(text(f'TRUNCATE {table}'), raise_if_fail=True)
+        progress = pipeline._chunk_progress(
+            pipeline._l0_temp_table, pipeline._l1_temp_table, file1.split('/')[-1]
+        )
+        assert progress is None
+
+        pipeline = ONSPostcodeDirectoryPipeline(app_with_db.dbi, force=False, **options)
+        pipeline.process(FileInfo.from_path(file1))
+        rows = app_with_db.dbi.execute_query(f'SELECT pcds FROM {pipeline._l1_table}')
+        assert sorted(r[0] for r in rows) == ['AB1 0AA', 'AB1 0AB']
+
+    def test_delta(self, app_with_db):
+        pipeline = ONSPostcodeDirectoryPipeline(app_with_db.dbi, force=True, delta=True)
+        pipeline.process(FileInfo.from_path(file1))
+        pipeline = ONSPostcodeDirectoryPipeline(app_with_db.dbi, force=False, delta=True)
+        pipeline.process(FileInfo.from_path(file2))
+
+        # AB1 0AB is the same in both publications, AB1 0AA changed and AB1 0AD is new
+        rows = app_with_db.dbi.execute_query(
+            f'SELECT pcds, publication_date::text FROM {pipeline._l1_table} ORDER BY id'
+        )
+        assert [tuple(r) for r in rows] == [
+            ('AB1 0AA', '2019-05-01'),
+            ('AB1 0AB', '2019-05-01'),
+            ('AB1 0AA', '2019-07-01'),
+            ('AB1 0AD', '2019-07-01'),
+        ]
+        rows = app_with_db.dbi.execute_query(f'SELECT count(*) FROM {pipeline._l0_table}')
+        assert rows[0][0] == 4
+
+        current_query = f"""
+            SELECT pcds, dointr::text, publication_date::text
+            FROM {pipeline._current_table} ORDER BY pcd
+        """
+        rows = app_with_db.dbi.execute_query(current_query)
+        assert [tuple(r) for r in rows] == [
+            ('AB1 0AA', '2000-01-01', '2019-07-01'),
+            ('AB1 0AB', '1980-01-01', '2019-05-01'),
+            ('AB1 0AD', '1980-01-01', '2019-07-01'),
+        ]
+
+        # postcodes missing from a publication are removed from the current table
+        pipeline.process(FileInfo.from_path(file1))
+        rows = app_with_db.dbi.execute_query(current_query)
+        assert [tuple(r) for r in rows] == [
+            ('AB1 0AA', '1980-01-01', '2019-05-01'),
+            ('AB1 0AB', '1980-01-01', '2019-05-01'),
+        ]
+        rows = app_with_db.dbi.execute_query(f'SELECT count(*) FROM {pipeline._l1_table}')
+        assert rows[0][0] == 5
+
+    def test_grid_reference(self, app_with_db):
+        pipeline = ONSPostcodeDirectoryPipeline(app_with_db.dbi, force=True)
+        pipeline.process(FileInfo.from_path(file1))
+        query = f'SELECT pcds, easting, northing FROM {pipeline._l1_table} ORDER BY pcds'
+        rows = app_with_db.dbi.execute_query(query)
+        assert [tuple(r) for r in rows] == [
+            ('AB1 0AA', 385386, 801193),
+            ('AB1 0AB', 385177, 801314),
+        ]
@@ -0,0 +1,177 @@
+from io import BytesIO
+
+import pytest
+
+from app.etl.utils import (
+    copy_from_stdin_statement,
+    CountingReader,
+    DSVRange,
+    EmptyQuoteRemover,
+    FileRangeReader,
+    IteratorReader,
+    measure_stage,
+    split_dsv_into_ranges,
+    split_dsv_range,
+)
+
+
+class TestEmptyQuoteRemover:
+    @pytest.mark.parametrize(
+        'data',
+        (
+            b'',
+            b'""',
+            b'"""',
+            b'""""',
+            b'a,"",b\n',
+            b'a,"b ""quoted"" c",""\n"",d,""\n',
+            b'"' * 11 + b'a' + b'"' * 4,
+        ),
+    )
+    @pytest.mark.parametrize('chunk_size', (1, 2, 3, 7, 1024))
+    def test_matches_whole_file_replace(self, data, chunk_size):
+        stream = EmptyQuoteRemover(BytesIO(data), chunk_size=chunk_size)
+        assert stream.read() == data.replace(b'""', b'')
+
+    def test_small_reads(self):
+        data = b'pcd,"",pcds\n"AB1 0AA","","AB1 0AA"\n'
+        stream = EmptyQuoteRemover(BytesIO(data), chunk_size=4)
+        chunks = []
+        chunk = stream.read(5)
+        while chunk:
+            assert len(chunk) <= 5
+            chunks.append(chunk)
+            chunk = stream.read(5)
+        assert b''.join(chunks) == data.replace(b'""', b'')
+
+    def test_reads_wrapped_stream_in_chunks(self):
+        class RecordingStream(BytesIO):
+            read_sizes = []
+
+            def read(self, size=-1):
+                self.read_sizes.append(size)
+                return super().read(size)
+
+        wrapped = RecordingStream(b'a,b\n' * 100)
+        EmptyQuoteRemover(wrapped, chunk_size=16).read()
+        assert set(wrapped.read_sizes) == {16}
+
+
+class TestSplitDSVIntoRanges:
+    def test_ranges_end_on_record_boundaries(self):
+        data = b'a,b\n1,"x\ny"\n2,"z"\n3,""\n4,"w\n\nv"\n5,u'
+        ranges = split_dsv_into_ranges(BytesIO(data), 3, has_header=True, chunk_size=4)
+
+        assert [data[r.start : r.end] for r in ranges] == [
+            b'a,b\n1,"x\ny"\n',
+            b'2,"z"\n3,""\n',
+            b'4,"w\n\nv"\n5,u',
+        ]
+        assert [r.num_records for r in ranges] == [1, 2, 2]
+
+    def test_single_range(self):
+        data = b'a,b\n1,2\n'
+        assert split_dsv_into_ranges(BytesIO(data), 1, has_header=True) == [
+            DSVRange(0, len(data), 1)
+        ]
+
+    def test_empty_file(self):
+        assert split_dsv_into_ranges(BytesIO(b''), 4) == [DSVRange(0, 0, 0)]
+
+    def test_unquoted(self):
+        data = b'a,b\n1,"x\n2,y\n'
+        ranges = split_dsv_into_ranges(BytesIO(data), 2, has_header=True, quote=None)
+        assert [data[r.start : r.end] for r in ranges] == [b'a,b\n1,"x\n', b'2,y\n']
+        assert [r.num_records for r in ranges] == [1, 1]
+
+
+class TestSplitDSVRange:
+    data = b'a,b\n1,"x\ny"\n2,"z"\n3,""\n4,"w\n\nv"\n5,u'
+
+    def test_splits_past_middle_on_record_boundary(self):
+        offset, num_lines = split_dsv_range(BytesIO(self.data), 0, len(self.data), chunk_size=4)
+        assert self.data[:offset] == b'a,b\n1,"x\ny"\n2,"z"\n'
+        assert num_lines == 4
+
+    def test_splits_at_offset(self):
+        assert split_dsv_range(BytesIO(self.data), 0, len(self.data), at=0) == (4, 1)
+
+    def test_split_before_middle_when_last_record_is_long(self):
+        start = self.data.index(b'3,')
+        assert split_dsv_range(BytesIO(self.data), start, len(self.data) - 4) == (start + 5, 1)
+
+    def test_single_record(self):
+        start = self.data.index(b'4,')
+        assert split_dsv_range(BytesIO(self.data), start, start + 9) is None
+        # unquoted, the line breaks of the record are record boundaries
+        assert split_dsv_range(BytesIO(self.data), start, start + 9, quote=None) == (start + 5, 1)
+
+
+class TestFileRangeReader:
+    def test_reads_range(self, tmp_path):
+        path = tmp_path / 'data.csv'
+        path.write_bytes(b'0123456789')
+        with open(path, 'rb') as f:
+            reader = FileRangeReader(f.fileno(), 2, 7)
+            assert reader.read(2) == b'23'
+            assert reader.read() == b'456'
+            assert reader.read() == b''
+
+
+class TestIteratorReader:
+    def test_reads_chunks(self):
+        reader = IteratorReader(iter([b'abc', b'', b'de', b'f']))
+        assert reader.read(2) == b'ab'
+        assert reader.read(5) == b'c'
+        assert reader.read() == b'def'
+        assert reader.read() == b''
+
+
+class TestCopyFromStdinStatement:
+    def test_defaults(self):
+        assert copy_from_stdin_statement('"s"."L0.temp"', ['a', 'b']) == (
+            'COPY "s"."L0.temp" (a,b) FROM STDIN WITH '
+            "(FORMAT csv, HEADER false, DELIMITER ',', QUOTE '\"')"
+        )
+
+    def test_freeze_and_encoding(self):
+        stmt = copy_from_stdin_statement(
+            '"s"."L0.temp"', has_header=True, null='None', encoding='WIN1252', freeze=True
+        )
+        assert stmt == (
+            'COPY "s"."L0.temp" FROM STDIN WITH (FORMAT csv, HEADER true, DELIMITER \',\', '
+            "QUOTE '\"', NULL 'None', ENCODING 'WIN1252', FREEZE true)"
+        )
+
+
+class TestCountingReader:
+    def test_counts_reads(self):
+        reader = CountingReader(BytesIO(b'a,b\n1,2\n3,4\n'))
+        assert reader.readline() == b'a,b\n'
+        assert reader.read(2) == b'1,'
+        assert list(reader) == [b'2\n', b'3,4\n']
+        assert reader.bytes_read == 12
+
+    def test_passes_through_seek(self):
+        reader = CountingReader(BytesIO(b'0123456789'))
+        reader.seek(4)
+        assert reader.read() == b'456789'
+        assert reader.tell() == 10
+        assert reader.bytes_read == 6
+
+
+class TestMeasureStage:
+    def test_sets_metrics(self):
+        with measure_stage('load') as metrics:
+            metrics.rows = 3
+        assert metrics.stage == 'load'
+        assert metrics.rows == 3
+        assert metrics.duration >= 0
+        assert metrics.started_timestamp is not None
+        assert metrics.peak_rss > 0
+
+    def test_sets_duration_on_error(self):
+        with pytest.raises(ValueError):
+            with measure_stage('load') as metrics:
+                raise ValueError()
+        assert metrics.duration >= 0
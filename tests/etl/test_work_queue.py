@@ -0,0 +1,98 @@
+from unittest import mock
+
+import fakeredis
+import pytest
+
+from app.etl.work_queue import redis_from_config, WorkItem, WorkQueue
+
+
+@pytest.fixture
+def work_queue():
+    return WorkQueue(fakeredis.FakeRedis(), name='test_queue', lease_seconds=60)
+
+
+class TestWorkQueue:
+    def test_claims_items_in_order(self, work_queue):
+        assert work_queue.enqueue('a', 'file_1.csv')
+        assert work_queue.enqueue('a', 'file_2.csv')
+        assert work_queue.enqueue('b')
+        assert not work_queue.enqueue('a', 'file_1.csv')
+        assert work_queue.outstanding('a') == 2
+
+        lease = work_queue.claim(['a', 'b'])
+        assert lease.item == WorkItem('a', 'file_1.csv')
+        # one item of a pipeline is leased at a time
+        assert work_queue.claim(['a', 'b']).item == WorkItem('b', None)
+        assert work_queue.claim(['a', 'b']) is None
+
+        assert work_queue.complete(lease)
+        assert work_queue.outstanding('a') == 1
+        assert work_queue.claim(['a']).item == WorkItem('a', 'file_2.csv')
+        # completed items can be queued again
+        assert work_queue.enqueue('a', 'file_1.csv')
+
+    def test_claims_only_given_pipelines(self, work_queue):
+        work_queue.enqueue('a', 'file_1.csv')
+        assert work_queue.claim(['b']) is None
+
+    @mock.patch('app.etl.work_queue.time')
+    def test_requeues_expired_leases(self, mock_time, work_queue, app):
+        mock_time.time.return_value = 1000
+        work_queue.enqueue('a', 'file_1.csv')
+        work_queue.enqueue('a', 'file_2.csv')
+        expired_lease = work_queue.claim(['a'])
+
+        mock_time.time.return_value = 1059
+        assert work_queue.renew(expired_lease)
+        mock_time.time.return_value = 1100
+        assert work_queue.claim(['a']) is None
+
+        mock_time.time.return_value = 1200
+        lease = work_queue.claim(['a'])
+        assert lease.item == WorkItem('a', 'file_1.csv')
+        assert not work_queue.renew(expired_lease)
+        assert not work_queue.complete(expired_lease)
+        assert work_queue.complete(lease)
+        assert work_queue.outstanding('a') == 1
+
+    def test_release(self, work_queue):
+        work_queue.enqueue('a', 'file_1.csv')
+        work_queue.enqueue('a', 'file_2.csv')
+        lease = work_queue.claim(['a'])
+        assert work_queue.release(lease)
+        assert work_queue.claim(['a']).item == WorkItem('a', 'file_1.csv')
+        assert work_queue.outstanding('a') == 2
+
+    def test_fail(self, work_queue):
+        work_queue.enqueue('a', 'file_1.csv')
+        work_queue.enqueue('a', 'file_2.csv')
+        lease = work_queue.claim(['a'])
+        assert work_queue.fail(lease)
+        assert work_queue.outstanding('a') == 1
+        assert work_queue.failed('a') == 1
+        assert work_queue.failed('b') == 0
+        assert work_queue.claim(['a']).item == WorkItem('a', 'file_2.csv')
+        # failed items can be queued again
+        assert work_queue.enqueue('a', 'file_1.csv')
+        work_queue.clear_failed('a')
+        assert work_queue.failed('a') == 0
+
+    def test_heartbeat_renews_lease(self, work_queue):
+        work_queue.enqueue('a', 'file_1.csv')
+        lease = work_queue.claim(['a'])
+        with mock.patch.object(work_queue, 'renew', return_value=True) as mock_renew:
+            with work_queue.heartbeat(lease, interval=0.01):
+                while not mock_renew.called:
+                    pass
+        mock_renew.assert_called_with(lease)
+
+
+@pytest.mark.parametrize(
+    'ssl,expected_url',
+    ((True, 'rediss://dss_redis:6379'), (False, 'redis://dss_redis:6379')),
+)
+@mock.patch('app.etl.work_queue.redis')
+def test_redis_from_config(mock_redis, ssl, expected_url):
+    config = {'host': 'redis://dss_redis', 'port': 6379, 'password': '', 'ssl': ssl}
+    redis_from_config(config)
+    mock_redis.Redis.from_url.assert_called_once_with(expected_url, password=None)
@@ -280,7 +280,7 @@ class TestWorldBankTariffPipeline:
                     # EU - EU has zero rate
                     (201, 724, 36, 2017, 10, None, None, None, 10, None, None, None),
                     # eu_rep_rate expanded from 918-36 (AUS)
-                    (201, 724, 705, 2017, 0, None, None, None, None, None, 0, None)
+                    (201, 724, 705, 2017, 0, None, None, None, None, None, 0, None),
                     # EU - EU has zero rate and trumps app rate
                 ],
             ),
@@ -628,7 +628,7 @@ class TestWorldBankTariffPipeline:
                     # eu-eu trumps all
                     (201, 724, 705, 2016, 0, None, None, None, None, None, 0, 35),
                     # eu-eu trumps all
-                    (201, 724, 705, 2017, 0, None, None, None, None, None, 0, None)
+                    (201, 724, 705, 2017, 0, None, None, None, None, None, 0, None),
                     # eu-eu trumps all
                 ],
             ),
@@ -695,6 +695,35 @@ class TestWorldBankTariffPipeline:
                 pipeline,
             )
 
+    def test_transform_resumes_from_checkpoint(self, mocker, add_dit_baci):
+        patch_years(mocker, ('2018', '2018'))
+        patch_required_countries(
+            mocker,
+            countries=[
+                ('BRA', 76, True),
+                ('ZAF', 710, True),
+                ('DZA', 12, True),
+                ('AGO', 24, True),
+                ('AUS', 36, True),
+            ],
+        )
+
+        self.partial_transform_data()
+        with mock.patch(
+            'app.etl.organisation.world_bank.WorldBankTariffTransformPipeline._get_products'
+        ) as mock_get_products:
+            mock_get_products.return_value = [['301'], ['401']]
+            pipeline = WorldBankTariffTransformPipeline(self.dbi, force=False)
+            pipeline.checkpoint = 201
+            pipeline.process()
+            assert pipeline.checkpoint == '401'
+            assert rows_equal_table(
+                self.dbi,
+                PRODUCT_201_ROWS + PRODUCT_301_ROWS + PRODUCT_401_ROWS,
+                pipeline._l1_table,
+                pipeline,
+            )
+
     def partial_transform_data(self):
         pipeline = WorldBankTariffPipeline(self.dbi, force=True)
         fi = FileInfo.from_path(country_to_country_three_products)
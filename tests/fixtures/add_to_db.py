@@ -19,6 +19,10 @@ def add_ons_postcode(app):
         for record in records:
             defaults = {
                 'pcds': record.get('postcode'),
+                'easting': record.get('easting'),
+                'northing': record.get('northing'),
+                'ctry': record.get('ctry'),
+                'doterm': record.get('doterm'),
             }
             ONSPostcodeDirectoryL1.get_or_create(
                 id=record.get('id', None),
@@ -32,9 +36,13 @@ def add_ons_postcode(app):
 def add_dit_reference_postcodes(app):
     def _method(records):
         for record in records:
+            postcode = record.get('postcode')
             defaults = {
-                'postcode': record.get('postcode'),
+                'postcode': postcode,
+                'postcode_normalised': postcode.replace(' ', '').lower() if postcode else None,
                 'local_authority_district_code': record.get('local_authority_district_code'),
+                'date_of_introduction': record.get('date_of_introduction'),
+                'date_of_termination': record.get('date_of_termination'),
             }
             DITReferencePostcodesL1.get_or_create(
                 id=record.get('id', None),
@@ -119,3 +119,70 @@ def test_get_processed_or_ignored_datafile_names_one_data_source(app_with_db):
     processed_or_ignored_dfs = DatafileRegistryModel.get_processed_or_ignored_datafiles('source2')
 
     assert processed_or_ignored_dfs == {'source2': [entry5['file_name'], entry6['file_name']]}
+
+
+def test_is_processed_or_ignored(app_with_db):
+    for entry in (entry1, entry2, entry3, entry5, entry6):
+        DatafileRegistryModel.get_update_or_create(**entry)
+
+    assert DatafileRegistryModel.is_processed_or_ignored('source1', 'test_file_2.zip')
+    assert not DatafileRegistryModel.is_processed_or_ignored('source1', 'test_file.zip')
+    assert DatafileRegistryModel.is_processed_or_ignored('source2', 'test_file_4.zip')
+    assert not DatafileRegistryModel.is_processed_or_ignored('source1', 'test_file_4.zip')
+
+
+def test_get_processed_datafile(app_with_db):
+    DatafileRegistryModel.get_update_or_create(**entry2, content_digest='abc', size=3)
+    assert DatafileRegistryModel.get_processed_datafile('source1', 'abc') is None
+
+    DatafileRegistryModel.get_update_or_create(**entry3, content_digest='abc', size=3)
+    row = DatafileRegistryModel.get_processed_datafile('source1', 'abc')
+    assert row.file_name == entry3['file_name']
+    assert row.size == 3
+    assert DatafileRegistryModel.get_processed_datafile('source2', 'abc') is None
+
+
+def test_get_checkpoint(app_with_db):
+    row, _ = DatafileRegistryModel.get_update_or_create(**entry2, content_digest='abc')
+    assert DatafileRegistryModel.get_checkpoint('source1', 'test_file.zip') is None
+
+    row.save_checkpoint({'member_index': 1000})
+    assert DatafileRegistryModel.get_checkpoint('source1', 'test_file.zip') == {
+        'member_index': 1000
+    }
+    assert DatafileRegistryModel.get_checkpoint('source1', 'test_file.zip', 'abc') == {
+        'member_index': 1000
+    }
+    # content changed
+    assert DatafileRegistryModel.get_checkpoint('source1', 'test_file.zip', 'def') is None
+
+    DatafileRegistryModel.get_update_or_create(**{**entry2, 'state': DatafileState.PROCESSED.value})
+    assert DatafileRegistryModel.get_checkpoint('source1', 'test_file.zip') is None
+
+
+def test_get_checkpoint_without_file_name(app_with_db):
+    row, _ = DatafileRegistryModel.get_update_or_create(**entry7)
+    row.save_checkpoint(1)
+    assert DatafileRegistryModel.get_checkpoint('source3', None) is None
+
+    row, _ = DatafileRegistryModel.get_update_or_create(
+        **{**entry7, 'state': DatafileState.FAILED.value}
+    )
+    row.save_checkpoint(2)
+    assert DatafileRegistryModel.get_checkpoint('source3', None) == 2
+
+
+def test_get_last_processed_timestamp(app_with_db):
+    assert DatafileRegistryModel.get_last_processed_timestamp('source1') is None
+    DatafileRegistryModel.get_update_or_create(**entry1)
+    assert DatafileRegistryModel.get_last_processed_timestamp('source1') is None
+
+    row, _ = DatafileRegistryModel.get_update_or_create(**entry3)
+    timestamp = DatafileRegistryModel.get_last_processed_timestamp('source1')
+    assert timestamp == row.created_timestamp
+
+    row, _ = DatafileRegistryModel.get_update_or_create(
+        **{**entry1, 'state': DatafileState.PROCESSED.value}
+    )
+    assert DatafileRegistryModel.get_last_processed_timestamp('source1') > timestamp
+    assert DatafileRegistryModel.get_last_processed_timestamp('source2') is None